@@ -0,0 +1,77 @@
+import time
+from typing import Optional, Union
+
+import httpx
+import jwt
+
+from labfunctions import defaults, types
+from labfunctions.io.memory_store import TTLCache
+
+from .nbclient import NBClient
+
+
+def agent_http_client(**kwargs) -> httpx.Client:
+    """Connections to the server are kept alive between the jobs"""
+    limits = httpx.Limits(keepalive_expiry=defaults.AGENT_HTTP_KEEPALIVE)
+    return httpx.Client(limits=limits, **kwargs)
+
+
+def _token_ttl(access_token: str) -> Optional[float]:
+    """Secs until the token should be refreshed, None if it doesn't expire"""
+    decoded = jwt.decode(access_token, options={"verify_signature": False})
+    exp = decoded.get("exp")
+    if exp is None:
+        return None
+    return exp - time.time() - defaults.AGENT_CREDS_REFRESH_SECS
+
+
+class AgentClient(NBClient):
+    """
+    Client shared by the jobs of an agent. Its http connections are kept
+    alive between jobs, and the private keys and agent tokens of the
+    projects are cached, so a job doesn't wait two round trips to the
+    server before starting its container.
+    A token is asked again `defaults.AGENT_CREDS_REFRESH_SECS` before
+    it expires, private keys after `creds_ttl`.
+    """
+
+    def __init__(
+        self,
+        *args,
+        creds_ttl: int = defaults.AGENT_CREDS_TTL,
+        http_init_func=agent_http_client,
+        **kwargs,
+    ):
+        super().__init__(*args, http_init_func=http_init_func, **kwargs)
+        self._keys = TTLCache(maxsize=defaults.AGENT_CREDS_CACHE, ttl=creds_ttl)
+        self._tokens = TTLCache(maxsize=defaults.AGENT_CREDS_CACHE)
+
+    def projects_private_key(
+        self, projectid: Optional[str] = None, store_key=False
+    ) -> Union[str, None]:
+        projectid = projectid or self.projectid
+        key = self._keys.get(projectid)
+        if key is None:
+            key = super().projects_private_key(projectid, store_key=store_key)
+            self._keys.set(projectid, key)
+        return key
+
+    def projects_agent_token(
+        self, agentname: Optional[str] = None, projectid: Optional[str] = None
+    ) -> Union[types.user.AgentJWTResponse, None]:
+        cache_key = (projectid or self.projectid, agentname)
+        token = self._tokens.get(cache_key)
+        if token is None:
+            token = super().projects_agent_token(agentname, projectid=projectid)
+            if token is None:
+                return None
+            ttl = _token_ttl(token.creds.access_token)
+            if ttl is None or ttl > 0:
+                self._tokens.set(cache_key, token, ttl=ttl)
+        return token
+
+    def invalidate_creds(self, projectid: str):
+        """Forgets the credentials of a project, for instance when
+        they were rotated"""
+        self._keys.delete(projectid)
+        self._tokens.delete_where(lambda k: k[0] == projectid)
@@ -273,14 +273,13 @@ class BaseClient:
                     yield evt
                     buffer_ = ""
 
-    def events_publish(self, execid, data, event=None):
+    def events_publish(self, execid, data, event=None, projectid=None):
+        projectid = projectid or self.projectid
         final = data
         if isinstance(data, dict):
             final = json.dumps(data)
         if final:
             evt = types.events.EventSSE(data=final, event=event)
-            self._http.post(
-                f"/events/{self.projectid}/{execid}/_publish", json=evt.dict()
-            )
+            self._http.post(f"/events/{projectid}/{execid}/_publish", json=evt.dict())
         else:
             self.logger.warning(f"execid: {execid} empty message")
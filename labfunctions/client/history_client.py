@@ -2,11 +2,16 @@ import json
 import logging
 from dataclasses import asdict
 from pathlib import Path
-from typing import Any, Dict, Generator, List, Optional, Union
+from typing import Any, BinaryIO, Dict, Generator, List, Optional, Union
 
 from labfunctions import defaults, errors, secrets, types
 from labfunctions.log import client_logger
-from labfunctions.utils import parse_var_line
+from labfunctions.utils import (
+    binary_file_reader,
+    compressed_file_reader,
+    compressor,
+    parse_var_line,
+)
 
 from .base import BaseClient
 from .utils import get_private_key, store_credentials_disk, store_private_key
@@ -26,6 +31,14 @@ class HistoryClient(BaseClient):
             return True
         return False
 
+    def history_register_batch(self, results: List[types.ExecutionResult]) -> bool:
+        batch = types.ExecutionResultBatch(results=results)
+        rsp = self._http.post(
+            f"/history/_batch",
+            json=batch.dict(),
+        )
+        return rsp.status_code == 201
+
     def history_get_last(
         self, wfid: Optional[str] = None, last=1
     ) -> List[types.HistoryResult]:
@@ -64,30 +77,84 @@ class HistoryClient(BaseClient):
             else:
                 raise errors.HistoryNotebookError(self._addr, uri)
 
-    def history_nb_output(self, exec_result: types.ExecutionResult) -> bool:
-        """Upload the notebook from the execution result
-        TODO: zip or compress notebook before upload.
+    def history_nb_output(
+        self,
+        exec_result: types.ExecutionResult,
+        encoding: str = defaults.OUTPUT_ENCODING,
+    ) -> bool:
+        """Upload the notebook from the execution result,
+        it is compressed while it is streamed from disk.
+        :param encoding: gzip or zstd
         :return: True if ok, False if something fails.
         """
-        form_data = dict(output_name=exec_result.output_name)
-
         file_dir = f"{exec_result.output_dir}/{exec_result.output_name}"
-
-        _addr = f"/history/{exec_result.projectid}/_output_ok"
+        status = "ok"
         if exec_result.error:
-            _addr = f"/history/{exec_result.projectid}/_output_fail"
+            status = "errors"
             file_dir = f"{exec_result.error_dir}/{exec_result.output_name}"
 
-        files = {"file": open(file_dir)}
         rsp = self._http.post(
-            _addr,
-            files=files,
-            data=form_data,
+            f"/history/{exec_result.projectid}/_output",
+            params=dict(output_name=exec_result.output_name, status=status),
+            content=compressed_file_reader(file_dir, encoding=encoding),
+            headers={"Content-Encoding": encoding},
         )
         if rsp.status_code == 201:
             return True
         return False
 
+    def history_blob(self, projectid: str, path: str) -> bool:
+        """Upload a file taken out of an output notebook,
+        see :class:`labfunctions.types.SlimOptions`"""
+        rsp = self._http.post(
+            f"/history/{projectid}/_blobs/{Path(path).name}",
+            content=binary_file_reader(path, chunk_size=defaults.UPLOAD_CHUNK_SIZE),
+        )
+        return rsp.status_code == 201
+
+    def history_checkpoint(
+        self,
+        projectid: str,
+        execid: str,
+        notebook: str,
+        encoding: str = defaults.OUTPUT_ENCODING,
+    ) -> bool:
+        """Upload the notebook of a running execution, see
+        :class:`labfunctions.notebooks.checkpoint.Checkpointer`"""
+        data = notebook.encode("utf-8")
+        comp = compressor(encoding)
+        if comp:
+            data = comp.compress(data) + comp.flush()
+        rsp = self._http.post(
+            f"/history/{projectid}/_checkpoints/{execid}",
+            content=data,
+            headers={"Content-Encoding": encoding},
+        )
+        return rsp.status_code == 201
+
+    def history_get_checkpoint(self, projectid: str, execid: str) -> Optional[str]:
+        """The last checkpoint of an execution, None if there isn't"""
+        rsp = self._http.get(f"/history/{projectid}/_checkpoints/{execid}")
+        if rsp.status_code == 200:
+            return rsp.text
+        return None
+
+    def history_logs(
+        self, projectid: str, execid: str, fileobj: BinaryIO
+    ) -> Union[str, None]:
+        """Upload the gzipped logs of an execution
+        :return: the path of the logs relative to the project
+        """
+        chunks = iter(lambda: fileobj.read(defaults.UPLOAD_CHUNK_SIZE), b"")
+        rsp = self._http.post(
+            f"/history/{projectid}/_logs",
+            params=dict(execid=execid),
+            content=chunks,
+        )
+        if rsp.status_code == 201:
+            return rsp.json()["path"]
+        return None
+
     def task_status(self, execid: str) -> Union[types.TaskStatus, None]:
         rsp = self._http.get(f"/history/{self.projectid}/task/{execid}")
         if rsp.status_code == 200:
@@ -1,5 +1,5 @@
 import os
-from typing import Optional, Union
+from typing import Optional, Type, Union
 
 from labfunctions import defaults, secrets, types
 from labfunctions.conf import load_client
@@ -37,9 +37,15 @@ def from_file(
 
 
 def from_env(
-    settings: Optional[types.ClientSettings] = None, projectid=None
+    settings: Optional[types.ClientSettings] = None,
+    projectid=None,
+    client_class: Type[NBClient] = NBClient,
 ) -> NBClient:
-    """Creates a client using the settings module and environment variables"""
+    """Creates a client using the settings module and environment variables
+
+    :param client_class: NBClient or a subclass like
+    :class:`labfunctions.client.agent_client.AgentClient`
+    """
     settings = settings or load_client()
     # nbvars = secrets.load(settings.BASE_PATH)
     # creds = _load_creds(settings, nbvars)
@@ -48,7 +54,7 @@ def from_env(
         pd.projectid = projectid
 
     lab_state = LabState(pd)
-    c = NBClient(
+    c = client_class(
         url_service=settings.WORKFLOW_SERVICE,
         lab_state=lab_state,
         base_path=os.getenv(defaults.BASE_PATH_ENV),
@@ -14,6 +14,7 @@ from labfunctions.types import (
     HistoryRequest,
     HistoryResult,
     NBTask,
+    NBTaskBatch,
     ProjectData,
     ProjectReq,
     ScheduleData,
@@ -158,6 +159,16 @@ class WorkflowsClient(BaseClient):
 
         return ExecutionNBTask(**rsp.json())
 
+    def notebook_run_batch(self, tasks: List[NBTask]) -> List[ExecutionNBTask]:
+        batch = NBTaskBatch(tasks=tasks)
+        rsp = self._http.post(
+            f"/workflows/{self.projectid}/notebooks/_run_batch", json=batch.dict()
+        )
+        if rsp.status_code != 202:
+            raise AttributeError(rsp.text)
+
+        return [ExecutionNBTask(**r) for r in rsp.json()["rows"]]
+
     def build_context(
         self,
         wfid: str,
@@ -5,6 +5,7 @@ import sys
 import click
 from rich.logging import RichHandler
 
+from labfunctions import defaults
 from labfunctions.conf.server_settings import settings
 
 # from labfunctions.control_plane import rqscheduler
@@ -56,8 +57,77 @@ def agentcli():
     default=False,
     help="Debug log",
 )
+@click.option(
+    "--warm-pool",
+    default=0,
+    help="Containers kept ready by runtime, it saves their startup",
+)
+@click.option(
+    "--warm-max-runs",
+    default=defaults.WARM_MAX_RUNS,
+    help="Tasks executed by a warm container before replacing it",
+)
+@click.option(
+    "--warm-max-mem",
+    default=None,
+    type=int,
+    help="Replace a warm container when its memory in MB is over this value",
+)
+@click.option(
+    "--admission",
+    is_flag=True,
+    default=False,
+    help="Tasks wait until the cpus and memory they request are free",
+)
+@click.option(
+    "--max-cpus",
+    default=None,
+    type=float,
+    help="Cpus for tasks with --admission, all by default",
+)
+@click.option(
+    "--max-mem",
+    default=None,
+    type=int,
+    help="Memory in MB for tasks with --admission, all by default",
+)
+@click.option(
+    "--prepull",
+    is_flag=True,
+    default=False,
+    help="Pull the images of new runtimes ahead",
+)
+@click.option(
+    "--max-images",
+    default=defaults.AGENT_MAX_IMAGES,
+    help="Runtime images kept with --prepull, the least used are removed",
+)
+@click.option(
+    "--max-images-disk",
+    default=None,
+    type=int,
+    help="Disk in MB for runtime images with --prepull",
+)
 @click.option("--machine-id", "-m", default=f"localhost/ba/{hostname}")
-def runcli(redis, workers, qnames, cluster, ip_address, agent_name, machine_id, debug):
+def runcli(
+    redis,
+    workers,
+    qnames,
+    cluster,
+    ip_address,
+    agent_name,
+    machine_id,
+    debug,
+    warm_pool,
+    warm_max_runs,
+    warm_max_mem,
+    admission,
+    max_cpus,
+    max_mem,
+    prepull,
+    max_images,
+    max_images_disk,
+):
     """Run the agent"""
     # pylint: disable=import-outside-toplevel
     # from labfunctions.control_plane import agent
@@ -88,6 +158,15 @@ def runcli(redis, workers, qnames, cluster, ip_address, agent_name, machine_id,
         heartbeat_check_every=settings.AGENT_HEARTBEAT_CHECK,
         agent_name=agent_name,
         workers_n=workers,
+        warm_pool=warm_pool,
+        warm_max_runs=warm_max_runs,
+        warm_max_mem_mb=warm_max_mem,
+        admission=admission,
+        max_cpus=max_cpus,
+        max_mem_mb=max_mem,
+        prepull=prepull,
+        max_images=max_images,
+        max_images_mb=max_images_disk,
     )
 
     agent.run(conf)
@@ -11,7 +11,9 @@ from labfunctions.conf import load_client
 from labfunctions.context import create_dummy_ctx
 from labfunctions.executors import jupyter_exec
 from labfunctions.executors.docker_exec import docker_exec
+from labfunctions.executors.kernel_pool import KernelPool
 from labfunctions.executors.local_exec import local_exec_env
+from labfunctions.executors.warm_exec import warm_exec_serve
 from labfunctions.hashes import generate_random
 from labfunctions.types import NBTask
 
@@ -56,7 +58,9 @@ def local(from_file, url_service, local, wfid):
     """Used by the agent to run workloads or for development purposes"""
     rsp = None
 
-    if os.environ.get(defaults.EXECUTIONTASK_VAR):
+    if os.environ.get(defaults.EXECUTIONTASK_VAR) or os.environ.get(
+        defaults.EXECUTIONTASK_FILE_VAR
+    ):
 
         nbclient = client.from_env()
         console.print(f"=> Starting work inside container")
@@ -86,6 +90,44 @@ def local(from_file, url_service, local, wfid):
         console.print(f"=>[bold green] WFID: {rsp.wfid} locally executed[/]")
 
 
+@executorscli.command()
+@click.option("--socket", "-s", required=True, help="Unix socket to listen to")
+@click.option(
+    "--max-runs",
+    "-m",
+    default=defaults.WARM_MAX_RUNS,
+    help="Exit after this number of tasks",
+)
+@click.option(
+    "--idle-secs",
+    "-i",
+    default=defaults.WARM_IDLE_SECS,
+    help="Exit if no task arrives in this time",
+)
+@click.option(
+    "--kernels",
+    "-k",
+    default=1,
+    help="Idle Jupyter kernels kept for tasks with kernel_reuse",
+)
+@click.option(
+    "--kernel-max-runs",
+    default=defaults.KERNEL_MAX_RUNS,
+    help="Replace a kernel after this number of tasks",
+)
+@click.option(
+    "--kernel-max-rss",
+    default=None,
+    type=int,
+    help="Replace a kernel if it uses more than this memory in MB",
+)
+def warm(socket, max_runs, idle_secs, kernels, kernel_max_runs, kernel_max_rss):
+    """Used by the agent to keep a warm container waiting for tasks"""
+    console.print(f"=> Warm executor listening on {socket}")
+    pool = KernelPool(size=kernels, max_runs=kernel_max_runs, max_rss_mb=kernel_max_rss)
+    warm_exec_serve(socket, max_runs=max_runs, idle_secs=idle_secs, kernels=pool)
+
+
 # @executorscli.command()
 # @click.option(
 #     "--from-file",
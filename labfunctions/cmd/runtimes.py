@@ -173,7 +173,7 @@ def build(
             PROJECTS_STORE_CLASS,
             PROJECTS_STORE_BUCKET,
         )
-        kv.put_stream(ctx.download_zip, kv.from_file_gen(zfile.filepath))
+        kv.put_file(ctx.download_zip, zfile.filepath)
         with progress:
             task = progress.add_task(
                 f" Building docker image for {name}", start=False, total=1
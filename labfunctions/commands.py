@@ -1,16 +1,24 @@
+import asyncio
+import codecs
+import inspect
 import json
 import logging
 import os
 import shlex
+import struct
 import subprocess
 import sys
+import time
+from collections import deque
 from datetime import datetime
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple, Union
 
+import httpx
 from pydantic import BaseModel
 
 import docker
-from labfunctions import log
+from labfunctions import defaults, log
+from labfunctions.errors.generics import DockerAPIError
 from labfunctions.types.docker import (
     DockerBuildLog,
     DockerBuildLowLog,
@@ -113,14 +121,27 @@ class DockerCommand:
         self.docker = docker_client or docker.from_env()
 
     def _wait_result(
-        self, container: docker.models.containers.Container, timeout: int
+        self,
+        container: docker.models.containers.Container,
+        timeout: int,
+        should_stop: Optional[Callable[[], bool]] = None,
+        poll_secs: int = 5,
     ) -> Union[Dict[str, Any], None]:
-        result = None
-        try:
-            result = container.wait(timeout=timeout)
-        except Exception:
-            pass
-        return result
+        """It waits for the container, if `should_stop` is provided
+        it will be checked each `poll_secs`, returning None when True"""
+        if not should_stop:
+            poll_secs = timeout
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            try:
+                return container.wait(timeout=min(poll_secs, remaining))
+            except Exception:
+                pass
+            if should_stop and should_stop():
+                return None
 
     def run(
         self,
@@ -135,7 +156,12 @@ class DockerCommand:
         ports=None,
         resources=DockerResources(),
         volumes: List[DockerVolume] = [],
+        should_stop: Optional[Callable[[], bool]] = None,
     ) -> DockerRunResult:
+        """
+        :param should_stop: optional callable checked while the container
+        runs, if it returns True the container is killed.
+        """
 
         runtime = None
         if require_gpu:
@@ -152,14 +178,19 @@ class DockerCommand:
                 environment=env_data,
                 network_mode=network_mode,
                 ports=ports,
+                volumes=[f"{v.orig_mount}:{v.dst_mount}" for v in volumes],
                 **resources.dict(),
             )
-            result = self._wait_result(container, timeout)
+            result = self._wait_result(container, timeout, should_stop)
             if not result:
                 container.kill()
             else:
                 status_code = result["StatusCode"]
-            logs = container.logs().decode("utf-8")
+            tail = LogTail(defaults.EXEC_LOGS_TAIL)
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            for chunk in container.logs(stream=True):
+                tail.write(decoder.decode(chunk))
+            logs = tail.text()
             if remove:
                 container.remove()
         except docker.errors.ContainerError as e:
@@ -221,3 +252,315 @@ class DockerCommand:
             push_log_str = str(e)
 
         return DockerPushLog(logs=push_log_str, error=error)
+
+
+class LogTail:
+    def __init__(self, max_chars: int = defaults.EXEC_LOGS_TAIL):
+        """Keeps only the last `max_chars` of a stream of logs"""
+        self.max_chars = max_chars
+        self.size = 0
+        self._chunks: Deque[str] = deque()
+
+    def write(self, chunk: str):
+        self._chunks.append(chunk)
+        self.size += len(chunk)
+        while self.size > self.max_chars and len(self._chunks) > 1:
+            self.size -= len(self._chunks.popleft())
+
+    def text(self) -> str:
+        return "".join(self._chunks)[-self.max_chars :]
+
+
+def demux_docker_stream(buffer: bytearray) -> Tuple[List[bytes], bytearray]:
+    """
+    Docker multiplexes stdout and stderr of containers without tty in frames
+    of an 8 bytes header (stream, 0, 0, 0, size uint32) plus the payload.
+    :return: the payload of the complete frames and the bytes left.
+    """
+    frames = []
+    while len(buffer) >= 8:
+        size = struct.unpack(">I", buffer[4:8])[0]
+        if len(buffer) < 8 + size:
+            break
+        frames.append(bytes(buffer[8 : 8 + size]))
+        del buffer[: 8 + size]
+    return frames, buffer
+
+
+def docker_http_client() -> httpx.AsyncClient:
+    """An async client to the docker engine API configured from DOCKER_HOST"""
+    host = os.getenv("DOCKER_HOST", "unix:///var/run/docker.sock")
+    if host.startswith("unix://"):
+        transport = httpx.AsyncHTTPTransport(uds=host[len("unix://") :])
+        return httpx.AsyncClient(
+            base_url="http://docker", transport=transport, timeout=None
+        )
+    return httpx.AsyncClient(base_url=host.replace("tcp://", "http://"), timeout=None)
+
+
+def _registry_auth(image: str) -> Dict[str, str]:
+    repo, _ = docker.utils.parse_repository_tag(image)
+    registry, _ = docker.auth.resolve_repository_name(repo)
+    authcfg = docker.auth.resolve_authconfig(docker.auth.load_config(), registry)
+    if not authcfg:
+        return {}
+    return {"X-Registry-Auth": docker.auth.encode_header(authcfg).decode()}
+
+
+async def _maybe_await(value):
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+
+class AsyncDockerCommand:
+    def __init__(
+        self,
+        client: Optional[httpx.AsyncClient] = None,
+        max_log_chars: int = defaults.EXEC_LOGS_TAIL,
+        poll_secs: int = 5,
+    ):
+        """
+        Asyncio version of :meth:`DockerCommand.run` talking directly with
+        the docker engine API, so a single event loop can supervise many
+        containers. Logs are streamed while the container runs, only the
+        last `max_log_chars` are kept for the result.
+
+        :param client: a http client to docker, see :func:`docker_http_client`
+        :param max_log_chars: chars of logs returned in the DockerRunResult
+        :param poll_secs: how often `should_stop` is checked
+        """
+        self.client = client or docker_http_client()
+        self.max_log_chars = max_log_chars
+        self.poll_secs = poll_secs
+
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        rsp = await self.client.request(method, url, **kwargs)
+        if rsp.status_code >= 400:
+            raise DockerAPIError(rsp.status_code, rsp.text)
+        return rsp
+
+    async def pull(self, image: str):
+        async with self.client.stream(
+            "POST",
+            "/images/create",
+            params={"fromImage": image},
+            headers=_registry_auth(image),
+        ) as rsp:
+            if rsp.status_code >= 400:
+                body = await rsp.aread()
+                raise DockerAPIError(rsp.status_code, body.decode())
+            # errors after the pull started are reported in the progress stream
+            async for line in rsp.aiter_lines():
+                if '"error"' in line:
+                    raise DockerAPIError(rsp.status_code, line)
+
+    async def images(self) -> List[Dict[str, Any]]:
+        """Local images, as returned by the docker engine"""
+        rsp = await self._request("GET", "/images/json")
+        return rsp.json()
+
+    async def image_size(self, image: str) -> int:
+        rsp = await self._request("GET", f"/images/{image}/json")
+        return rsp.json().get("Size", 0)
+
+    async def remove_image(self, image: str):
+        await self._request("DELETE", f"/images/{image}")
+
+    async def create(self, config: Dict[str, Any]) -> str:
+        try:
+            rsp = await self._request("POST", "/containers/create", json=config)
+        except DockerAPIError as e:
+            if e.status_code != 404:
+                raise
+            await self.pull(config["Image"])
+            rsp = await self._request("POST", "/containers/create", json=config)
+        return rsp.json()["Id"]
+
+    async def kill(self, cid: str):
+        try:
+            await self._request("POST", f"/containers/{cid}/kill")
+        except DockerAPIError as e:
+            # 409: the container is not running anymore
+            if e.status_code != 409:
+                raise
+
+    async def remove(self, cid: str):
+        await self._request("DELETE", f"/containers/{cid}", params={"force": "true"})
+
+    async def follow_logs(
+        self,
+        cid: str,
+        tail: Optional[LogTail],
+        on_log: Optional[Callable[[str], Any]] = None,
+        since: Optional[int] = None,
+    ):
+        """Streams stdout and stderr of a container until it stops
+        :param since: only logs from this unix timestamp
+        """
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        buffer = bytearray()
+        params = {"follow": "true", "stdout": "true", "stderr": "true"}
+        if since:
+            params["since"] = str(since)
+        async with self.client.stream(
+            "GET", f"/containers/{cid}/logs", params=params
+        ) as rsp:
+            async for chunk in rsp.aiter_bytes():
+                buffer.extend(chunk)
+                frames, buffer = demux_docker_stream(buffer)
+                for frame in frames:
+                    text = decoder.decode(frame)
+                    if tail:
+                        tail.write(text)
+                    if on_log:
+                        await _maybe_await(on_log(text))
+
+    async def _wait_result(
+        self,
+        cid: str,
+        timeout: int,
+        should_stop: Optional[Callable[[], Any]] = None,
+    ) -> Union[Dict[str, Any], None]:
+        waiter = asyncio.ensure_future(self._request("POST", f"/containers/{cid}/wait"))
+        poll_secs = self.poll_secs if should_stop else timeout
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        try:
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return None
+                done, _ = await asyncio.wait(
+                    {waiter}, timeout=min(poll_secs, remaining)
+                )
+                if done:
+                    return waiter.result().json()
+                if should_stop and await _maybe_await(should_stop()):
+                    return None
+        except Exception:
+            return None
+        finally:
+            waiter.cancel()
+
+    @staticmethod
+    def container_config(
+        cmd: str,
+        image: str,
+        *,
+        env_data: Dict[str, Any] = {},
+        require_gpu: bool = False,
+        network_mode: str = "bridge",
+        ports: Optional[Dict[str, int]] = None,
+        resources=DockerResources(),
+        volumes: List[DockerVolume] = [],
+        auto_remove: bool = False,
+    ) -> Dict[str, Any]:
+        """Body of a container creation for the docker engine API"""
+        host_config: Dict[str, Any] = {
+            "NetworkMode": network_mode,
+            "AutoRemove": auto_remove,
+        }
+        if require_gpu:
+            host_config["Runtime"] = "nvidia"
+        if resources.mem_limit:
+            host_config["Memory"] = resources.mem_limit
+        if resources.mem_reservation:
+            host_config["MemoryReservation"] = resources.mem_reservation
+        if resources.nano_cpus:
+            host_config["NanoCpus"] = resources.nano_cpus
+        if volumes:
+            host_config["Binds"] = [f"{v.orig_mount}:{v.dst_mount}" for v in volumes]
+        if ports:
+            host_config["PortBindings"] = {
+                k: [{"HostPort": str(v)}] for k, v in ports.items()
+            }
+        return {
+            "Image": image,
+            "Cmd": shlex.split(cmd),
+            "Env": [f"{k}={v}" for k, v in env_data.items()],
+            "ExposedPorts": {k: {} for k in (ports or {})},
+            "HostConfig": host_config,
+        }
+
+    async def start(self, cmd: str, image: str, **kwargs) -> str:
+        """Starts a container without waiting for it,
+        kwargs are the same than :meth:`container_config`
+        :return: the id of the container
+        """
+        cid = await self.create(self.container_config(cmd, image, **kwargs))
+        await self._request("POST", f"/containers/{cid}/start")
+        return cid
+
+    async def memory_usage(self, cid: str) -> int:
+        """Memory used by a container in bytes"""
+        rsp = await self._request(
+            "GET", f"/containers/{cid}/stats", params={"stream": "false"}
+        )
+        return rsp.json().get("memory_stats", {}).get("usage", 0)
+
+    async def run(
+        self,
+        cmd: str,
+        image: str,
+        *,
+        timeout: int = 120,
+        env_data: Dict[str, Any] = {},
+        remove: bool = True,
+        require_gpu: bool = False,
+        network_mode: str = "bridge",
+        ports: Optional[Dict[str, int]] = None,
+        resources=DockerResources(),
+        volumes: List[DockerVolume] = [],
+        should_stop: Optional[Callable[[], Any]] = None,
+        on_log: Optional[Callable[[str], Any]] = None,
+    ) -> DockerRunResult:
+        """
+        Same params than :meth:`DockerCommand.run`, `should_stop` and
+        `on_log` could be sync or async callables.
+
+        :param on_log: it receives each chunk of logs of the container.
+        :return: a container killed at its timeout has the status
+        `defaults.EXEC_TIMEOUT_STATUS`.
+        """
+        tail = LogTail(self.max_log_chars)
+        status_code = -1
+        cid = None
+        logs = None
+        try:
+            cid = await self.start(
+                cmd,
+                image,
+                env_data=env_data,
+                require_gpu=require_gpu,
+                network_mode=network_mode,
+                ports=ports,
+                resources=resources,
+                volumes=volumes,
+            )
+            logs = asyncio.ensure_future(self.follow_logs(cid, tail, on_log))
+            deadline = asyncio.get_running_loop().time() + timeout
+            result = await self._wait_result(cid, timeout, should_stop)
+            if not result:
+                await self.kill(cid)
+                if asyncio.get_running_loop().time() >= deadline:
+                    status_code = defaults.EXEC_TIMEOUT_STATUS
+            else:
+                status_code = result["StatusCode"]
+            # the last lines of the logs after the container stopped
+            await asyncio.wait({logs}, timeout=self.poll_secs)
+        except (DockerAPIError, httpx.HTTPError) as e:
+            log.error_logger.error(str(e))
+            tail.write(str(e))
+            status_code = -3
+        finally:
+            if logs:
+                logs.cancel()
+                # errors following the logs don't change the result
+                await asyncio.gather(logs, return_exceptions=True)
+            if cid and remove:
+                try:
+                    await self.remove(cid)
+                except (DockerAPIError, httpx.HTTPError) as e:
+                    log.error_logger.error(str(e))
+        return DockerRunResult(msg=tail.text(), status=status_code)
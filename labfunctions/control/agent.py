@@ -11,6 +11,13 @@ from libq.scheduler import Scheduler
 # from .worker import start_worker
 from libq.worker import AsyncWorker
 
+from labfunctions.control.tasks import init_queue_conn
+from labfunctions.executors.docker_exec import (
+    init_admission,
+    init_agent_client,
+    init_image_cache,
+    init_warm_pool,
+)
 from labfunctions.hashes import generate_random
 from labfunctions.redis_conn import create_pool
 from labfunctions.types import ServerSettings
@@ -38,6 +45,12 @@ def run(conf: AgentConfig):
     :param name: a custom name for this worker
     :param ip_address: the ip as worker that will advertise to Redis.
     :param workers_n: how many worker to run
+    :param warm_pool: containers kept ready by project and runtime, 0 disables it.
+    :param admission: tasks wait for the cpus and memory they request,
+    `max_cpus` and `max_mem_mb` limit the capacity of the machine.
+    :param prepull: pulls the images of new runtimes ahead and keeps
+    up to `max_images` (or `max_images_mb`), they are advertised in the
+    `images` of the AgentNode.
     """
 
     name = conf.agent_name or conf.machine_id.rsplit("/", maxsplit=1)[1]
@@ -56,6 +69,21 @@ def run(conf: AgentConfig):
         workers=[],
         birthday=_now,
     )
+    init_agent_client()
+    init_queue_conn(conn)
+    if conf.warm_pool:
+        init_warm_pool(
+            conf.warm_pool,
+            max_runs=conf.warm_max_runs,
+            max_mem_mb=conf.warm_max_mem_mb,
+        )
+    if conf.admission:
+        init_admission(conf.max_cpus, conf.max_mem_mb)
+    metadata = node.dict()
+    images = None
+    if conf.prepull:
+        images = init_image_cache(conf.max_images, max_disk_mb=conf.max_images_mb)
+        images.advertise(metadata)
     store = RedisJobStore()
     scheduler = Scheduler(store, conn=conn)
     worker = AsyncWorker(
@@ -63,8 +91,10 @@ def run(conf: AgentConfig):
         conn=conn,
         id=name,
         heartbeat_secs=conf.heartbeat_check_every,
-        metadata=node.dict(),
+        metadata=metadata,
         max_jobs=conf.workers_n,
     )
+    if images:
+        worker.create_task("images", images.listen(conn))
 
     worker.run()
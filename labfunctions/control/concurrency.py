@@ -0,0 +1,106 @@
+from typing import Optional, Tuple
+
+from redis.asyncio import Redis
+
+# KEYS[1] running key, KEYS[2] waiting key, KEYS[3] parked key
+# ARGV[1] execid, ARGV[2] policy, ARGV[3] ttl, ARGV[4] data of the run
+_ACQUIRE_SCRIPT = """
+local running = redis.call('GET', KEYS[1])
+if not running then
+    redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[3])
+    return {'run', ''}
+end
+if ARGV[2] == 'replace' then
+    redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[3])
+    return {'replace', running}
+end
+if ARGV[2] == 'queue-one' then
+    if redis.call('SET', KEYS[2], ARGV[1], 'NX', 'EX', ARGV[3] * 2) then
+        redis.call('SET', KEYS[3], ARGV[4], 'EX', ARGV[3] * 2)
+        return {'queued', running}
+    end
+end
+return {'skip', running}
+"""
+
+# the parked run, if any, takes the lock when it is released
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return false
+end
+local waiting = redis.call('GET', KEYS[2])
+local data = redis.call('GET', KEYS[3])
+redis.call('DEL', KEYS[2], KEYS[3])
+if waiting and data then
+    redis.call('SET', KEYS[1], waiting, 'EX', ARGV[2])
+    return data
+end
+redis.call('DEL', KEYS[1])
+return false
+"""
+
+
+class WorkflowLock:
+    prefix = "lab:wf"
+
+    def __init__(self, conn: Redis, wfid: str, ttl: int):
+        """
+        It enforces the concurrency policy of a scheduled workflow
+        (see :class:`labfunctions.types.ScheduleData`) using redis,
+        so it is shared by every agent.
+
+        A run queued by the "queue-one" policy doesn't wait in a worker,
+        it is parked in redis and it takes the lock when the running one
+        releases it, then the releaser enqueues it again.
+
+        :param conn: a redis client with decode_responses
+        :param wfid: workflow id
+        :param ttl: secs that a run could hold the lock, usually the
+        timeout of the task plus a margin. A parked run is dropped
+        after twice this time.
+        """
+        self.conn = conn
+        self.wfid = wfid
+        self.ttl = ttl
+        self._acquire = conn.register_script(_ACQUIRE_SCRIPT)
+        self._release = conn.register_script(_RELEASE_SCRIPT)
+
+    @property
+    def running_key(self) -> str:
+        return f"{self.prefix}:{self.wfid}:running"
+
+    @property
+    def waiting_key(self) -> str:
+        return f"{self.prefix}:{self.wfid}:waiting"
+
+    @property
+    def parked_key(self) -> str:
+        return f"{self.prefix}:{self.wfid}:parked"
+
+    @property
+    def _keys(self):
+        return [self.running_key, self.waiting_key, self.parked_key]
+
+    async def acquire(
+        self, execid: str, policy: str, data: str = ""
+    ) -> Tuple[str, str]:
+        """
+        :param data: what is needed to enqueue the run again if it is parked
+        :return: the action to take ("run", "replace", "queued" or "skip")
+        and the execid of the run holding the lock, if any.
+        """
+        action, running = await self._acquire(
+            keys=self._keys, args=[execid, policy, self.ttl, data]
+        )
+        return action, running
+
+    async def lost(self, execid: str) -> bool:
+        """True if the run was replaced by another one"""
+        return await self.conn.get(self.running_key) != execid
+
+    async def release(self, execid: str) -> Optional[str]:
+        """
+        :return: the data of the parked run, which holds the lock now
+        and should be enqueued again.
+        """
+        return await self._release(keys=self._keys, args=[execid, self.ttl])
@@ -0,0 +1,174 @@
+import asyncio
+from typing import Any, Dict, List, Optional
+
+from redis.asyncio import ConnectionPool
+
+from labfunctions import defaults, log
+
+from .queues import QueuePool
+
+# Feeds the queue consumed by the agents (KEYS[1]) up to ARGV[1] jobs
+# in one atomic step, so several servers dispatching the same queue
+# can't exceed it. Priority levels from 0 to ARGV[2] - 1 are served
+# in order; inside of a level the projects are sorted and rotated by
+# a cursor kept in the hash KEYS[2], shared by all the servers, and
+# each project moves up to its weight (ARGV[4..] as projectid, weight
+# pairs, 1 by default) in each round.
+# Pending lists and projects sets are named from ARGV[3] like
+# FairShareQueue.pending_key and FairShareQueue.projects_key.
+# A project is removed from its set when its pending list is empty,
+# in the same step, so a concurrent push can't be lost.
+_DISPATCH_SCRIPT = """
+local room = tonumber(ARGV[1]) - redis.call('LLEN', KEYS[1])
+local weights = {}
+for i = 4, #ARGV, 2 do
+    weights[ARGV[i]] = tonumber(ARGV[i + 1])
+end
+local moved = 0
+for level = 0, tonumber(ARGV[2]) - 1 do
+    if room <= 0 then break end
+    local projects_key = ARGV[3] .. ':' .. level .. ':projects'
+    local projects = redis.call('SMEMBERS', projects_key)
+    if #projects > 0 then
+        table.sort(projects)
+        local cursor = redis.call('HINCRBY', KEYS[2], level, 1) - 1
+        local order = {}
+        for i = 1, #projects do
+            order[i] = projects[(cursor + i - 1) % #projects + 1]
+        end
+        while room > 0 and #order > 0 do
+            local keep = {}
+            for _, projectid in ipairs(order) do
+                if room <= 0 then break end
+                local pending = ARGV[3] .. ':' .. level .. ':' .. projectid
+                local take = math.min(weights[projectid] or 1, room)
+                local n = 0
+                while n < take do
+                    local id = redis.call('LPOP', pending)
+                    if not id then break end
+                    redis.call('RPUSH', KEYS[1], id)
+                    n = n + 1
+                end
+                if redis.call('LLEN', pending) == 0 then
+                    redis.call('SREM', projects_key, projectid)
+                elseif n == take then
+                    table.insert(keep, projectid)
+                end
+                room = room - n
+                moved = moved + n
+            end
+            order = keep
+        end
+    end
+end
+return moved
+"""
+
+
+class FairShareQueue:
+    prefix = "lab:fs"
+
+    def __init__(
+        self,
+        conn: ConnectionPool,
+        queues: QueuePool,
+        *,
+        weights: Optional[Dict[str, int]] = None,
+        max_depth: int = 10,
+        wait_ttl: int = 60 * 60 * 24,
+        levels: int = defaults.PRIORITY_LEVELS,
+    ):
+        """
+        Jobs are kept in a pending list by queue, priority and project,
+        instead of going directly to the queue listened by the agents.
+        :meth:`dispatch` feeds that queue, keeping it no deeper than
+        `max_depth`: higher priorities are moved first and inside
+        of a priority level projects are served in a weighted round robin,
+        so a project with thousands of pending notebooks doesn't starve
+        the others.
+
+        :param conn: redis connection
+        :param queues: pool of queues shared with the SchedulerExec
+        :param weights: projectid -> weight, how many jobs a project can move
+        in each round. By default 1.
+        :param max_depth: max number of jobs waiting in the agents queue
+        :param wait_ttl: secs that a job could wait to be dispatched
+        :param levels: priority levels, 0 is the highest.
+        """
+        self.conn = conn
+        self.queues = queues
+        self.weights = weights or {}
+        self.max_depth = max_depth
+        self.wait_ttl = wait_ttl
+        self.levels = levels
+        self._dispatch = self.conn.register_script(_DISPATCH_SCRIPT)
+
+    @property
+    def queues_key(self) -> str:
+        return f"{self.prefix}:queues"
+
+    def cursors_key(self, qname: str) -> str:
+        return f"{self.prefix}:{qname}:cursors"
+
+    def projects_key(self, qname: str, priority: int) -> str:
+        return f"{self.prefix}:{qname}:{priority}:projects"
+
+    def pending_key(self, qname: str, priority: int, projectid: str) -> str:
+        return f"{self.prefix}:{qname}:{priority}:{projectid}"
+
+    def level(self, priority: int) -> int:
+        return min(max(priority, 0), self.levels - 1)
+
+    def push(self, pipe, qname: str, projectid: str, execid: str, priority: int):
+        """Adds the push of a job already stored by libq to a redis pipeline"""
+        level = self.level(priority)
+        pipe.rpush(self.pending_key(qname, level, projectid), execid)
+        pipe.sadd(self.projects_key(qname, level), projectid)
+        pipe.sadd(self.queues_key, qname)
+
+    async def dispatch(self, qname: str) -> int:
+        """Moves pending jobs to the queue of the agents,
+        see _DISPATCH_SCRIPT.
+        :return: number of jobs moved.
+        """
+        Q = self.queues.get(qname)
+        args: List[Any] = [self.max_depth, self.levels, f"{self.prefix}:{qname}"]
+        for projectid, weight in self.weights.items():
+            args.extend([projectid, weight])
+        return await self._dispatch(keys=[Q.name, self.cursors_key(qname)], args=args)
+
+    async def dispatch_all(self) -> int:
+        moved = 0
+        for qname in await self.conn.smembers(self.queues_key):
+            moved += await self.dispatch(qname)
+        return moved
+
+    async def run(self, every_secs: float = 1.0):
+        """It runs forever, to be used as a background task of the server"""
+        while True:
+            try:
+                await self.dispatch_all()
+            except Exception as e:
+                log.server_logger.error(f"Fair share dispatch failed: {e}")
+            await asyncio.sleep(every_secs)
+
+    async def depth(
+        self, projectid: Optional[str] = None
+    ) -> Dict[str, Dict[int, Dict[str, int]]]:
+        """
+        Pending jobs by queue, priority level and project
+        :param projectid: if provided, only for this project
+        """
+        depth: Dict[str, Dict[int, Dict[str, int]]] = {}
+        for qname in sorted(await self.conn.smembers(self.queues_key)):
+            depth[qname] = {}
+            for level in range(self.levels):
+                if projectid:
+                    projects = [projectid]
+                else:
+                    projects = await self.conn.smembers(self.projects_key(qname, level))
+                depth[qname][level] = {
+                    p: await self.conn.llen(self.pending_key(qname, level, p))
+                    for p in sorted(projects)
+                }
+        return depth
@@ -0,0 +1,40 @@
+from typing import Any, Dict
+
+from libq import Queue
+from redis.asyncio import ConnectionPool
+
+from labfunctions.io.memory_store import TTLCache
+
+
+class QueuePool:
+    def __init__(
+        self, conn: ConnectionPool, maxsize=256, idle_secs=60 * 10, **queue_opts
+    ):
+        """
+        A bounded registry of :class:`libq.Queue` objects keyed by name,
+        to avoid building a new queue for each request.
+        Queues not used for `idle_secs` are evicted.
+
+        :param conn: redis connection shared by every queue
+        :param maxsize: max number of queues kept, the least recently used is
+        evicted first.
+        :param idle_secs: time in secs since last usage to evict a queue
+        :param queue_opts: extra params passed to :class:`libq.Queue`
+        """
+        self.conn = conn
+        self._opts: Dict[str, Any] = queue_opts
+        self._queues = TTLCache(maxsize=maxsize, ttl=idle_secs)
+
+    def get(self, qname: str) -> Queue:
+        Q = self._queues.get(qname)
+        if not Q:
+            Q = Queue(qname, conn=self.conn, **self._opts)
+        # refresh the idle time
+        self._queues.set(qname, Q)
+        return Q
+
+    def stats(self) -> Dict[str, int]:
+        return self._queues.stats()
+
+    def __len__(self) -> int:
+        return len(self._queues)
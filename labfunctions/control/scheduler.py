@@ -1,16 +1,24 @@
-from typing import Optional, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 from libq import JobStoreSpec, Queue, RedisJobStore, Scheduler, create_pool
 from libq.errors import JobNotFound
 from libq.jobs import Job
+from libq.types import JobPayload, JobStatus, Prefixes
+from libq.utils import now_secs
 from redis.asyncio import ConnectionPool
 
 from labfunctions import conf, defaults, types
 from labfunctions.cluster2 import CreateRequest, DestroyRequest
 from labfunctions.executors import ExecID
 from labfunctions.managers import runtimes_mg, workflows_mg
-from labfunctions.notebooks import create_notebook_ctx
+from labfunctions.notebooks import create_notebook_ctx, ctx2wire, job_timeout
 from labfunctions.runtimes.context import create_build_ctx
+from labfunctions.types.runtimes import RuntimeData
+
+from .fairshare import FairShareQueue
+from .queues import QueuePool
+
+RuntimeKey = Tuple[str, Optional[str]]
 
 
 async def create_task_ctx(
@@ -27,6 +35,35 @@ async def create_task_ctx(
     return nb_ctx
 
 
+async def resolve_runtimes(
+    session, projectid: str, tasks: List[types.NBTask]
+) -> Dict[RuntimeKey, Union[RuntimeData, None]]:
+    """It queries each distinct (runtime, version) pair only once"""
+    runtimes: Dict[RuntimeKey, Union[RuntimeData, None]] = {}
+    for task in tasks:
+        key = (task.runtime, task.version)
+        if task.runtime and key not in runtimes:
+            runtimes[key] = await runtimes_mg.get_runtime(
+                session, projectid, task.runtime, task.version
+            )
+    return runtimes
+
+
+async def create_tasks_ctx(
+    session, projectid: str, tasks: List[types.NBTask], prefix=None
+) -> List[types.ExecutionNBTask]:
+    """Batch version of :func:`create_task_ctx`"""
+    runtimes = await resolve_runtimes(session, projectid, tasks)
+    ctxs = []
+    for task in tasks:
+        execid = str(ExecID(prefix=prefix))
+        runtime = runtimes.get((task.runtime, task.version))
+        ctxs.append(
+            create_notebook_ctx(projectid, task, execid=execid, runtime=runtime)
+        )
+    return ctxs
+
+
 class JobManager:
     """
     Manage periodic tasks like Workflows
@@ -56,10 +93,12 @@ class JobManager:
             self.tasks["workflow"],
             queue=qname,
             jobid=wd.wfid,
-            params={"data": ctx.dict()},
+            params={
+                "data": ctx2wire(ctx),
+                "concurrency": wd.schedule.concurrency,
+            },
             interval=wd.schedule.interval,
             cron=wd.schedule.cron,
-            background=True,
             repeat=wd.schedule.repeat,
         )
         await self.enqueue_job(wd.wfid)
@@ -87,6 +126,8 @@ class SchedulerExec:
     between the different control plane components.
     """
 
+    # only the build runs in the process pool of the worker (background),
+    # the other tasks are coroutines awaited in the loop of the worker
     tasks = {
         "notebook": "labfunctions.control.tasks.notebook_dispatcher",
         "build": "labfunctions.control.tasks.build_dispatcher",
@@ -102,8 +143,17 @@ class SchedulerExec:
         build_queue=defaults.BUILD_QUEUE,
         build_timeout="1h",
         settings: types.ServerSettings = None,
+        queues_maxsize=256,
+        queues_idle_secs=60 * 10,
+        fairshare_opts: Optional[Dict[str, Any]] = None,
     ):
         self.conn = conn or create_pool()
+        self.queues = QueuePool(
+            self.conn, maxsize=queues_maxsize, idle_secs=queues_idle_secs
+        )
+        self.fairshare: Optional[FairShareQueue] = None
+        if fairshare_opts is not None:
+            self.fairshare = FairShareQueue(self.conn, self.queues, **fairshare_opts)
 
         self.control_q = Queue(control_queue, conn=self.conn, queue_wait_ttl=60 * 15)
         self.build_q = Queue(build_queue, conn=self.conn)
@@ -122,19 +172,76 @@ class SchedulerExec:
     ) -> types.ExecutionNBTask:
 
         nb_ctx = await create_task_ctx(session, projectid, task, prefix=prefix)
-
-        qname = f"{nb_ctx.cluster}.{nb_ctx.machine}"
-        Q = Queue(qname, conn=self.conn)
-        job = await Q.enqueue(
-            self.tasks["notebook"],
-            execid=nb_ctx.execid,
-            timeout=task.timeout,
-            background=True,
-            params={"data": nb_ctx.dict()},
-        )
-
+        await self._send_notebooks([nb_ctx])
         return nb_ctx
 
+    async def enqueue_notebooks(
+        self,
+        session,
+        *,
+        projectid: str,
+        tasks: List[types.NBTask],
+        prefix=None,
+    ) -> List[types.ExecutionNBTask]:
+        """
+        Enqueue a batch of notebooks. Runtimes are resolved once
+        per (runtime, version) and all the jobs are sent to redis
+        in a single pipeline, grouped by `cluster.machine` queue.
+        """
+        ctxs = await create_tasks_ctx(session, projectid, tasks, prefix=prefix)
+        await self._send_notebooks(ctxs)
+        return ctxs
+
+    async def _send_notebooks(self, ctxs: List[types.ExecutionNBTask]):
+        """
+        It stores the jobs in the way that libq does, in one pipeline.
+        If fair share is enabled, jobs go to the pending lists of
+        each project, otherwise they go directly to the `cluster.machine` queue.
+        """
+        queues: Dict[str, Queue] = {}
+        _now = int(now_secs())
+        async with self.conn.pipeline() as pipe:
+            for nb_ctx in ctxs:
+                qname = f"{nb_ctx.cluster}.{nb_ctx.machine}"
+                Q = queues.get(qname)
+                if not Q:
+                    Q = self.queues.get(qname)
+                    queues[qname] = Q
+                    pipe.sadd(Prefixes.queues_list.value, Q.name)
+                payload = JobPayload(
+                    func_name=self.tasks["notebook"],
+                    timeout=job_timeout(nb_ctx),
+                    params={"data": ctx2wire(nb_ctx)},
+                    status=JobStatus.queued.value,
+                    created_ts=_now,
+                    queue=qname,
+                )
+                wait_ttl = Q._queue_wait_ttl
+                if self.fairshare:
+                    wait_ttl = self.fairshare.wait_ttl
+                pipe.setex(
+                    f"{Prefixes.job.value}{nb_ctx.execid}", wait_ttl, payload.json()
+                )
+                if self.fairshare:
+                    self.fairshare.push(
+                        pipe, qname, nb_ctx.projectid, nb_ctx.execid, nb_ctx.priority
+                    )
+                else:
+                    pipe.rpush(Q.name, nb_ctx.execid)
+            await pipe.execute()
+
+        if self.fairshare:
+            for qname in queues.keys():
+                await self.fairshare.dispatch(qname)
+
+    async def queue_depth(
+        self, projectid: Optional[str] = None
+    ) -> Dict[str, Dict[int, Dict[str, int]]]:
+        """Pending notebooks by queue, priority and project (fair share only)"""
+        if not self.fairshare:
+            return {}
+        return await self.fairshare.depth(projectid)
+
     async def enqueue_build(
         self,
         session,
@@ -200,6 +307,8 @@ class SchedulerExec:
         return job
 
     async def _get_job(self, execid: str) -> Union[Job, None]:
+        # a Job only wraps the shared connection and the payload read,
+        # it is not kept in the QueuePool: the status changes between reads
         job = Job(execid, conn=self.conn)
         try:
             await job.fetch()
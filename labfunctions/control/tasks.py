@@ -1,34 +1,153 @@
+import json
 from datetime import datetime
 from functools import partial
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 
-from labfunctions import client, log, types
+from libq import Queue
+from redis.asyncio import Redis
+
+from labfunctions import client, defaults, log, types
 from labfunctions.cluster2 import ClusterControl, CreateRequest, DestroyRequest
 from labfunctions.conf import load_server
+from labfunctions.errors.generics import CheckpointTimeout
 from labfunctions.executors import ExecID
-from labfunctions.executors.docker_exec import docker_exec
+from labfunctions.executors.docker_exec import docker_exec_async
+from labfunctions.io.memory_store import TTLCache
+from labfunctions.notebooks import ctx2wire, job_timeout, wire2ctx, workflow_run_ctx
 from labfunctions.redis_conn import create_pool
 from labfunctions.runtimes.builder import builder_exec
 from labfunctions.utils import get_version, run_async, today_string
 
+from .concurrency import WorkflowLock
+
+# secs that a workflow lock outlives the job of the task
+WF_LOCK_MARGIN_SECS = 60
+
+PARKED_TASK = "labfunctions.control.tasks.parked_dispatcher"
+
+# wfid -> (registered data, ExecutionNBTask)
+_templates = TTLCache(maxsize=1024)
+
+_queue_conn: Optional[Redis] = None
+
+
+async def notebook_dispatcher(data: Dict[str, Any]):
+    ctx = wire2ctx(data)
+    result = await docker_exec_async(ctx)
+    if ctx.checkpoint and result.timed_out:
+        # the job fails so libq retries it with the same execid,
+        # the next run resumes from the checkpoint of this one
+        raise CheckpointTimeout(ctx.execid, ctx.timeout)
+    return result.dict()
+
 
-def notebook_dispatcher(data: Dict[str, Any]):
-    ctx = types.ExecutionNBTask(**data)
-    result = docker_exec(ctx)
+def init_queue_conn(conn: Redis) -> Redis:
+    """The tasks share the redis connections of the worker running them"""
+    global _queue_conn
+    _queue_conn = conn
+    return _queue_conn
+
+
+def get_queue_conn() -> Redis:
+    """The redis of the worker or one created once from the settings"""
+    global _queue_conn
+    if _queue_conn is None:
+        settings = load_server()
+        _queue_conn = create_pool(settings.QUEUE_REDIS)
+    return _queue_conn
+
+
+def _workflow_lock(wfid: str, timeout: int) -> WorkflowLock:
+    return WorkflowLock(get_queue_conn(), wfid, ttl=timeout + WF_LOCK_MARGIN_SECS)
+
+
+async def _dispatch_with_policy(
+    ctx: types.ExecutionNBTask, policy: str, lock: WorkflowLock
+) -> Dict[str, Any]:
+    action, running = await lock.acquire(
+        ctx.execid, policy, data=json.dumps(ctx2wire(ctx))
+    )
+    if action == "queued":
+        log.server_logger.info(f"{ctx.wfid}: {ctx.execid} parked until {running} ends")
+        return dict(wfid=ctx.wfid, execid=ctx.execid, queued=True, running=running)
+    if action == "skip":
+        log.server_logger.info(f"{ctx.wfid}: {ctx.execid} skipped by {running}")
+        return dict(wfid=ctx.wfid, execid=ctx.execid, skipped=True, running=running)
+    if action == "replace":
+        log.server_logger.info(f"{ctx.wfid}: {ctx.execid} replaces {running}")
+
+    return await _run_locked(ctx, lock)
+
+
+async def _run_locked(ctx: types.ExecutionNBTask, lock: WorkflowLock) -> Dict[str, Any]:
+    try:
+        result = await docker_exec_async(
+            ctx, should_stop=partial(lock.lost, ctx.execid)
+        )
+    finally:
+        parked = await lock.release(ctx.execid)
+        if parked:
+            await _enqueue_parked(lock.conn, json.loads(parked))
     return result.dict()
 
 
-def workflow_dispatcher(data: Dict[str, Any]):
-    ctx = types.ExecutionNBTask(**data)
-    ctx.execid = str(ExecID())
+async def _enqueue_parked(conn: Redis, data: Dict[str, Any]):
+    """The parked run holds the lock already, see :func:`parked_dispatcher`"""
+    ctx = wire2ctx(data)
+    Q = Queue(f"{ctx.cluster}.{ctx.machine}", conn=conn)
+    await Q.enqueue(
+        PARKED_TASK,
+        execid=ctx.execid,
+        params={"data": data},
+        timeout=job_timeout(ctx),
+    )
+    log.server_logger.info(f"{ctx.wfid}: {ctx.execid} enqueued again")
+
+
+async def parked_dispatcher(data: Dict[str, Any]):
+    """
+    Runs a workflow parked by the "queue-one" policy. It took the lock
+    when the previous run released it, unless the lock expired or was
+    replaced meanwhile.
+    """
+    ctx = wire2ctx(data)
+    lock = _workflow_lock(ctx.wfid, job_timeout(ctx))
+    if await lock.lost(ctx.execid):
+        log.server_logger.info(f"{ctx.wfid}: {ctx.execid} lost its parked place")
+        return dict(wfid=ctx.wfid, execid=ctx.execid, skipped=True)
+    return await _run_locked(ctx, lock)
+
+
+def workflow_template(wfid: str, data: Dict[str, Any]) -> types.ExecutionNBTask:
+    """
+    The context registered with a workflow is the same for every run,
+    so it is parsed once by worker and kept while the registered
+    data doesn't change.
+    """
+    cached = _templates.get(wfid)
+    if cached and cached[0] == data:
+        return cached[1]
+    template = wire2ctx(data)
+    _templates.set(wfid, (data, template))
+    return template
+
+
+async def workflow_dispatcher(
+    data: Dict[str, Any], concurrency: str = defaults.WF_CONCURRENCY_ALLOW
+):
+    template = workflow_template(data.get("w") or data["wfid"], data)
+    ctx = workflow_run_ctx(
+        template,
+        execid=str(ExecID()),
+        now=datetime.utcnow().isoformat(),
+        today=today_string(format_="day"),
+    )
+    if concurrency == defaults.WF_CONCURRENCY_ALLOW:
+        result = await docker_exec_async(ctx)
+        return result.dict()
 
-    today = today_string(format_="day")
-    _now = datetime.utcnow().isoformat()
-    ctx.params["NOW"] = _now
-    ctx.created_at = _now
-    ctx.today = today
-    result = notebook_dispatcher(ctx.dict())
-    return result
+    lock = _workflow_lock(ctx.wfid, job_timeout(ctx))
+    return await _dispatch_with_policy(ctx, concurrency, lock)
 
 
 def build_dispatcher(data: Dict[str, Any]):
@@ -50,7 +50,104 @@ SANIC_APP_NAME = "labfunctions"
 
 NB_OUTPUTS = "outputs"
 
+# Logs of notebooks executions
+EXEC_LOGS_TAIL = 16 * 1024  # chars kept in the execution result
+EXEC_LOGS_CHUNK = 8 * 1024  # chars published by event
+EXEC_LOGS_FLUSH_SECS = 1.0
+EXEC_LOGS_EVENT = "log"
+# status of a container killed at the timeout of its task
+EXEC_TIMEOUT_STATUS = -4
+# secs that the job of a task outlives the timeout of the task: env,
+# image pull and the upload of the logs happen outside of that timeout
+EXEC_JOB_MARGIN_SECS = 10 * 60
+
+# unix timestamp of when the agent dispatched a notebook
+DISPATCHED_AT_ENV = "LF_DISPATCHED_AT"
+
+# Warm containers pool of the agent
+WARM_SOCKETS_DIR = "/tmp/labfunctions/warm"  # in the host
+WARM_SOCKETS_MOUNT = "/run/labfunctions"  # inside the container
+WARM_MAX_RUNS = 20
+WARM_IDLE_SECS = 30 * 60  # a warm container exits if it doesn't get tasks
+# Jupyter kernels reused by a warm container (NBTask.kernel_reuse)
+KERNEL_NAME = "python3"
+KERNEL_MAX_RUNS = 10
+KERNEL_POOL_MAX_KEYS = 4  # workflows with idle kernels in a warm container
+# parsed notebooks kept in memory by the executor
+NB_CACHE_SIZE = 64
+
+# slimming of output notebooks (types.SlimOptions)
+SLIM_STREAM_TAIL = 10_000  # chars
+SLIM_IMAGE_MIN_BYTES = 16 * 1024  # base64 size
+SLIM_BLOBS_DIR = f"{NB_OUTPUTS}/blobs"
+
+# admission control of the agent, for tasks without resources requested
+TASK_CPUS = 1.0
+TASK_MEM_MB = 1024
+AGENT_RESERVED_MEM_MB = 512  # not used by tasks
+
+# runtime images kept by an agent (see executors/image_cache)
+AGENT_MAX_IMAGES = 20
+AGENT_MAX_PULLS = 2
+
+# client shared by the jobs of an agent (see client/agent_client)
+AGENT_HTTP_KEEPALIVE = 60  # secs
+AGENT_CREDS_TTL = 60 * 10  # private keys
+AGENT_CREDS_REFRESH_SECS = 60 * 30  # before the expiration of a token
+AGENT_CREDS_CACHE = 256  # projects
+
+# checkpoints of notebooks (NBTask.checkpoint)
+CHECKPOINT_TAG = "checkpoint"  # a cell from where a retry could resume
+CHECKPOINT_SETUP_TAG = "setup"  # cells executed again on resume
+CHECKPOINT_SECS = 60
+CHECKPOINT_GRACE_SECS = 30  # before the timeout of the task
+CHECKPOINTS_DIR = f"{NB_OUTPUTS}/checkpoints"
+
+# results cached by io.cache.frozen_result
+CACHE_DIR = "/tmp/labfunctions/cache"
+CACHE_MEMORY_MB = 256
+CACHE_DISK_MB = 2 * 1024
+CACHE_KV_PREFIX = "cache"
+
+# http clients of the fileserver kv stores (io/kv_files)
+KV_MAX_CONNECTIONS = 50
+KV_MAX_KEEPALIVE = 20
+KV_KEEPALIVE_SECS = 60
+KV_TIMEOUT = 60
+
+# put_file and get_file of the kv stores (io/transfer)
+KV_PART_SIZE = 8 * 1024 * 1024
+KV_PARALLEL_PARTS = 4
+
+# async google storage kv store (io/kv_gcs.AsyncKVGS)
+GCS_ENDPOINT = "https://storage.googleapis.com"
+GCS_CHUNK_SIZE = 8 * 1024 * 1024  # a multiple of 256 KiB
+GCS_PARALLEL_RANGES = 4  # by download
+GCS_MAX_REQUESTS = 16  # by store
+GCS_RETRIES = 3
+GCS_COMPOSE_MAX = 32  # objects composed by request
+
+# parameters sweep (NBTask.sweep)
+SWEEP_MAX_ITEMS = 1000
+# tasks enqueued by one request (NBTaskBatch.tasks)
+BATCH_MAX_TASKS = 500
+
+# compression of the output notebooks sent by the executor: gzip or zstd
+OUTPUT_ENCODING = "gzip"
+UPLOAD_CHUNK_SIZE = 256 * 1024
+# bytes of a compressed upload once decompressed by the server
+UPLOAD_MAX_DECOMPRESSED = 1024 * 1024 * 1024
+# zstd has no max_length, its input is fed in slices of this size,
+# so one slice can't give more than a few MB
+UPLOAD_ZSTD_SLICE = 64
+
 EXECUTIONTASK_VAR = "LF_EXECUTION_TASK"
+# contexts bigger than EXECUTIONTASK_ENV_MAX chars are written to a file
+# in TASKS_DIR (tmpfs) and mounted in the container instead of the env var
+EXECUTIONTASK_FILE_VAR = "LF_EXECUTION_TASK_FILE"
+EXECUTIONTASK_ENV_MAX = 64 * 1024
+TASKS_DIR = "/dev/shm/labfunctions/tasks"  # in the host
+TASKS_MOUNT = "/run/labfunctions-tasks"  # inside the container
 JUPYTERCTX_VAR = "LF_JUPYTER_CTX"
 
 BASE_PATH_ENV = "LF_BASE_PATH"
@@ -72,6 +169,24 @@ NANO_MACHINE_ALPHABET = "0123456789abcdefghijklmnopqrstuvwxyz"
 MACHINE_TYPE = "cpu"
 CLUSTER_NAME = "default"
 
+# Tasks priorities, 0 is the highest
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+PRIORITY_LEVELS = 3
+
+# What to do when a workflow is triggered while a previous run is active
+WF_CONCURRENCY_ALLOW = "allow"
+WF_CONCURRENCY_SKIP = "skip"
+WF_CONCURRENCY_QUEUE_ONE = "queue-one"
+WF_CONCURRENCY_REPLACE = "replace"
+WF_CONCURRENCY_POLICIES = (
+    WF_CONCURRENCY_ALLOW,
+    WF_CONCURRENCY_SKIP,
+    WF_CONCURRENCY_QUEUE_ONE,
+    WF_CONCURRENCY_REPLACE,
+)
+
 AGENT_HOMEDIR = "/home/op"
 AGENT_DOCKER_IMG = "nuxion/labfunctions"
 AGENT_ENV_TPL = "agent.docker.envfile"
@@ -83,5 +198,6 @@ DOCKER_CUDA_VER = "11.6"
 SERVER_LOG = "lab.server"
 ERROR_LOG = "lab.error"
 CLIENT_LOG = "lab.client"
+RUNTIMES_CHANNEL = "lab.runtimes"
 CONTROL_QUEUE = "default.control"
 BUILD_QUEUE = "default.build"
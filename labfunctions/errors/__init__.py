@@ -2,6 +2,7 @@ from .client import LoginError, ProjectCreateError
 from .generics import (
     AuthValidationFailed,
     CommandExecutionException,
+    DockerAPIError,
     HistoryNotebookError,
     PrivateKeyNotFound,
     ProjectNotFound,
@@ -3,6 +3,41 @@ class CommandExecutionException(Exception):
         super().__init__(message)
 
 
+class DockerAPIError(Exception):
+    def __init__(self, status_code: int, message: str):
+        self.status_code = status_code
+        super().__init__(f"Docker API error {status_code}: {message}")
+
+
+class WarmRunError(Exception):
+    pass
+
+
+class WarmRunTimeout(WarmRunError):
+    pass
+
+
+class AdmissionTimeout(Exception):
+    def __init__(self, execid: str, cpus: float, mem_mb: int, timeout: float):
+        _msg = (
+            f"execid: {execid} not admitted in {timeout} secs, "
+            f"waiting for {cpus} cpus and {mem_mb} MB"
+        )
+        super().__init__(_msg)
+
+
+class CheckpointTimeout(Exception):
+    def __init__(self, execid: str, timeout: int):
+        _msg = f"execid: {execid} timeout after {timeout} secs, it will resume from its checkpoint"
+        super().__init__(_msg)
+
+
+class UploadTooLarge(Exception):
+    def __init__(self, max_size: int):
+        _msg = f"The upload is larger than {max_size} bytes once decompressed"
+        super().__init__(_msg)
+
+
 class WorkflowDisabled(Exception):
     def __init__(self, projectid, wfid):
         _msg = f"projectid: {projectid} and wfid: {wfid} disabled"
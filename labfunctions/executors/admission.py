@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Optional, Tuple
+
+from labfunctions import defaults
+from labfunctions.errors.generics import AdmissionTimeout
+from labfunctions.types import ExecutionNBTask
+
+logger = logging.getLogger("nbworkf.server")
+
+
+def machine_capacity() -> Tuple[float, int]:
+    """
+    Cpus usable by this process and memory of the machine in MB
+    minus :data:`defaults.AGENT_RESERVED_MEM_MB`
+    """
+    if hasattr(os, "sched_getaffinity"):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+    mem = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    mem_mb = mem // (1024 * 1024) - defaults.AGENT_RESERVED_MEM_MB
+    return float(cpus), max(mem_mb, 1)
+
+
+class ResourceGate:
+    def __init__(
+        self,
+        cpus: Optional[float] = None,
+        mem_mb: Optional[int] = None,
+        task_cpus: float = defaults.TASK_CPUS,
+        task_mem_mb: int = defaults.TASK_MEM_MB,
+    ):
+        """
+        Admission control of the agent: a task starts when the cpus
+        and memory requested by it fit in what is left of the capacity
+        of the machine, otherwise it waits for the running tasks.
+        Tasks without requests count as `task_cpus` and `task_mem_mb`.
+        A request bigger than the capacity is reduced to it, so the
+        task waits until it can run alone.
+
+        :param cpus: capacity, by default the cpus of the machine
+        :param mem_mb: capacity, by default the memory of the machine
+        """
+        machine_cpus, machine_mem = machine_capacity()
+        self.cpus = cpus or machine_cpus
+        self.mem_mb = mem_mb or machine_mem
+        self.task_cpus = task_cpus
+        self.task_mem_mb = task_mem_mb
+        self.used_cpus = 0.0
+        self.used_mem_mb = 0
+        self._cond: Optional[asyncio.Condition] = None
+
+    def _condition(self) -> asyncio.Condition:
+        # created inside of the loop of the worker
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    def request(self, ctx: ExecutionNBTask) -> Tuple[float, int]:
+        cpus = min(ctx.cpus or self.task_cpus, self.cpus)
+        mem_mb = min(ctx.mem_mb or self.task_mem_mb, self.mem_mb)
+        return cpus, mem_mb
+
+    def fits(self, cpus: float, mem_mb: int) -> bool:
+        return (
+            self.used_cpus + cpus <= self.cpus
+            and self.used_mem_mb + mem_mb <= self.mem_mb
+        )
+
+    @asynccontextmanager
+    async def reserve(self, ctx: ExecutionNBTask, timeout: Optional[float] = None):
+        """Waits until the resources of the task are free and holds
+        them while the block runs, it gives the secs waited.
+        The wait happens after the worker took the job, so it is
+        bounded by `timeout`, usually the timeout of the task.
+
+        :raises AdmissionTimeout: if they aren't free in `timeout` secs
+        """
+        cpus, mem_mb = self.request(ctx)
+        cond = self._condition()
+        started = time.monotonic()
+        async with cond:
+            if not self.fits(cpus, mem_mb):
+                logger.info(
+                    f"execid: {ctx.execid} waiting for {cpus} cpus, {mem_mb} MB"
+                )
+            try:
+                await asyncio.wait_for(
+                    cond.wait_for(lambda: self.fits(cpus, mem_mb)), timeout
+                )
+            except asyncio.TimeoutError:
+                raise AdmissionTimeout(ctx.execid, cpus, mem_mb, timeout)
+            self.used_cpus += cpus
+            self.used_mem_mb += mem_mb
+        try:
+            yield time.monotonic() - started
+        finally:
+            async with cond:
+                self.used_cpus -= cpus
+                self.used_mem_mb -= mem_mb
+                cond.notify_all()
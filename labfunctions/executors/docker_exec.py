@@ -1,18 +1,41 @@
 import json
 import logging
+import math
 import os
+import time
+from contextlib import AsyncExitStack
 from datetime import datetime, timedelta
+from functools import partial
+from typing import Any, Callable, Optional, Tuple
 
 from labfunctions import client, defaults, secrets
+from labfunctions.client.agent_client import AgentClient
+from labfunctions.client.nbclient import NBClient
+from labfunctions.commands import AsyncDockerCommand
+from labfunctions.errors.generics import (
+    AdmissionTimeout,
+    WarmRunError,
+    WarmRunTimeout,
+)
 
 # from labfunctions.executors import context
 # from labfunctions.conf.server_settings import settings
 from labfunctions.types import ExecutionNBTask, ExecutionResult
+from labfunctions.types.docker import DockerRunResult
+from labfunctions.utils import run_async
 
+from .admission import ResourceGate
+from .image_cache import ImageCache
+from .log_stream import LogStreamer
 from .nbtask_base import NBTaskDocker
+from .warm_pool import WarmContainer, WarmPool
 
+logger = logging.getLogger("nbworkf.server")
 
-def docker_exec(ctx: ExecutionNBTask) -> ExecutionResult:
+
+def docker_exec(
+    ctx: ExecutionNBTask, should_stop: Optional[Callable[[], bool]] = None
+) -> ExecutionResult:
     """
     It will get a wfid from the control plane.
     This function runs in RQ Worker from a data plane machine.
@@ -22,12 +45,213 @@ def docker_exec(ctx: ExecutionNBTask) -> ExecutionResult:
         - https://www.in-ulm.de/~mascheck/various/argmax/
         - and https://stackoverflow.com/questions/1078031/what-is-the-maximum-size-of-a-linux-environment-variable-value
         - and getconf -a | grep ARG_MAX # (value in kib)
+
+    :param should_stop: checked while the container runs, if it returns
+    True the container is killed (see workflows concurrency policies).
     """
 
-    nbclient = client.from_env()
+    nbclient = get_client()
     print("NB Addr: ", nbclient._addr)
     runner = NBTaskDocker(nbclient)
-    result = runner.run(ctx)
+    result = runner.run(ctx, should_stop=should_stop)
     if result.error and not os.getenv("DEBUG"):
         runner.register(result)
     return result
+
+
+_client: Optional[AgentClient] = None
+_docker: Optional[AsyncDockerCommand] = None
+_warm_pool: Optional[WarmPool] = None
+_admission: Optional[ResourceGate] = None
+_images: Optional[ImageCache] = None
+
+
+def init_agent_client() -> AgentClient:
+    """The same client, with its connections and the credentials of the
+    projects, is shared by all the jobs of an agent"""
+    global _client
+    _client = client.from_env(client_class=AgentClient)
+    return _client
+
+
+def get_client() -> NBClient:
+    """The client of the agent or a new one if there isn't"""
+    return _client or client.from_env()
+
+
+def get_async_docker() -> AsyncDockerCommand:
+    """The same docker client is shared by all the jobs of an agent"""
+    global _docker
+    if _docker is None:
+        _docker = AsyncDockerCommand()
+    return _docker
+
+
+def init_warm_pool(
+    size: int, max_runs: int = defaults.WARM_MAX_RUNS, max_mem_mb=None
+) -> WarmPool:
+    """Enables the warm pool of containers for the agent"""
+    global _warm_pool
+    _warm_pool = WarmPool(
+        get_async_docker(), size=size, max_runs=max_runs, max_mem_mb=max_mem_mb
+    )
+    return _warm_pool
+
+
+def init_admission(
+    cpus: Optional[float] = None,
+    mem_mb: Optional[int] = None,
+    task_cpus: float = defaults.TASK_CPUS,
+    task_mem_mb: int = defaults.TASK_MEM_MB,
+) -> ResourceGate:
+    """Enables the admission control of tasks for the agent,
+    see :class:`ResourceGate`"""
+    global _admission
+    _admission = ResourceGate(
+        cpus, mem_mb, task_cpus=task_cpus, task_mem_mb=task_mem_mb
+    )
+    return _admission
+
+
+def init_image_cache(
+    max_images: int = defaults.AGENT_MAX_IMAGES, max_disk_mb: Optional[int] = None
+) -> ImageCache:
+    """Enables the cache of runtime images for the agent, the caller
+    should run :meth:`ImageCache.listen` to pull new runtimes ahead"""
+    global _images
+    _images = ImageCache(
+        get_async_docker(), max_images=max_images, max_disk_mb=max_disk_mb
+    )
+    return _images
+
+
+async def _warm_exec(
+    runner: NBTaskDocker, wc: WarmContainer, ctx: ExecutionNBTask, **kwargs
+) -> Tuple[ExecutionResult, bool]:
+    """
+    :return: the result and if it was registered already by the container
+    """
+    _started = time.time()
+    env = await run_async(partial(runner.prepare_env, ctx))
+    env[defaults.DISPATCHED_AT_ENV] = str(_started)
+    try:
+        result = await _warm_pool.run(wc, env, ctx.timeout, **kwargs)
+    except WarmRunError as e:
+        status = defaults.EXEC_TIMEOUT_STATUS if isinstance(e, WarmRunTimeout) else -1
+        failed = DockerRunResult(msg=str(e), status=status)
+        return runner.make_result(ctx, failed, _started), False
+    finally:
+        runner.remove_task_file(ctx)
+    logger.info(f"execid: {ctx.execid} warm start in {result.startup_secs} secs")
+    return result, True
+
+
+async def _publish_logs(nbclient: NBClient, ctx: ExecutionNBTask, text: str):
+    publish = partial(
+        nbclient.events_publish,
+        ctx.execid,
+        {"msg": text},
+        event=defaults.EXEC_LOGS_EVENT,
+        projectid=ctx.projectid,
+    )
+    await run_async(publish)
+
+
+async def _upload_logs(
+    nbclient: NBClient, ctx: ExecutionNBTask, streamer: LogStreamer
+) -> Optional[str]:
+    logs_path = None
+    with await streamer.close() as logs:
+        try:
+            upload = partial(nbclient.history_logs, ctx.projectid, ctx.execid, logs)
+            logs_path = await run_async(upload)
+            exit_ = partial(
+                nbclient.events_publish,
+                ctx.execid,
+                "exit",
+                event="control",
+                projectid=ctx.projectid,
+            )
+            await run_async(exit_)
+        except Exception as e:
+            logger.error(f"Uploading logs of {ctx.execid} failed: {e}")
+    return logs_path
+
+
+async def docker_exec_async(
+    ctx: ExecutionNBTask, should_stop: Optional[Callable[[], Any]] = None
+) -> ExecutionResult:
+    """
+    Asyncio version of :func:`docker_exec`, used by the agent.
+    If admission is enabled, the task waits until the cpus and memory
+    it requests are free in the machine. The wait is deducted from the
+    timeout of the task, if it takes the whole timeout the task fails
+    without running. Both are bounded by the deadline of the task taken
+    when it starts, the libq job lives longer (see
+    :func:`labfunctions.notebooks.job_timeout`). With the image cache, the
+    image of the task is kept while it runs.
+    If the warm pool is enabled and it has a container ready
+    for the runtime, the task runs there. Tasks with resources
+    requested don't use it, their limits are set when the
+    container is created.
+
+    Logs of the container are published as events in the channel of the
+    execution while it runs. The full logs are uploaded when it ends, the
+    result only keeps the last lines of them and the path to the logs.
+    """
+    deadline = time.monotonic() + ctx.timeout
+    async with AsyncExitStack() as stack:
+        if _admission:
+            try:
+                waited = await stack.enter_async_context(
+                    _admission.reserve(ctx, ctx.timeout)
+                )
+            except AdmissionTimeout as e:
+                return await _not_admitted(ctx, e)
+            if waited >= 1:
+                logger.info(f"execid: {ctx.execid} admitted after {waited:.0f} secs")
+                timeout = max(math.floor(deadline - time.monotonic()), 1)
+                ctx = ctx.copy(update={"timeout": timeout})
+        if _images:
+            await stack.enter_async_context(_images.use(ctx.runtime))
+        return await _docker_exec_async(ctx, should_stop)
+
+
+async def _not_admitted(ctx: ExecutionNBTask, e: AdmissionTimeout) -> ExecutionResult:
+    logger.error(str(e))
+    runner = NBTaskDocker(await run_async(get_client))
+    failed = DockerRunResult(msg=str(e), status=-1)
+    result = runner.make_result(ctx, failed, time.time())
+    if not os.getenv("DEBUG"):
+        await run_async(runner.register, result)
+    return result
+
+
+async def _docker_exec_async(
+    ctx: ExecutionNBTask, should_stop: Optional[Callable[[], Any]] = None
+) -> ExecutionResult:
+    nbclient = await run_async(get_client)
+    runner = NBTaskDocker(nbclient)
+    streamer = LogStreamer(partial(_publish_logs, nbclient, ctx))
+    streamer.start()
+    wc = None
+    if _warm_pool and not (ctx.cpus or ctx.mem_mb):
+        wc = _warm_pool.acquire((ctx.projectid, ctx.runtime, ctx.gpu_support))
+    registered = False
+    try:
+        if wc:
+            result, registered = await _warm_exec(
+                runner, wc, ctx, should_stop=should_stop, on_log=streamer.write
+            )
+        else:
+            result = await runner.arun(
+                ctx, get_async_docker(), should_stop=should_stop, on_log=streamer.write
+            )
+        if result.error and not registered and not os.getenv("DEBUG"):
+            await run_async(runner.register, result)
+    finally:
+        # the server sets the path of the logs in the registered result,
+        # so they are uploaded after it
+        logs_path = await _upload_logs(nbclient, ctx, streamer)
+    result.logs_path = logs_path
+    return result
@@ -0,0 +1,206 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional, Set
+
+import httpx
+from redis.asyncio import Redis
+
+from labfunctions import defaults
+from labfunctions.commands import AsyncDockerCommand
+from labfunctions.errors.generics import DockerAPIError
+from labfunctions.types.runtimes import RuntimeEvent
+
+logger = logging.getLogger("nbworkf.server")
+
+
+def is_runtime_image(image: str) -> bool:
+    """Images built for runtimes, see
+    :func:`labfunctions.runtimes.make_docker_name`"""
+    repo = image.rsplit(":", maxsplit=1)[0]
+    return f"{defaults.DOCKER_AUTHOR}/" in repo
+
+
+class ImageCache:
+    def __init__(
+        self,
+        docker: AsyncDockerCommand,
+        max_images: int = defaults.AGENT_MAX_IMAGES,
+        max_disk_mb: Optional[int] = None,
+        max_pulls: int = defaults.AGENT_MAX_PULLS,
+    ):
+        """
+        Runtime images local to the agent. New runtimes announced in
+        :data:`defaults.RUNTIMES_CHANNEL` are pulled ahead, so the first
+        task of a runtime doesn't wait for it. The images are advertised
+        in the metadata of the agent (see :meth:`advertise`).
+        When there are more than `max_images` or they use more than
+        `max_disk_mb`, the least recently used are removed. Only
+        runtime images are managed, others are never removed.
+        The size of an image includes the layers shared with others,
+        so the disk used is an upper bound.
+
+        :param docker: docker client shared with the agent
+        :param max_pulls: pulls running at the same time
+        """
+        self.docker = docker
+        self.max_images = max_images
+        self.max_disk = max_disk_mb * 1024 * 1024 if max_disk_mb else None
+        self.max_pulls = max_pulls
+        # image -> size in bytes, the least recently used first
+        self._images: "OrderedDict[str, int]" = OrderedDict()
+        self._runtimes: Dict[str, str] = {}
+        self._in_use: Dict[str, int] = {}
+        self._pulling: Dict[str, asyncio.Future] = {}
+        self._background: Set[asyncio.Future] = set()
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._metadata: Optional[Dict[str, Any]] = None
+
+    @property
+    def images(self) -> List[str]:
+        return list(self._images)
+
+    def advertise(self, metadata: Dict[str, Any]):
+        """`metadata` is kept updated with the local images, it should
+        be the dict registered by the worker in each heartbeat"""
+        self._metadata = metadata
+        self._advertise()
+
+    def _advertise(self):
+        if self._metadata is not None:
+            self._metadata["images"] = sorted(self._images)
+
+    async def load(self):
+        """Runtime images already in the machine, the oldest
+        are the first to be removed"""
+        found = []
+        for img in await self.docker.images():
+            for tag in img.get("RepoTags") or []:
+                if is_runtime_image(tag) and tag not in self._images:
+                    found.append((img.get("Created", 0), tag, img.get("Size", 0)))
+        for _, tag, size in sorted(found):
+            self._images[tag] = size
+        self._advertise()
+        await self.evict()
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        # created inside of the loop of the worker
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.max_pulls)
+        return self._sem
+
+    async def _pull(self, image: str):
+        async with self._semaphore():
+            logger.info(f"Pulling image {image}")
+            await self.docker.pull(image)
+            size = await self.docker.image_size(image)
+        self._images[image] = size
+        self._images.move_to_end(image)
+        self._advertise()
+        await self.evict()
+
+    async def pull(self, image: str, runtimeid: Optional[str] = None):
+        """Pulls the image if it is not local, concurrent calls for the
+        same image wait for the same pull"""
+        if runtimeid:
+            self._runtimes[runtimeid] = image
+        if image in self._images:
+            return
+        pulling = self._pulling.get(image)
+        if pulling is None:
+            pulling = asyncio.ensure_future(self._pull(image))
+            self._pulling[image] = pulling
+            pulling.add_done_callback(lambda _: self._pulling.pop(image, None))
+        await asyncio.shield(pulling)
+
+    @asynccontextmanager
+    async def use(self, image: str):
+        """The image is pulled if needed and it is not removed while
+        the block runs. A failed pull is only logged, the task will
+        report it when the container is created."""
+        self._in_use[image] = self._in_use.get(image, 0) + 1
+        try:
+            if is_runtime_image(image):
+                try:
+                    await self.pull(image)
+                    self._images.move_to_end(image)
+                except (DockerAPIError, httpx.HTTPError) as e:
+                    logger.error(f"Pull of {image} failed: {e}")
+            yield
+        finally:
+            self._in_use[image] -= 1
+            if not self._in_use[image]:
+                del self._in_use[image]
+
+    def _over_limits(self) -> bool:
+        if len(self._images) > self.max_images:
+            return True
+        return bool(self.max_disk and sum(self._images.values()) > self.max_disk)
+
+    async def remove(self, image: str) -> bool:
+        try:
+            await self.docker.remove_image(image)
+        except DockerAPIError as e:
+            # 409: a container uses it, 404: removed by someone else
+            if e.status_code != 404:
+                logger.warning(f"Image {image} not removed: {e}")
+                return False
+        self._images.pop(image, None)
+        self._advertise()
+        return True
+
+    async def evict(self) -> List[str]:
+        """Removes the least recently used images until the cache is
+        under its limits
+        :return: images removed"""
+        removed = []
+        for image in list(self._images):
+            if not self._over_limits():
+                break
+            if image in self._in_use or image in self._pulling:
+                continue
+            if await self.remove(image):
+                removed.append(image)
+        return removed
+
+    async def forget(self, runtimeid: str):
+        """The runtime was deleted, its image is removed if not in use"""
+        image = self._runtimes.pop(runtimeid, None)
+        if image and image in self._images and image not in self._in_use:
+            await self.remove(image)
+
+    def _run_background(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _pull_quietly(self, image: str, runtimeid: str):
+        try:
+            await self.pull(image, runtimeid)
+        except Exception as e:
+            logger.error(f"Prepull of {image} failed: {e}")
+
+    def on_event(self, evt: RuntimeEvent):
+        if evt.action == "created" and evt.image:
+            self._run_background(self._pull_quietly(evt.image, evt.runtimeid))
+        elif evt.action == "deleted":
+            self._run_background(self.forget(evt.runtimeid))
+
+    async def listen(self, redis: Redis):
+        """It runs forever, to be used as a task of the agent"""
+        try:
+            await self.load()
+        except Exception as e:
+            logger.error(f"Loading local images failed: {e}")
+        pubsub = redis.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(defaults.RUNTIMES_CHANNEL)
+        async for msg in pubsub.listen():
+            try:
+                self.on_event(RuntimeEvent.parse_raw(msg["data"]))
+            except Exception as e:
+                logger.warning(f"Invalid runtime event {msg}: {e}")
+
+    async def close(self):
+        for task in list(self._background):
+            task.cancel()
@@ -0,0 +1,183 @@
+import logging
+import os
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from labfunctions import defaults
+
+logger = logging.getLogger("nbworkf.server")
+
+# (projectid, wfid, kernel name)
+KernelKey = Tuple[str, str, str]
+
+# runs in the kernel before each task: a clean namespace and the env
+# and cwd of the task, like a new kernel started by papermill would have.
+_PREPARE_CODE = """get_ipython().run_line_magic("reset", "-f")
+import os as _os
+_os.environ.clear()
+_os.environ.update({env!r})
+_os.chdir({cwd!r})
+del _os
+"""
+
+
+def _rss(pid: int) -> int:
+    """Resident memory of a process in bytes"""
+    with open(f"/proc/{pid}/statm", "r") as f:
+        pages = int(f.read().split()[1])
+    return pages * os.sysconf("SC_PAGE_SIZE")
+
+
+def kernel_name_from(nb) -> str:
+    kernelspec = nb.get("metadata", {}).get("kernelspec", {})
+    return kernelspec.get("name") or defaults.KERNEL_NAME
+
+
+class PooledKernel:
+    __slots__ = ("km", "key", "runs")
+
+    def __init__(self, km, key: KernelKey):
+        self.km = km
+        self.key = key
+        self.runs = 0
+
+    @property
+    def name(self) -> str:
+        return self.key[2]
+
+    @property
+    def pid(self) -> Optional[int]:
+        provisioner = getattr(self.km, "provisioner", None)
+        process = getattr(provisioner, "process", None)
+        return getattr(process, "pid", None)
+
+    def execute(self, code: str, timeout: int = 30):
+        kc = self.km.client()
+        kc.start_channels()
+        try:
+            kc.wait_for_ready(timeout=timeout)
+            reply = kc.execute_interactive(
+                code, silent=True, store_history=False, timeout=timeout
+            )
+        finally:
+            kc.stop_channels()
+        if reply["content"]["status"] != "ok":
+            raise RuntimeError(reply["content"].get("evalue"))
+
+
+class KernelPool:
+    def __init__(
+        self,
+        size: int = 1,
+        max_runs: int = defaults.KERNEL_MAX_RUNS,
+        max_rss_mb: Optional[int] = None,
+        start_timeout: int = 60,
+        max_keys: int = defaults.KERNEL_POOL_MAX_KEYS,
+    ):
+        """
+        Jupyter kernels started ahead, used by :class:`NBTaskLocal` for
+        the tasks with `kernel_reuse`. It lives in a warm container
+        (see :func:`labfunctions.executors.warm_exec.warm_exec_serve`),
+        so the pool is by project and runtime, and by workflow and
+        kernel name inside of it (:data:`KernelKey`).
+        The namespace of a kernel is reset before each task, but the
+        modules imported by a previous task are still loaded, which is
+        what saves time. That state is only shared by the runs of the
+        same workflow.
+        A kernel is replaced if the task fails, after `max_runs` or
+        when it uses more than `max_rss_mb`.
+
+        :param size: idle kernels kept by key
+        :param start_timeout: secs to wait for a new kernel
+        :param max_keys: keys with idle kernels, the kernels of the
+        least recently used ones are shut down.
+        """
+        self.size = size
+        self.max_runs = max_runs
+        self.max_rss = max_rss_mb * 1024 * 1024 if max_rss_mb else None
+        self.start_timeout = start_timeout
+        self.max_keys = max_keys
+        self._idle: Dict[KernelKey, List[PooledKernel]] = OrderedDict()
+
+    def _start(self, key: KernelKey) -> PooledKernel:
+        from jupyter_client import KernelManager
+
+        km = KernelManager(kernel_name=key[2])
+        km.start_kernel()
+        pk = PooledKernel(km, key)
+        try:
+            pk.execute("pass", timeout=self.start_timeout)
+        except Exception:
+            self._shutdown(pk)
+            raise
+        return pk
+
+    def _shutdown(self, pk: PooledKernel):
+        try:
+            pk.km.shutdown_kernel(now=True)
+        except Exception as e:
+            logger.warning(f"Shutdown of kernel {pk.name} failed: {e}")
+
+    def _use(self, key: KernelKey) -> List[PooledKernel]:
+        idle = self._idle.setdefault(key, [])
+        self._idle.move_to_end(key)
+        while len(self._idle) > self.max_keys:
+            _, evicted = self._idle.popitem(last=False)
+            for pk in evicted:
+                self._shutdown(pk)
+        return idle
+
+    def fill(self, key: Optional[KernelKey] = None):
+        """Starts the kernels missing for `key` and for the keys
+        used before"""
+        if key:
+            self._use(key)
+        for kkey, idle in self._idle.items():
+            while len(idle) < self.size:
+                try:
+                    idle.append(self._start(kkey))
+                except Exception as e:
+                    logger.error(f"Kernel {kkey} failed to start: {e}")
+                    break
+
+    def acquire(self, key: KernelKey) -> PooledKernel:
+        """An idle kernel ready for a task, it is started if there
+        isn't any. The task should release it with :meth:`release`."""
+        idle = self._use(key)
+        while idle:
+            pk = idle.pop()
+            if not pk.km.is_alive():
+                self._shutdown(pk)
+                continue
+            try:
+                self._prepare(pk)
+                return pk
+            except Exception as e:
+                logger.warning(f"Kernel {key} discarded: {e}")
+                self._shutdown(pk)
+        pk = self._start(key)
+        self._prepare(pk)
+        return pk
+
+    def _prepare(self, pk: PooledKernel):
+        pk.execute(_PREPARE_CODE.format(env=dict(os.environ), cwd=os.getcwd()))
+
+    def release(self, pk: PooledKernel, ok: bool = True):
+        """Puts the kernel back or shuts it down"""
+        pk.runs += 1
+        recycle = not ok or pk.runs >= self.max_runs or not pk.km.is_alive()
+        if not recycle and self.max_rss and pk.pid:
+            try:
+                recycle = _rss(pk.pid) > self.max_rss
+            except OSError:
+                recycle = True
+        if recycle or pk.key not in self._idle:
+            self._shutdown(pk)
+        else:
+            self._idle[pk.key].append(pk)
+
+    def close(self):
+        for idle in self._idle.values():
+            for pk in idle:
+                self._shutdown(pk)
+        self._idle = {}
@@ -4,29 +4,52 @@ import os
 import shutil
 import time
 from pathlib import Path
-from typing import Union
+from typing import Optional, Union
 
 from labfunctions import client, defaults
 from labfunctions.conf import load_client
 from labfunctions.types import ExecutionNBTask, ExecutionResult, NBTask
 
+from .kernel_pool import KernelPool
 from .nbtask_base import NBTaskLocal
+from .sweep_exec import sweep_exec
 
 # from labfunctions.notebooks import nb_job_executor
 
 
-def local_exec_env() -> ExecutionResult:
+def load_task() -> ExecutionNBTask:
+    """
+    The task from the file in `defaults.EXECUTIONTASK_FILE_VAR` or from
+    the env var `defaults.EXECUTIONTASK_VAR`. The file is read as bytes
+    and parsed without decoding it first, so big params are copied once.
+    """
+    path = os.getenv(defaults.EXECUTIONTASK_FILE_VAR)
+    if path:
+        with open(path, "rb") as f:
+            data = json.loads(f.read())
+    else:
+        data = json.loads(os.environ[defaults.EXECUTIONTASK_VAR])
+    return ExecutionNBTask(**data)
+
+
+def local_exec_env(kernels: Optional[KernelPool] = None) -> ExecutionResult:
     """
     Control the notebook execution.
     TODO: implement notifications
     TODO: base executor class?
+
+    :param kernels: kernels kept by a warm container
     """
     # Init
     nbclient = client.from_env()
-    runner = NBTaskLocal(nbclient)
-    ctx_str = os.getenv(defaults.EXECUTIONTASK_VAR)
+    runner = NBTaskLocal(nbclient, kernels=kernels)
+    etask = load_task()
+    if etask.sweep:
+        result, items = sweep_exec(etask)
+        if not os.getenv("LF_LOCAL"):
+            runner.register_batch([result, *items])
+        return result
 
-    etask = ExecutionNBTask(**json.loads(ctx_str))
     result = runner.run(etask)
 
     if not os.getenv("LF_LOCAL"):
@@ -0,0 +1,75 @@
+import asyncio
+import gzip
+import tempfile
+import time
+from typing import Any, Awaitable, BinaryIO, Callable, List, Optional
+
+from labfunctions import defaults, log
+
+
+class LogStreamer:
+    def __init__(
+        self,
+        publish: Callable[[str], Awaitable[Any]],
+        chunk_size: int = defaults.EXEC_LOGS_CHUNK,
+        flush_secs: float = defaults.EXEC_LOGS_FLUSH_SECS,
+    ):
+        """
+        It receives the logs of a running container: they are published
+        in chunks as events, and the full logs are gzipped into a temporary
+        file, so nothing grows in memory with the size of the logs.
+
+        :param publish: coroutine function which publishes a chunk of logs
+        :param chunk_size: chars buffered before publishing them
+        :param flush_secs: max time that a chunk waits to be published
+        """
+        self._publish = publish
+        self.chunk_size = chunk_size
+        self.flush_secs = flush_secs
+        self._buffer: List[str] = []
+        self._size = 0
+        self._lock = asyncio.Lock()
+        self._spool = tempfile.TemporaryFile()
+        self._gz = gzip.GzipFile(fileobj=self._spool, mode="wb")
+        self._flusher: Optional[asyncio.Task] = None
+        self._last_flush = time.monotonic()
+
+    def start(self):
+        self._flusher = asyncio.ensure_future(self._flush_every())
+
+    async def _flush_every(self):
+        while True:
+            await asyncio.sleep(self.flush_secs)
+            if time.monotonic() - self._last_flush >= self.flush_secs:
+                await self.flush()
+
+    async def write(self, text: str):
+        self._gz.write(text.encode("utf-8"))
+        self._buffer.append(text)
+        self._size += len(text)
+        if self._size >= self.chunk_size:
+            await self.flush()
+
+    async def flush(self):
+        async with self._lock:
+            if not self._buffer:
+                return
+            data = "".join(self._buffer)
+            self._buffer = []
+            self._size = 0
+            self._last_flush = time.monotonic()
+            try:
+                await self._publish(data)
+            except Exception as e:
+                # losing a live chunk is fine, it is still in the full logs
+                log.error_logger.warning(f"Publishing logs failed: {e}")
+
+    async def close(self) -> BinaryIO:
+        """Publishes what is left and returns the gzipped logs
+        ready to be read. The file is removed when closed."""
+        if self._flusher:
+            self._flusher.cancel()
+        await self.flush()
+        self._gz.close()
+        self._spool.seek(0)
+        return self._spool
@@ -5,19 +5,27 @@ import shutil
 import time
 import warnings
 from copy import deepcopy
-from datetime import datetime
+from datetime import datetime, timezone
+from functools import partial
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Callable, Dict, List, Optional, Union
+
+import nbformat
 
 from labfunctions import defaults
 from labfunctions.client.diskclient import DiskClient
 from labfunctions.client.nbclient import NBClient
-from labfunctions.commands import DockerCommand, DockerRunResult
+from labfunctions.commands import AsyncDockerCommand, DockerCommand, DockerRunResult
+from labfunctions.notebooks.checkpoint import Checkpointer
+from labfunctions.notebooks.slim import slim_output
+from labfunctions.notebooks.utils import execute_notebook, read_notebook
 from labfunctions.types import ExecutionNBTask, ExecutionResult, NBTask
+from labfunctions.types.docker import DockerResources, DockerVolume
 from labfunctions.types.runtimes import RuntimeData
-from labfunctions.utils import get_version, today_string
+from labfunctions.utils import get_version, run_async, today_string
 
 from .execid import ExecID
+from .kernel_pool import KernelPool, kernel_name_from
 
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 
@@ -43,6 +51,30 @@ def _simple_retry(func, params, max_retries=3, wait_time=5):
     return status
 
 
+def startup_secs(nb, started: float) -> Optional[float]:
+    """
+    Secs from the dispatch of the task (see `defaults.DISPATCHED_AT_ENV`)
+    or from `started` to the start of the first cell executed by papermill.
+    """
+    dispatched = float(os.getenv(defaults.DISPATCHED_AT_ENV, started))
+    for cell in nb.cells:
+        start = cell.get("metadata", {}).get("papermill", {}).get("start_time")
+        if start:
+            first = datetime.fromisoformat(start)
+            if not first.tzinfo:
+                first = first.replace(tzinfo=timezone.utc)
+            return round(first.timestamp() - dispatched, 3)
+    return None
+
+
+def task_resources(ctx: ExecutionNBTask) -> DockerResources:
+    """Limits of the container of a task from its requests"""
+    return DockerResources(
+        mem_limit=ctx.mem_mb * 1024 * 1024 if ctx.mem_mb else None,
+        nano_cpus=int(ctx.cpus * 10**9) if ctx.cpus else None,
+    )
+
+
 class NBTaskExecBase:
 
     WFID_TMP = "tmp"
@@ -64,11 +96,22 @@ class NBTaskExecBase:
 
     def register(self, result: ExecutionResult):
         self.client.history_register(result)
+        self._upload_outputs(result)
+
+    def register_batch(self, results: List[ExecutionResult]):
+        """Like :meth:`register` but the history rows are sent in one request"""
+        self.client.history_register_batch(results)
+        for result in results:
+            self._upload_outputs(result)
+
+    def _upload_outputs(self, result: ExecutionResult):
         if result.output_name:
             try:
                 self.client.history_nb_output(result)
             except FileNotFoundError:
                 print(f"WARNING: file not found for {result.execid}")
+        for blob in result.blobs or []:
+            self.client.history_blob(result.projectid, blob)
 
     def notificate(self, ctx: ExecutionNBTask, result: ExecutionResult):
         raise NotImplementedError()
@@ -77,6 +120,40 @@ class NBTaskExecBase:
 class NBTaskDocker(NBTaskExecBase):
     cmd = "lab exec local"
 
+    def __init__(
+        self,
+        client: Union[NBClient, DiskClient],
+        tasks_dir: str = defaults.TASKS_DIR,
+        env_max: int = defaults.EXECUTIONTASK_ENV_MAX,
+    ):
+        """
+        The task is passed to the container in the env var
+        `defaults.EXECUTIONTASK_VAR`, if it is bigger than `env_max`
+        chars it is written to `tasks_dir` and mounted in the container,
+        big params would exceed ARG_MAX and each process forked by the
+        notebook copies its env.
+
+        :param tasks_dir: a dir of the host, a tmpfs like /dev/shm is
+        better because the file is only read once.
+        """
+        super().__init__(client)
+        self.tasks_dir = tasks_dir
+        self.env_max = env_max
+
+    def task_file(self, execid: str) -> str:
+        return f"{self.tasks_dir}/{execid}.json"
+
+    def _task_volumes(self, env: Dict[str, Any]) -> List[DockerVolume]:
+        if defaults.EXECUTIONTASK_FILE_VAR not in env:
+            return []
+        return [DockerVolume(orig_mount=self.tasks_dir, dst_mount=defaults.TASKS_MOUNT)]
+
+    def remove_task_file(self, ctx: ExecutionNBTask):
+        try:
+            os.remove(self.task_file(ctx.execid))
+        except FileNotFoundError:
+            pass
+
     def build_env(self, data: Dict[str, Any]) -> Dict[str, Any]:
         priv_key = self.client.projects_private_key(data["projectid"])
         if not priv_key:
@@ -84,14 +161,22 @@ class NBTaskDocker(NBTaskExecBase):
 
         env = {
             defaults.PRIVKEY_VAR_NAME: priv_key,
-            defaults.EXECUTIONTASK_VAR: json.dumps(data),
             defaults.SERVICE_URL_ENV: self.client._addr,
             defaults.BASE_PATH_ENV: "/app",
         }
+        task = json.dumps(data)
+        if len(task) > self.env_max:
+            os.makedirs(self.tasks_dir, exist_ok=True)
+            path = self.task_file(data["execid"])
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(task)
+            inner = f"{defaults.TASKS_MOUNT}/{os.path.basename(path)}"
+            env[defaults.EXECUTIONTASK_FILE_VAR] = inner
+        else:
+            env[defaults.EXECUTIONTASK_VAR] = task
         return env
 
-    def run(self, ctx: ExecutionNBTask) -> ExecutionResult:
-        _started = time.time()
+    def prepare_env(self, ctx: ExecutionNBTask) -> Dict[str, Any]:
         env = self.build_env(ctx.dict())
         agent_token = self.client.projects_agent_token(projectid=ctx.projectid)
         env.update(
@@ -100,15 +185,16 @@ class NBTaskDocker(NBTaskExecBase):
                 "LF_AGENT_REFRESH_TOKEN": agent_token.creds.refresh_token,
             }
         )
-        cmd = DockerCommand()
-        result = cmd.run(
-            self.cmd, ctx.runtime, timeout=ctx.timeout, env_data=env, require_gpu=ctx
-        )
+        return env
+
+    def make_result(
+        self, ctx: ExecutionNBTask, result: DockerRunResult, started: float
+    ) -> ExecutionResult:
         error = False
         if result.status != 0:
             error = True
 
-        elapsed = round(time.time() - _started)
+        elapsed = round(time.time() - started)
         return ExecutionResult(
             projectid=ctx.projectid,
             name=ctx.nb_name,
@@ -126,13 +212,78 @@ class NBTaskDocker(NBTaskExecBase):
             error=error,
             error_msg=result.msg,
             created_at=ctx.created_at,
+            timed_out=result.status == defaults.EXEC_TIMEOUT_STATUS,
         )
 
+    def run(
+        self,
+        ctx: ExecutionNBTask,
+        should_stop: Optional[Callable[[], bool]] = None,
+    ) -> ExecutionResult:
+        _started = time.time()
+        env = self.prepare_env(ctx)
+        env[defaults.DISPATCHED_AT_ENV] = str(_started)
+        cmd = DockerCommand()
+        try:
+            result = cmd.run(
+                self.cmd,
+                ctx.runtime,
+                timeout=ctx.timeout,
+                env_data=env,
+                require_gpu=ctx.gpu_support,
+                resources=task_resources(ctx),
+                volumes=self._task_volumes(env),
+                should_stop=should_stop,
+            )
+        finally:
+            self.remove_task_file(ctx)
+        return self.make_result(ctx, result, _started)
+
+    async def arun(
+        self,
+        ctx: ExecutionNBTask,
+        cmd: AsyncDockerCommand,
+        should_stop: Optional[Callable[[], Any]] = None,
+        on_log: Optional[Callable[[str], Any]] = None,
+    ) -> ExecutionResult:
+        """Like :meth:`run` but it doesn't block the event loop
+        while the container is running."""
+        _started = time.time()
+        env = await run_async(self.prepare_env, ctx)
+        env[defaults.DISPATCHED_AT_ENV] = str(_started)
+        try:
+            result = await cmd.run(
+                self.cmd,
+                ctx.runtime,
+                timeout=ctx.timeout,
+                env_data=env,
+                require_gpu=ctx.gpu_support,
+                resources=task_resources(ctx),
+                volumes=self._task_volumes(env),
+                should_stop=should_stop,
+                on_log=on_log,
+            )
+        finally:
+            self.remove_task_file(ctx)
+        return self.make_result(ctx, result, _started)
+
     def notificate(self, ctx: ExecutionNBTask, result: ExecutionResult):
         pass
 
 
 class NBTaskLocal(NBTaskExecBase):
+    def __init__(
+        self,
+        client: Union[NBClient, DiskClient],
+        kernels: Optional[KernelPool] = None,
+    ):
+        """
+        :param kernels: used for the tasks with `kernel_reuse`,
+        otherwise papermill starts a new kernel for each task.
+        """
+        super().__init__(client)
+        self.kernels = kernels
+
     def run(self, ctx: ExecutionNBTask) -> ExecutionResult:
         import papermill as pm
 
@@ -142,12 +293,37 @@ class NBTaskLocal(NBTaskExecBase):
         Path(ctx.output_dir).mkdir(parents=True, exist_ok=True)
         print(f"Current dir: {Path.cwd()}")
         print(f"Input: {ctx.pm_input}")
+        _startup = None
+        kernel = None
+        _ok = False
+        if ctx.kernel_reuse and self.kernels:
+            nb = read_notebook(ctx.pm_input)
+            key = (ctx.projectid, ctx.wfid, kernel_name_from(nb))
+            kernel = self.kernels.acquire(key)
+        checkpointer = self._checkpointer(ctx, _started)
         try:
-            pm.execute_notebook(ctx.pm_input, ctx.pm_output, parameters=ctx.params)
+            nb = execute_notebook(
+                ctx.pm_input,
+                ctx.pm_output,
+                parameters=ctx.params,
+                checkpointer=checkpointer,
+                **({"km": kernel.km} if kernel else {}),
+            )
+            _startup = startup_secs(nb, _started)
+            _ok = True
         except pm.exceptions.PapermillExecutionError as e:
             self.logger.error(f"jobdid:{ctx.wfid} execid:{ctx.execid} failed {e}")
             _error = True
             _error_msg = str(e)
+        finally:
+            if kernel:
+                self.kernels.release(kernel, ok=_ok)
+            if checkpointer:
+                checkpointer.stop()
+                if not _ok:
+                    checkpointer.checkpoint()
+        _blobs = self._slim(ctx)
+        if _error:
             self._error_handler(ctx)
 
         elapsed = time.time() - _started
@@ -168,11 +344,46 @@ class NBTaskLocal(NBTaskExecBase):
             error_msg=_error_msg,
             elapsed_secs=round(elapsed, 2),
             created_at=ctx.created_at,
+            startup_secs=_startup,
+            blobs=_blobs,
         )
 
     def notificate(self, ctx: ExecutionNBTask, result: ExecutionResult):
         pass
 
+    def _checkpointer(
+        self, ctx: ExecutionNBTask, started: float
+    ) -> Optional[Checkpointer]:
+        """For tasks with `checkpoint`, the checkpoint of a previous
+        try of the same execution is resumed"""
+        if not ctx.checkpoint or not self.client:
+            return None
+        resume = None
+        try:
+            data = self.client.history_get_checkpoint(ctx.projectid, ctx.execid)
+            if data:
+                resume = nbformat.reads(data, as_version=4)
+        except Exception as e:
+            self.logger.warning(f"execid:{ctx.execid} checkpoint not loaded {e}")
+        checkpointer = Checkpointer(
+            ctx.pm_output,
+            partial(self.client.history_checkpoint, ctx.projectid, ctx.execid),
+            resume=resume,
+            deadline=started + ctx.timeout,
+        )
+        checkpointer.start()
+        return checkpointer
+
+    def _slim(self, ctx: ExecutionNBTask) -> Optional[List[str]]:
+        if not ctx.slim or not Path(ctx.pm_output).exists():
+            return None
+        try:
+            return slim_output(ctx.pm_output, ctx.slim) or None
+        except Exception as e:
+            # the output is still stored as it is
+            self.logger.warning(f"execid:{ctx.execid} slimming failed {e}")
+            return None
+
     def _error_handler(self, etask: ExecutionNBTask):
         error_output = f"{etask.error_dir}/{etask.output_name}"
         Path(etask.error_dir).mkdir(parents=True, exist_ok=True)
@@ -0,0 +1,62 @@
+import os
+import time
+from typing import List, Optional, Tuple
+
+from loky import get_reusable_executor
+
+from labfunctions.notebooks.context import make_error_result, sweep_ctxs
+from labfunctions.types import ExecutionNBTask, ExecutionResult
+
+from .nbtask_base import NBTaskLocal
+
+
+def _run_item(ctx: ExecutionNBTask) -> ExecutionResult:
+    # without client: the results are registered by the parent process
+    runner = NBTaskLocal(None)
+    return runner.run(ctx)
+
+
+def sweep_exec(
+    ctx: ExecutionNBTask, workers: Optional[int] = None
+) -> Tuple[ExecutionResult, List[ExecutionResult]]:
+    """
+    Runs each item of `ctx.sweep` in a pool of processes.
+    The processes are reused between items, so the libs of the runtime
+    are imported once by process and not once by item.
+
+    :param workers: processes of the pool, by default one by cpu.
+    :return: a summary of the sweep and the result of each item.
+    """
+    _started = time.time()
+    items = sweep_ctxs(ctx)
+    workers = workers or min(len(items), os.cpu_count() or 1)
+    executor = get_reusable_executor(max_workers=workers)
+    futures = [executor.submit(_run_item, item) for item in items]
+
+    results = []
+    for item, future in zip(items, futures):
+        try:
+            results.append(future.result())
+        except Exception as e:
+            result = make_error_result(item, time.time() - _started)
+            result.error_msg = str(e)
+            results.append(result)
+
+    failed = [r.execid for r in results if r.error]
+    summary = ExecutionResult(
+        projectid=ctx.projectid,
+        name=ctx.nb_name,
+        wfid=ctx.wfid,
+        execid=ctx.execid,
+        cluster=ctx.cluster,
+        machine=ctx.machine,
+        runtime=ctx.runtime,
+        params=ctx.params,
+        input_=ctx.pm_input,
+        error=bool(failed),
+        error_msg=f"Failed: {', '.join(failed)}" if failed else None,
+        elapsed_secs=round(time.time() - _started, 2),
+        created_at=ctx.created_at,
+        sweep=[r.execid for r in results],
+    )
+    return summary, results
@@ -0,0 +1,84 @@
+import json
+import os
+import socket
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+from labfunctions import defaults
+
+from .kernel_pool import KernelPool
+from .local_exec import local_exec_env
+
+
+@contextmanager
+def _environ(env: Dict[str, str]):
+    """Sets env vars only while a task runs"""
+    before = {k: os.environ.get(k) for k in env}
+    os.environ.update(env)
+    try:
+        yield
+    finally:
+        for k, v in before.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+
+
+def run_request(
+    request: Dict[str, Any], kernels: Optional[KernelPool] = None
+) -> Dict[str, Any]:
+    with _environ(request["env"]):
+        try:
+            result = local_exec_env(kernels=kernels)
+            return {"result": result.dict()}
+        except Exception as e:
+            return {"error": str(e)}
+
+
+def warm_exec_serve(
+    socket_path: str,
+    max_runs: int = defaults.WARM_MAX_RUNS,
+    idle_secs: int = defaults.WARM_IDLE_SECS,
+    kernels: Optional[KernelPool] = None,
+):
+    """
+    Runs inside of a container of the warm pool of an agent.
+    Each connection to `socket_path` sends one json line with the env vars
+    of a task (like the ones used by :class:`NBTaskDocker`),
+    the task runs through :func:`local_exec_env` and the result is
+    returned as a json line. The container exits after `max_runs`,
+    so the agent replaces it with a fresh one, or after `idle_secs`
+    without tasks, in case the agent is gone.
+
+    :param kernels: for the tasks with `kernel_reuse`, it is filled
+    again after each response, while the container waits.
+    """
+    # imported ahead, it is what makes a warm container faster
+    import papermill  # noqa: F401 pylint: disable=unused-import
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(1)
+    server.settimeout(idle_secs)
+    try:
+        for _ in range(max_runs):
+            try:
+                conn, _ = server.accept()
+            except socket.timeout:
+                break
+            conn.settimeout(None)
+            with conn, conn.makefile("rwb") as stream:
+                request = json.loads(stream.readline())
+                response = run_request(request, kernels)
+                stream.write(json.dumps(response).encode("utf-8") + b"\n")
+                stream.flush()
+            if kernels:
+                kernels.fill()
+    finally:
+        server.close()
+        os.remove(socket_path)
+        if kernels:
+            kernels.close()
@@ -0,0 +1,238 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from labfunctions import defaults
+from labfunctions.commands import AsyncDockerCommand, _maybe_await
+from labfunctions.errors.generics import DockerAPIError, WarmRunError, WarmRunTimeout
+from labfunctions.hashes import generate_random
+from labfunctions.types import ExecutionResult
+from labfunctions.types.docker import DockerVolume
+
+# (projectid, docker image, gpu support)
+PoolKey = Tuple[str, str, bool]
+
+logger = logging.getLogger("nbworkf.server")
+
+
+class WarmContainer:
+    __slots__ = ("cid", "key", "socket_path", "runs")
+
+    def __init__(self, cid: str, key: PoolKey, socket_path: str):
+        self.cid = cid
+        self.key = key
+        self.socket_path = socket_path
+        self.runs = 0
+
+    async def request(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        reader, writer = await asyncio.open_unix_connection(
+            self.socket_path, limit=2**24
+        )
+        try:
+            writer.write(json.dumps(data).encode("utf-8") + b"\n")
+            await writer.drain()
+            line = await reader.readline()
+        finally:
+            writer.close()
+        if not line:
+            raise ConnectionError(f"Warm container {self.cid} closed the socket")
+        return json.loads(line)
+
+
+class WarmPool:
+    cmd = "lab exec warm"
+
+    def __init__(
+        self,
+        docker: AsyncDockerCommand,
+        size: int = 2,
+        max_runs: int = defaults.WARM_MAX_RUNS,
+        max_mem_mb: Optional[int] = None,
+        sockets_dir: str = defaults.WARM_SOCKETS_DIR,
+        tasks_dir: str = defaults.TASKS_DIR,
+        start_timeout: int = 120,
+        poll_secs: int = 5,
+    ):
+        """
+        Containers started ahead by runtime image, waiting for tasks on a
+        unix socket (see :func:`labfunctions.executors.warm_exec.warm_exec_serve`).
+        It saves the start of a container and the imports of python libs
+        of each run.
+        A container is replaced after `max_runs` or if it uses more
+        than `max_mem_mb` after a run.
+        When every container of an image is busy :meth:`acquire` returns
+        None, and the task should run in a new container as usual.
+        The containers of a project are not shared with other projects,
+        they keep the env, files and state of the previous runs.
+
+        :param docker: docker client shared with the agent
+        :param size: containers kept by project and image
+        :param sockets_dir: a dir of the host shared with the containers
+        :param tasks_dir: where big tasks are written, see :class:`NBTaskDocker`
+        :param start_timeout: secs to wait for a new container
+        :param poll_secs: how often `should_stop` is checked
+        """
+        self.docker = docker
+        self.size = size
+        self.max_runs = max_runs
+        self.max_mem = max_mem_mb * 1024 * 1024 if max_mem_mb else None
+        self.sockets_dir = sockets_dir
+        self.tasks_dir = tasks_dir
+        self.start_timeout = start_timeout
+        self.poll_secs = poll_secs
+        self._idle: Dict[PoolKey, List[WarmContainer]] = {}
+        self._alive: Dict[PoolKey, int] = {}
+        self._background: Set[asyncio.Future] = set()
+
+    async def _start(self, key: PoolKey) -> WarmContainer:
+        _, image, gpu = key
+        name = generate_random(size=12)
+        socket_path = f"{self.sockets_dir}/{name}.sock"
+        inner_socket = f"{defaults.WARM_SOCKETS_MOUNT}/{name}.sock"
+        os.makedirs(self.sockets_dir, exist_ok=True)
+        os.makedirs(self.tasks_dir, exist_ok=True)
+        cid = await self.docker.start(
+            f"{self.cmd} --socket {inner_socket} --max-runs {self.max_runs}",
+            image,
+            require_gpu=gpu,
+            auto_remove=True,
+            env_data={defaults.BASE_PATH_ENV: "/app"},
+            volumes=[
+                DockerVolume(
+                    orig_mount=self.sockets_dir,
+                    dst_mount=defaults.WARM_SOCKETS_MOUNT,
+                ),
+                DockerVolume(orig_mount=self.tasks_dir, dst_mount=defaults.TASKS_MOUNT),
+            ],
+        )
+        deadline = time.monotonic() + self.start_timeout
+        while not os.path.exists(socket_path):
+            if time.monotonic() > deadline:
+                await self.docker.remove(cid)
+                raise TimeoutError(f"Warm container for {image} didn't start")
+            await asyncio.sleep(0.1)
+        return WarmContainer(cid, key, socket_path)
+
+    async def _add(self, key: PoolKey):
+        """Starts a container in the background and keeps it idle"""
+        try:
+            wc = await self._start(key)
+            self._idle.setdefault(key, []).append(wc)
+        except (DockerAPIError, TimeoutError, OSError) as e:
+            self._alive[key] -= 1
+            logger.error(f"Warm container for {key[1]} failed: {e}")
+
+    def _spawn(self, key: PoolKey, n: int):
+        for _ in range(n):
+            self._alive[key] = self._alive.get(key, 0) + 1
+            task = asyncio.ensure_future(self._add(key))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+
+    def acquire(self, key: PoolKey) -> Optional[WarmContainer]:
+        """An idle container, None if there isn't any, in that case new
+        containers for the image start in the background."""
+        idle = self._idle.get(key, [])
+        while idle:
+            wc = idle.pop()
+            if os.path.exists(wc.socket_path):
+                return wc
+            # it exited after being idle for too long
+            self._alive[key] -= 1
+        self._spawn(key, self.size - self._alive.get(key, 0))
+        return None
+
+    async def _discard(self, wc: WarmContainer):
+        self._alive[wc.key] -= 1
+        try:
+            await self.docker.remove(wc.cid)
+        except DockerAPIError as e:
+            logger.warning(f"Removing warm container {wc.cid} failed: {e}")
+        self._spawn(wc.key, self.size - self._alive[wc.key])
+
+    async def release(self, wc: WarmContainer, ok: bool = True):
+        """Puts the container back or replaces it"""
+        recycle = not ok or wc.runs >= self.max_runs
+        if not recycle and self.max_mem:
+            try:
+                recycle = await self.docker.memory_usage(wc.cid) > self.max_mem
+            except DockerAPIError:
+                recycle = True
+        if recycle:
+            await self._discard(wc)
+        else:
+            self._idle.setdefault(wc.key, []).append(wc)
+
+    async def run(
+        self,
+        wc: WarmContainer,
+        env: Dict[str, Any],
+        timeout: int,
+        should_stop: Optional[Callable[[], Any]] = None,
+        on_log: Optional[Callable[[str], Any]] = None,
+    ) -> ExecutionResult:
+        """
+        Runs a task in a container given by :meth:`acquire`,
+        the container is released after the run.
+
+        :param env: env vars of the task, see :meth:`NBTaskDocker.prepare_env`
+        """
+        wc.runs += 1
+        ok = False
+        logs = None
+        if on_log:
+            logs = asyncio.ensure_future(
+                self.docker.follow_logs(wc.cid, None, on_log, since=int(time.time()))
+            )
+        request = asyncio.ensure_future(wc.request({"env": env}))
+        started = time.monotonic()
+        try:
+            response = await self._wait(request, timeout, should_stop)
+            ok = response is not None and "result" in response
+        finally:
+            request.cancel()
+            if logs:
+                logs.cancel()
+            await self.release(wc, ok)
+        if response is None and time.monotonic() - started >= timeout:
+            raise WarmRunTimeout(f"Task in {wc.cid} timeout")
+        if response is None:
+            raise WarmRunError(f"Task in {wc.cid} stopped")
+        if not ok:
+            raise WarmRunError(response.get("error"))
+        return ExecutionResult(**response["result"])
+
+    async def _wait(
+        self,
+        request: asyncio.Future,
+        timeout: int,
+        should_stop: Optional[Callable[[], Any]] = None,
+    ) -> Optional[Dict[str, Any]]:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return None
+            done, _ = await asyncio.wait(
+                {request}, timeout=min(self.poll_secs, remaining)
+            )
+            if done:
+                try:
+                    return request.result()
+                except (OSError, ValueError) as e:
+                    return {"error": str(e)}
+            if should_stop and await _maybe_await(should_stop()):
+                return None
+
+    async def close(self):
+        for task in list(self._background):
+            task.cancel()
+        for containers in self._idle.values():
+            for wc in containers:
+                await self.docker.remove(wc.cid)
+        self._idle = {}
+        self._alive = {}
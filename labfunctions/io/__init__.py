@@ -1,5 +1,5 @@
 from .kvspec import AsyncKVSpec, GenericKVSpec
-from .memory_store import MemoryStore
+from .memory_store import MemoryStore, TTLCache
 
 # __all__ = [
 #    "MemoryStore",
@@ -1,30 +1,45 @@
-# import tempfile
-import json
+import hashlib
 import logging
+import mmap
+import os
+import pickle
+import struct
+import threading
 import time
-from dataclasses import asdict, dataclass
+from collections import OrderedDict
+from dataclasses import dataclass
 from datetime import datetime
 from functools import wraps
-from typing import Any, Dict, Optional
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
 import cloudpickle
-import httpx
 
+from labfunctions import defaults
 from labfunctions.conf.client_settings import settings
-
-# from labfunctions.workflows.core import build_context
 from labfunctions.types import SimpleExecCtx
+from labfunctions.utils import mkdir_p
+
+from .kvspec import GenericKVSpec, KeyReadError, KeyWriteError
 
 logger = logging.getLogger(__name__)
 
-VALID_STRATEGIES = ["local", "fileserver"]
+VALID_STRATEGIES = ["memory", "local", "fileserver", "kv"]
+
+# an entry serialized starts with: magic, unix timestamp of its creation,
+# size of the pickle and number of out of band buffers
+_MAGIC = b"LFC5"
+_HEADER = struct.Struct("!4sdQI")
+_SIZE = struct.Struct("!Q")
+_ALIGN = 64
+_MISS = object()
 
 
 @dataclass
 class CacheConfig:
     name: str
     ctx: SimpleExecCtx
-    valid_for_min: int = 60
+    valid_for_min: Optional[int] = 60
     strategy: str = "local"
 
 
@@ -49,92 +64,427 @@ def build_ctx(wfid, execid, now=None) -> SimpleExecCtx:
     )
 
 
-def _write_pickle(name, data, ctx: SimpleExecCtx):
-    fpath = f"/tmp/{ctx.wfid}.{ctx.execid}.{name}.pickle"
-    metapath = f"/tmp/{ctx.wfid}.{ctx.execid}.{name}.json"
-    with open(fpath, "wb") as f:
-        f.write(cloudpickle.dumps(data))
-        logger.debug("CACHE: Wrote to %s", fpath)
-    with open(metapath, "w", encoding="utf-8") as f:
-        json.dump(asdict(ctx), f)
-
+def func_identity(func, name: Optional[str] = None) -> str:
+    """Name of the function and a hash of its code, so a result
+    is not reused when the function changes"""
+    code = getattr(func, "__code__", None)
+    h = hashlib.sha256()
+    if code is not None:
+        h.update(code.co_code)
+        h.update(repr(code.co_consts).encode("utf-8"))
+    fname = name or f"{func.__module__}.{func.__qualname__}"
+    return f"{fname}.{h.hexdigest()[:16]}"
 
-def _restore_pickle(name, ctx: SimpleExecCtx):
-    fpath = f"/tmp/{ctx.wfid}.{ctx.execid}.{name}.pickle"
-    metapath = f"/tmp/{ctx.wfid}.{ctx.execid}.{name}.json"
-    try:
-        with open(fpath, "rb") as f:
-            data = cloudpickle.load(f)
-            logger.debug("CACHE: Reading from %s", fpath)
-        with open(metapath, "r") as f:
-            data = f.read()
-            meta = json.loads(data)
-
-        return data, meta
-    except EOFError:
-        return None
-    except FileNotFoundError:
-        return None
 
+def cache_key(identity: str, args, kwargs, namespace: Optional[str] = None) -> str:
+    """
+    Key of a call: the identity of the function (see :func:`func_identity`)
+    and the hash of its arguments, it doesn't depend on the execution.
 
-def _write_fileserver(name, data, ctx: SimpleExecCtx):
-    urlpath = f"{settings.EXT_KV_LOCAL_ROOT}/cache/{ctx.wfid}.{ctx.execid}.{name}"
-    metapath = f"{settings.EXT_KV_LOCAL_ROOT}/cache/{ctx.wfid}.{ctx.execid}.{name}.json"
-    blob = cloudpickle.dumps(data)
-    rsp = httpx.put(urlpath, content=blob)
-    rsp2 = httpx.put(metapath, json=asdict(ctx))
-    if rsp.status_code > 202 and rsp2.status_code > 202:
-        logger.warning("CACHE: writing to fileserver failed %s", urlpath)
-    else:
-        logger.debug("CACHE: wrote to fileserver %s", urlpath)
-
-
-def _restore_fileserver(name, ctx: SimpleExecCtx):
-    urlpath = f"{settings.EXT_KV_LOCAL_ROOT}/cache/{ctx.wfid}.{ctx.execid}.{name}"
-    metapath = f"{settings.EXT_KV_LOCAL_ROOT}/cache/{ctx.wfid}.{ctx.execid}.{name}.json"
-    data = None
-    meta = None
-
+    :raises TypeError: if the arguments can't be pickled
+    """
     try:
-        rsp = httpx.get(urlpath)
-        rsp2 = httpx.get(metapath)
-        if rsp.status_code == 200 and rsp2.status_code == 200:
-            data = cloudpickle.loads(rsp.content)
-            meta = rsp2.json()
-            logger.debug("CACHE: Reading from fileserver %s", urlpath)
+        blob = cloudpickle.dumps((args, sorted(kwargs.items())))
     except Exception as e:
-        logger.warning(e)
-    return data, meta
-
-
-def is_valid_date(cache_dt: str, valid_for_min: int) -> bool:
-    dt = datetime.fromisoformat(cache_dt)
-    now = datetime.utcnow()
-    elapsed = round((now - dt).seconds / 60)
-    if elapsed > valid_for_min:
-        return False
-    return True
-
-
-def cache_manager_write(data, conf: CacheConfig):
-    if conf.strategy == "local" and conf.ctx.wfid:
-        _write_pickle(conf.name, data, conf.ctx)
-    elif conf.strategy == "fileserver" and conf.ctx.wfid:
-        _write_fileserver(conf.name, data, conf.ctx)
-    else:
-        logger.warning("CACHE: Invalid caching strategy %s", conf.strategy)
-
-
-def cache_manager_read(conf: CacheConfig):
-    data = None
-    meta = None
-    if conf.strategy == "local" and conf.ctx.wfid:
-        data, meta = _restore_pickle(conf.name, conf.ctx)
-    elif conf.strategy == "fileserver" and conf.ctx.wfid:
-        data, meta = _restore_fileserver(conf.name, conf.ctx)
+        raise TypeError(f"arguments of {identity} can't be hashed: {e}")
+    digest = hashlib.sha256(identity.encode("utf-8") + blob).hexdigest()
+    return f"{namespace or 'default'}/{digest}"
+
+
+def dump(value: Any, created: Optional[float] = None) -> Tuple[List[Any], int]:
+    """
+    Serializes `value` with pickle protocol 5. The buffers of numpy
+    arrays, pandas frames and arrow tables are kept out of the pickle,
+    and each one starts aligned to `_ALIGN` bytes, so they are loaded
+    from a memory map without copying them (see :func:`load`).
+    Layout: header, size of each buffer, pickle, buffers.
+
+    :return: the chunks to write, views of the buffers of `value`
+    instead of copies, and their total size
+    """
+    buffers: List[pickle.PickleBuffer] = []
+    data = cloudpickle.dumps(value, protocol=5, buffer_callback=buffers.append)
+    views = []
+    for buf in buffers:
+        try:
+            views.append(buf.raw())
+        except BufferError:
+            # not contiguous
+            views.append(memoryview(memoryview(buf).tobytes()))
+    header = _HEADER.pack(_MAGIC, created or time.time(), len(data), len(views))
+    header += b"".join(_SIZE.pack(v.nbytes) for v in views)
+    chunks: List[Any] = [header, data]
+    size = len(header) + len(data)
+    for v in views:
+        pad = -size % _ALIGN
+        chunks.extend([b"\0" * pad, v])
+        size += pad + v.nbytes
+    return chunks, size
+
+
+def read_created(raw) -> Optional[float]:
+    """:return: None if `raw` is not an entry of the cache"""
+    if len(raw) < _HEADER.size:
+        return None
+    magic, created, _, _ = _HEADER.unpack_from(raw)
+    return created if magic == _MAGIC else None
+
+
+def load(raw) -> Any:
+    """
+    `raw` could be a mmap of the file of the entry, the buffers are
+    views of it. When `raw` is a bytes object they are read only.
+    """
+    view = memoryview(raw)
+    _, _, data_size, nbuffers = _HEADER.unpack_from(view)
+    pos = _HEADER.size
+    sizes = [_SIZE.unpack_from(view, pos + i * _SIZE.size)[0] for i in range(nbuffers)]
+    pos += nbuffers * _SIZE.size
+    data = view[pos : pos + data_size]
+    pos += data_size
+    buffers = []
+    for size in sizes:
+        pos += -pos % _ALIGN
+        buffers.append(view[pos : pos + size])
+        pos += size
+    return pickle.loads(data, buffers=buffers)
+
+
+def _slices(chunks: List[Any], size: int = defaults.UPLOAD_CHUNK_SIZE):
+    """Chunks of at most `size` bytes, only one of them is copied
+    at a time"""
+    for chunk in chunks:
+        view = memoryview(chunk).cast("B")
+        for i in range(0, view.nbytes, size):
+            yield bytes(view[i : i + size])
+
+
+def _map(fpath) -> Optional[mmap.mmap]:
+    """A private map of the file, None if it is empty"""
+    with open(fpath, "rb") as f:
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        except ValueError:
+            return None
+
+
+def is_fresh(created: float, ttl: Optional[float]) -> bool:
+    return ttl is None or time.time() - created <= ttl
+
+
+class MemoryTier:
+    def __init__(self, max_bytes: int = defaults.CACHE_MEMORY_MB * 1024 * 1024):
+        """
+        Results kept as python objects, a hit doesn't deserialize them:
+        every hit of a key returns the same instance, a caller that
+        mutates it changes the result seen by the next hits.
+        The size of an entry is the size of its serialized version.
+        The least recently used entries are evicted when they use more
+        than `max_bytes`.
+        """
+        self.max_bytes = max_bytes
+        self.used = 0
+        # key -> (created, value, size)
+        self._data: "OrderedDict[str, Tuple[float, Any, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, ttl: Optional[float] = None) -> Any:
+        """The cached instance itself, not a copy"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return _MISS
+            created, value, _ = item
+            if not is_fresh(created, ttl):
+                self._pop(key)
+                return _MISS
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: Any, size: int, created: float):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._pop(key)
+            self._data[key] = (created, value, size)
+            self.used += size
+            while self.used > self.max_bytes:
+                self._pop(next(iter(self._data)))
+
+    def _pop(self, key: str):
+        item = self._data.pop(key, None)
+        if item is not None:
+            self.used -= item[2]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.used = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class DiskTier:
+    def __init__(
+        self,
+        root: str = defaults.CACHE_DIR,
+        max_bytes: int = defaults.CACHE_DISK_MB * 1024 * 1024,
+    ):
+        """
+        Serialized results as files in `root`, shared by the processes
+        of the machine. The modification time of a file is updated
+        in each hit, the oldest files are removed when they use more
+        than `max_bytes`.
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        self._used: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def path(self, key: str) -> Path:
+        return Path(self.root, *key.split("/"))
+
+    def get(self, key: str) -> Optional[mmap.mmap]:
+        """A private map of the file: its pages are shared with other
+        readers until they are written"""
+        fpath = self.path(key)
+        try:
+            mapped = _map(fpath)
+        except FileNotFoundError:
+            return None
+        if mapped is not None:
+            os.utime(fpath)
+        return mapped
+
+    def remove(self, key: str):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def put(self, key: str, chunks: Iterable[Any], size: Optional[int] = None):
+        """`chunks` are written as they come, they could be streamed
+        from another tier"""
+        if size is not None and size > self.max_bytes:
+            return
+        tmp, written = self._write(key, chunks)
+        if written > self.max_bytes:
+            os.remove(tmp)
+            return
+        self._commit(key, tmp, written)
+
+    def fetch(self, key: str, chunks: Iterable[Any]) -> Optional[mmap.mmap]:
+        """Like :meth:`put` followed by :meth:`get`. An entry larger than
+        `max_bytes` is not kept, but it is still mapped from its temporary
+        file, which is removed once mapped."""
+        tmp, written = self._write(key, chunks)
+        if written > self.max_bytes:
+            try:
+                return _map(tmp)
+            finally:
+                os.remove(tmp)
+        self._commit(key, tmp, written)
+        return self.get(key)
+
+    def _write(self, key: str, chunks: Iterable[Any]) -> Tuple[Path, int]:
+        fpath = self.path(key)
+        mkdir_p(fpath.parent)
+        # readers never see a file half written
+        tmp = fpath.with_name(f".{fpath.name}.{os.getpid()}.{threading.get_ident()}")
+        written = 0
+        try:
+            with open(tmp, "wb") as f:
+                for chunk in chunks:
+                    written += f.write(chunk)
+        except BaseException:
+            if tmp.exists():
+                os.remove(tmp)
+            raise
+        return tmp, written
+
+    def _commit(self, key: str, tmp: Path, written: int):
+        os.replace(tmp, self.path(key))
+        with self._lock:
+            if self._used is None:
+                self._used = sum(size for _, size, _ in self._files())
+            else:
+                self._used += written
+            if self._used > self.max_bytes:
+                self._evict()
+
+    def _files(self) -> List[Tuple[float, int, str]]:
+        files = []
+        for dirpath, _, names in os.walk(self.root):
+            for name in names:
+                fpath = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(fpath)
+                except FileNotFoundError:
+                    continue
+                files.append((st.st_mtime, st.st_size, fpath))
+        return files
+
+    def _evict(self):
+        """Other processes could write in the same dir,
+        so the size is taken again from the files"""
+        files = sorted(self._files())
+        used = sum(size for _, size, _ in files)
+        for _, size, fpath in files:
+            if used <= self.max_bytes:
+                break
+            try:
+                os.remove(fpath)
+                used -= size
+            except FileNotFoundError:
+                pass
+        self._used = used
+
+
+class KVTier:
+    def __init__(self, kv: GenericKVSpec, prefix: str = defaults.CACHE_KV_PREFIX):
+        """
+        Serialized results in a :class:`GenericKVSpec`, shared between
+        machines. Expired entries are ignored, but they are not removed:
+        the kv spec doesn't delete keys, the bucket should have its own
+        lifecycle rules.
+        """
+        self.kv = kv
+        self.prefix = prefix
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            return self.kv.get(self._key(key)) or None
+        except KeyReadError:
+            return None
+
+    def get_stream(self, key: str):
+        return self.kv.get_stream(self._key(key))
+
+    def put(self, key: str, chunks: Iterable[Any], size: Optional[int] = None):
+        self.kv.put_stream(self._key(key), _slices(chunks))
+
+
+class TieredCache:
+    def __init__(self, memory: Optional[MemoryTier] = None, *tiers):
+        """
+        A result is looked up in `memory` and then in each of `tiers`
+        (:class:`DiskTier`, :class:`KVTier`) in order. A hit in the kv
+        store is streamed to the disk tier and loaded from it, so the
+        result is not in memory twice (see :meth:`DiskTier.fetch`). A result is serialized once
+        when it is written to every tier (see :func:`dump`).
+        """
+        self.memory = memory
+        self.tiers = tiers
+        self.disk = next((t for t in tiers if isinstance(t, DiskTier)), None)
+
+    def _read(self, tier, key: str):
+        if not isinstance(tier, KVTier) or self.disk is None:
+            return tier.get(key)
+        try:
+            return self.disk.fetch(key, tier.get_stream(key))
+        except KeyReadError:
+            return None
+
+    def get(self, key: str, ttl: Optional[float] = None) -> Any:
+        """:return: `_MISS` if the key is not found or expired"""
+        if self.memory is not None:
+            value = self.memory.get(key, ttl)
+            if value is not _MISS:
+                return value
+        for tier in self.tiers:
+            try:
+                raw = self._read(tier, key)
+            except Exception as e:
+                logger.warning("CACHE: reading %s failed: %s", key, e)
+                continue
+            if raw is None:
+                continue
+            created = read_created(raw)
+            if created is None or not is_fresh(created, ttl):
+                if created is None and self.disk is not None:
+                    # an error page of a fileserver or an old format
+                    self.disk.remove(key)
+                continue
+            value = load(raw)
+            if self.memory is not None:
+                self.memory.put(key, value, len(raw), created)
+            logger.debug("CACHE: hit %s in %s", key, type(tier).__name__)
+            return value
+        return _MISS
+
+    def _put_tier(self, tier, key: str, chunks: List[Any], size: int):
+        try:
+            tier.put(key, chunks, size)
+        except (OSError, KeyWriteError) as e:
+            logger.warning("CACHE: writing %s failed: %s", key, e)
+
+    def put(self, key: str, value: Any):
+        created = time.time()
+        try:
+            chunks, size = dump(value, created)
+        except Exception as e:
+            logger.warning("CACHE: result of %s can't be pickled: %s", key, e)
+            return
+        if self.memory is not None:
+            self.memory.put(key, value, size, created)
+        for tier in self.tiers:
+            self._put_tier(tier, key, chunks, size)
+
+
+_memory = MemoryTier()
+_disk: Optional[DiskTier] = None
+_caches: Dict[str, TieredCache] = {}
+
+
+def _disk_tier() -> DiskTier:
+    global _disk
+    if _disk is None:
+        _disk = DiskTier()
+    return _disk
+
+
+def get_cache(strategy: str = "local") -> TieredCache:
+    """
+    Caches shared by the process for each strategy:
+    memory: only in memory
+    local: memory and disk
+    fileserver: memory, disk and the fileserver in `EXT_KV_LOCAL_ROOT`
+    kv: memory, disk and the projects store of the client settings
+
+    The entries of the disk, fileserver and kv tiers are unpickled
+    by :func:`load`, which only checks their magic header: whoever
+    can write in the cache dir, the fileserver or the bucket can run
+    code in the processes reading from it. Use "fileserver" and "kv"
+    only with stores written by trusted workflows.
+    """
+    cache = _caches.get(strategy)
+    if cache is not None:
+        return cache
+    if strategy == "memory":
+        cache = TieredCache(_memory)
+    elif strategy == "local":
+        cache = TieredCache(_memory, _disk_tier())
+    elif strategy == "fileserver":
+        kv = GenericKVSpec.create(
+            "labfunctions.io.kv_files.KVFiles",
+            defaults.CACHE_KV_PREFIX,
+            {"url": settings.EXT_KV_LOCAL_ROOT},
+        )
+        cache = TieredCache(_memory, _disk_tier(), KVTier(kv, prefix=""))
+    elif strategy == "kv":
+        kv = GenericKVSpec.create(
+            settings.PROJECTS_STORE_CLASS, settings.PROJECTS_STORE_BUCKET
+        )
+        prefix = f"{settings.PROJECTID}/{defaults.CACHE_KV_PREFIX}"
+        cache = TieredCache(_memory, _disk_tier(), KVTier(kv, prefix=prefix))
     else:
-        logger.warning("CACHE: Invalid caching strategy %s", conf.strategy)
-    return data, meta
+        raise TypeError(f"Invalid caching strategy {strategy}")
+    _caches[strategy] = cache
+    return cache
 
 
 def frozen_result(
@@ -144,7 +494,22 @@ def frozen_result(
     valid_for_min=60,
     strategy="local",
     from_global: Optional[Dict[str, Any]] = None,
+    cache: Optional[TieredCache] = None,
 ):
+    """
+    Caches the results of a function by its code and its arguments,
+    so the results are reused by the next executions of the workflow
+    while they are younger than `valid_for_min` (None never expires).
+
+    A hit in memory returns the same object returned by the previous
+    calls, not a copy: a result that is going to be mutated should be
+    copied by the caller. See :func:`get_cache` about the trust in the
+    stores shared between machines.
+
+    :param name: used instead of the name of the function in the key
+    :param strategy: one of VALID_STRATEGIES, see :func:`get_cache`
+    :param cache: a cache to use instead of the one of `strategy`
+    """
 
     if not wfid and not from_global:
         raise TypeError("wfid or global should be provided")
@@ -157,32 +522,26 @@ def frozen_result(
     cache_conf = CacheConfig(
         name=name, ctx=ctx, valid_for_min=valid_for_min, strategy=strategy
     )
+    _cache = cache or get_cache(strategy)
+    ttl = valid_for_min * 60 if valid_for_min is not None else None
 
     def decorate(func):
+        identity = func_identity(func, cache_conf.name)
+
         @wraps(func)
         def wrapper(*args, **kwargs):
-            if not cache_conf.name:
-                cache_conf.name = func.__name__
-
-            result, meta = cache_manager_read(cache_conf)
-            valid = False
-            if meta:
-                valid = is_valid_date(meta["execution_dt"], valid_for_min)
-            if not result or not valid:
+            try:
+                key = cache_key(identity, args, kwargs, namespace=cache_conf.ctx.wfid)
+            except TypeError as e:
+                logger.warning("CACHE: %s", e)
+                return func(*args, **kwargs)
+
+            result = _cache.get(key, ttl)
+            if result is _MISS:
                 result = func(*args, **kwargs)
-                cache_manager_write(result, cache_conf)
+                _cache.put(key, result)
             return result
 
         return wrapper
 
     return decorate
-
-
-if __name__ == "__main__":
-
-    @frozen_result(wfid="test", execid="test_t", strategy="fileserver", valid_for_min=5)
-    def my_func(msg):
-        print(msg)
-        return msg * 2
-
-    my_func("hello world")
@@ -1,86 +1,207 @@
-from typing import Any, AsyncGenerator, Dict, Generator, Union
+from functools import partial
+from typing import Any, AsyncGenerator, Dict, Generator, Optional, Union
 
 import httpx
 
-from .kvspec import AsyncKVSpec, GenericKVSpec
+from labfunctions import defaults
+
+from . import transfer
+from .kvspec import AsyncKVSpec, GenericKVSpec, KeyReadError
+
+
+def _has_http2() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def client_args(opts: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Options of the http client shared by the requests of a store:
+    url, timeout, max_connections, max_keepalive, keepalive (secs)
+    and http2, used only if the h2 package is installed.
+    """
+    limits = httpx.Limits(
+        max_connections=opts.get("max_connections", defaults.KV_MAX_CONNECTIONS),
+        max_keepalive_connections=opts.get("max_keepalive", defaults.KV_MAX_KEEPALIVE),
+        keepalive_expiry=opts.get("keepalive", defaults.KV_KEEPALIVE_SECS),
+    )
+    return dict(
+        timeout=opts.get("timeout", defaults.KV_TIMEOUT),
+        limits=limits,
+        http2=opts.get("http2", True) and _has_http2(),
+    )
+
+
+def _range(part: transfer.Part) -> Dict[str, str]:
+    return {"Range": f"bytes={part[0]}-{part[1]}"}
 
 
 class KVFiles(GenericKVSpec):
     def __init__(self, bucket: str, client_opts: Dict[str, Any] = {}):
+        """The connections to the fileserver are kept alive and
+        reused until :meth:`close`, see :func:`client_args`"""
         self._opts = client_opts
         self._bucket = bucket
+        self._client: Optional[httpx.Client] = None
 
     @property
     def url(self):
         return f"{self._opts['url']}/{self._bucket}"
 
+    @property
+    def client(self) -> httpx.Client:
+        if self._client is None:
+            self._client = httpx.Client(**client_args(self._opts))
+        return self._client
+
     def put(self, key: str, bdata: bytes):
-        ts = self._opts.get("timeout", 60)
-        with httpx.Client(timeout=ts) as client:
-            r = client.put(f"{self.url}/{key}", content=bdata)
+        r = self.client.put(f"{self.url}/{key}", content=bdata)
         if r.status_code == 201:
             return True
         return False
 
     def put_stream(self, key: str, generator: Generator[bytes, None, None]) -> bool:
-        ts = self._opts.get("timeout", 60)
-        with httpx.Client(timeout=ts) as client:
-            r = client.put(f"{self.url}/{key}", content=generator())
+        r = self.client.put(f"{self.url}/{key}", content=generator)
         if r.status_code == 201:
             return True
         return False
 
     def get(self, key: str) -> Union[bytes, None]:
-        with httpx.Client() as client:
-            r = client.get(f"{self.url}/{key}")
+        r = self.client.get(f"{self.url}/{key}")
         if r.status_code == 200:
             return r.content
         return None
 
     def get_stream(self, key: str) -> Generator[bytes, None, None]:
-
-        with httpx.Client() as client:
-            with client.stream("GET", f"{self.url}/{key}") as r:
-                for raw in r.iter_raw():
-                    yield raw
+        with self.client.stream("GET", f"{self.url}/{key}") as r:
+            if r.status_code != 200:
+                raise KeyReadError(self._bucket, key, f"status {r.status_code}")
+            for raw in r.iter_raw():
+                yield raw
+
+    def _fetch(self, key: str, part: transfer.Part) -> bytes:
+        r = self.client.get(f"{self.url}/{key}", headers=_range(part))
+        if r.status_code != 206:
+            raise KeyReadError(self._bucket, key, f"status {r.status_code}")
+        return r.content
+
+    def get_file(
+        self,
+        key: str,
+        fpath: str,
+        parallel: int = defaults.KV_PARALLEL_PARTS,
+        part_size: int = defaults.KV_PART_SIZE,
+    ):
+        """The parts are downloaded as ranges, if the fileserver doesn't
+        support them the file is streamed"""
+        with self.client.stream(
+            "GET", f"{self.url}/{key}", headers=_range((0, part_size - 1))
+        ) as r:
+            if r.status_code == 200:
+                transfer.stream_to_file(r.iter_bytes(), fpath)
+                return
+            if r.status_code == 416:
+                transfer.stream_to_file([], fpath)
+                return
+            if r.status_code != 206:
+                raise KeyReadError(self._bucket, key, f"status {r.status_code}")
+            first = r.read()
+        size = transfer.range_total(r.headers["Content-Range"])
+        try:
+            transfer.download_parts(
+                partial(self._fetch, key), size, fpath, parallel, part_size, first
+            )
+        except ValueError as e:
+            raise KeyReadError(self._bucket, key, str(e))
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
 
 
 class AsyncKVFiles(AsyncKVSpec):
     def __init__(self, bucket: str, client_opts: Dict[str, Any] = {}):
+        """The connections to the fileserver are kept alive and
+        reused until :meth:`close`, see :func:`client_args`"""
         self._opts = client_opts
         self._bucket = bucket
+        self._client: Optional[httpx.AsyncClient] = None
 
     @property
     def url(self):
         return f"{self._opts['url']}/{self._bucket}"
 
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # created inside of the loop of the server
+        if self._client is None:
+            self._client = httpx.AsyncClient(**client_args(self._opts))
+        return self._client
+
     async def put(self, key: str, bdata: bytes):
-        async with httpx.AsyncClient() as client:
-            r = await client.put(f"{self.url}/{key}", content=bdata)
-            if r.status_code == 201:
-                return True
+        r = await self.client.put(f"{self.url}/{key}", content=bdata)
+        if r.status_code == 201:
+            return True
         return False
 
     async def put_stream(
         self, key: str, generator: Generator[bytes, None, None]
     ) -> bool:
-        ts = self._opts.get("timeout", 60)
-        async with httpx.AsyncClient(timeout=ts) as client:
-            r = await client.put(f"{self.url}/{key}", content=generator)
-            if r.status_code == 201:
-                return True
+        r = await self.client.put(f"{self.url}/{key}", content=generator)
+        if r.status_code == 201:
+            return True
         return False
 
     async def get(self, key: str) -> Union[bytes, None]:
-        ts = self._opts.get("timeout", 60)
-        async with httpx.AsyncClient(timeout=ts) as client:
-            r = await client.get(f"{self.url}/{key}")
-            return r.content
+        r = await self.client.get(f"{self.url}/{key}")
+        return r.content
 
     async def get_stream(self, key: str) -> AsyncGenerator[bytes, None]:
         u = f"{self.url}/{key}"
-        ts = self._opts.get("timeout", 60)
-        async with httpx.AsyncClient(timeout=ts) as client:
-            async with client.stream("GET", u) as r:
-                async for chunk in r.aiter_bytes():
-                    yield chunk
+        async with self.client.stream("GET", u) as r:
+            async for chunk in r.aiter_bytes():
+                yield chunk
+
+    async def _fetch(self, key: str, part: transfer.Part) -> bytes:
+        r = await self.client.get(f"{self.url}/{key}", headers=_range(part))
+        if r.status_code != 206:
+            raise KeyReadError(self._bucket, key, f"status {r.status_code}")
+        return r.content
+
+    async def get_file(
+        self,
+        key: str,
+        fpath: str,
+        parallel: int = defaults.KV_PARALLEL_PARTS,
+        part_size: int = defaults.KV_PART_SIZE,
+    ):
+        """The parts are downloaded as ranges, if the fileserver doesn't
+        support them the file is streamed"""
+        async with self.client.stream(
+            "GET", f"{self.url}/{key}", headers=_range((0, part_size - 1))
+        ) as r:
+            if r.status_code == 200:
+                await transfer.astream_to_file(r.aiter_bytes(), fpath)
+                return
+            if r.status_code == 416:
+                transfer.stream_to_file([], fpath)
+                return
+            if r.status_code != 206:
+                raise KeyReadError(self._bucket, key, f"status {r.status_code}")
+            first = await r.aread()
+        size = transfer.range_total(r.headers["Content-Range"])
+        try:
+            await transfer.adownload_parts(
+                partial(self._fetch, key), size, fpath, parallel, part_size, first
+            )
+        except ValueError as e:
+            raise KeyReadError(self._bucket, key, str(e))
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -1,14 +1,43 @@
+import asyncio
+import base64
+import hashlib
 import io
+import logging
 import os
+from collections import deque
 from datetime import datetime, timedelta
-from typing import Any, AsyncGenerator, Dict, Generator, Union
+from functools import partial
+from typing import (
+    Any,
+    AsyncGenerator,
+    Deque,
+    Dict,
+    Generator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+from urllib.parse import quote
 
+import google.auth
+import httpx
+from google.auth.transport.requests import Request as AuthRequest
 from google.cloud.storage import Client
+from google.oauth2 import service_account
 from smart_open import open
 
+from labfunctions import defaults
 from labfunctions.utils import run_async
 
-from .kvspec import AsyncKVSpec, GenericKVSpec
+from . import transfer
+from .kv_files import client_args
+from .kvspec import AsyncKVSpec, GenericKVSpec, KeyReadError, KeyWriteError
+
+logger = logging.getLogger(__name__)
+
+_SCOPES = ["https://www.googleapis.com/auth/devstorage.read_write"]
+_RETRY_STATUS = {408, 429, 500, 502, 503, 504}
 
 
 class KVGS(GenericKVSpec):
@@ -64,26 +93,369 @@ class KVGS(GenericKVSpec):
             yield chunk
 
 
-class AsyncKVGS(AsyncKVSpec):
-    """A hacky solution because thereisn't trustworthy async lib"""
+def _credentials(opts: Dict[str, Any]):
+    """None for emulators without auth (`anonymous` option)"""
+    if opts.get("anonymous"):
+        return None
+    service_account_path = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS")
+    if service_account_path:
+        return service_account.Credentials.from_service_account_file(
+            service_account_path, scopes=_SCOPES
+        )
+    creds, _ = google.auth.default(scopes=_SCOPES)
+    return creds
+
+
+def _persisted(rsp: httpx.Response) -> int:
+    """Bytes stored by the server from a 308 response of a resumable upload"""
+    _range = rsp.headers.get("Range")
+    if not _range:
+        return 0
+    return int(_range.rsplit("-", maxsplit=1)[1]) + 1
+
+
+def _md5_hash(rsp: httpx.Response) -> Optional[bytes]:
+    """md5 of the object from a header as `crc32c=n03x6A==,md5=Ojk9c3...`"""
+    for value in rsp.headers.get_list("x-goog-hash", split_commas=True):
+        name, _, digest = value.strip().partition("=")
+        if name == "md5":
+            return base64.b64decode(digest)
+    return None
+
+
+async def _aiter(generator):
+    if hasattr(generator, "__aiter__"):
+        async for data in generator:
+            yield data
+    else:
+        for data in generator:
+            yield data
+
 
+class AsyncKVGS(AsyncKVSpec):
     def __init__(self, bucket: str, client_opts: Dict[str, Any] = {}):
+        """
+        Google Storage through its JSON API with an async http client,
+        no thread is used by a transfer.
+        Streams are uploaded by chunks in a resumable upload, a chunk
+        which fails is sent again from what the server stored. Streams
+        are downloaded by ranges, `parallel` of them at the same time.
+        The requests of the store are bounded by `max_requests`.
+
+        Besides the options of :func:`labfunctions.io.kv_files.client_args`,
+        `client_opts` could have: endpoint (for an emulator), anonymous,
+        chunk_size, parallel, max_requests and retries.
+        """
         self._opts = client_opts
         self._bucket = bucket
-        self.client = KVGS(bucket, client_opts)
+        self.endpoint = client_opts.get("endpoint", defaults.GCS_ENDPOINT)
+        self.chunk_size = client_opts.get("chunk_size", defaults.GCS_CHUNK_SIZE)
+        self.parallel = client_opts.get("parallel", defaults.GCS_PARALLEL_RANGES)
+        self.max_requests = client_opts.get("max_requests", defaults.GCS_MAX_REQUESTS)
+        self.retries = client_opts.get("retries", defaults.GCS_RETRIES)
+        self._creds = _credentials(client_opts)
+        self._client: Optional[httpx.AsyncClient] = None
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._auth_lock: Optional[asyncio.Lock] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # created inside of the loop of the server
+        if self._client is None:
+            self._client = httpx.AsyncClient(**client_args(self._opts))
+        return self._client
+
+    def _object_url(self, key: str) -> str:
+        return f"{self.endpoint}/storage/v1/b/{self._bucket}/o/{quote(key, safe='')}"
+
+    @property
+    def _upload_url(self) -> str:
+        return f"{self.endpoint}/upload/storage/v1/b/{self._bucket}/o"
+
+    async def _headers(self) -> Dict[str, str]:
+        if self._creds is None:
+            return {}
+        if not self._creds.valid:
+            if self._auth_lock is None:
+                self._auth_lock = asyncio.Lock()
+            async with self._auth_lock:
+                if not self._creds.valid:
+                    # once per hour, google-auth only refreshes blocking
+                    await run_async(self._creds.refresh, AuthRequest())
+        return {"Authorization": f"Bearer {self._creds.token}"}
+
+    async def _send(self, method: str, url: str, headers={}, **kwargs):
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.max_requests)
+        async with self._sem:
+            _headers = {**(await self._headers()), **headers}
+            return await self.client.request(method, url, headers=_headers, **kwargs)
+
+    async def _backoff(self, attempt: int):
+        await asyncio.sleep(0.5 * 2**attempt)
+
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Retries transport errors, 429 and 5xx responses"""
+        for attempt in range(self.retries + 1):
+            try:
+                rsp = await self._send(method, url, **kwargs)
+                if rsp.status_code not in _RETRY_STATUS or attempt == self.retries:
+                    return rsp
+            except httpx.TransportError:
+                if attempt == self.retries:
+                    raise
+            await self._backoff(attempt)
+        return rsp
 
     async def put(self, key: str, bdata: bytes):
-        await run_async(self.client.put, key, bdata)
+        rsp = await self._request(
+            "POST",
+            self._upload_url,
+            params={"uploadType": "media", "name": key},
+            content=bdata,
+            headers={"Content-Type": "application/octet-stream"},
+        )
+        if rsp.status_code != 200:
+            raise KeyWriteError(self._bucket, key, rsp.text)
+
+    async def _upload_chunk(
+        self, session: str, chunk: bytes, offset: int, total: Optional[int]
+    ) -> Tuple[int, bool]:
+        """
+        :param total: size of the object, None if it is not the last chunk
+        :return: bytes of the chunk stored by the server and
+        if the upload finished
+        """
+        _total = "*" if total is None else total
+        crange = f"bytes {offset}-{offset + len(chunk) - 1}/{_total}"
+        if not chunk:
+            crange = f"bytes */{_total}"
+        for attempt in range(self.retries + 1):
+            try:
+                rsp = await self._send(
+                    "PUT", session, content=chunk, headers={"Content-Range": crange}
+                )
+                if rsp.status_code in (200, 201):
+                    return len(chunk), True
+                if rsp.status_code == 308:
+                    return _persisted(rsp) - offset, False
+                if rsp.status_code not in _RETRY_STATUS:
+                    raise KeyWriteError(session, offset, rsp.text)
+            except httpx.TransportError:
+                if attempt == self.retries:
+                    raise
+            await self._backoff(attempt)
+            # the server could have stored part of the chunk
+            status = await self._send(
+                "PUT", session, headers={"Content-Range": f"bytes */{_total}"}
+            )
+            if status.status_code in (200, 201):
+                return len(chunk), True
+            if status.status_code == 308 and _persisted(status) > offset:
+                return _persisted(status) - offset, False
+        raise KeyWriteError(session, offset, "too many retries")
+
+    async def _resumable(self, key: str, generator) -> bool:
+        rsp = await self._request(
+            "POST",
+            self._upload_url,
+            params={"uploadType": "resumable", "name": key},
+            headers={"X-Upload-Content-Type": "application/octet-stream"},
+        )
+        if rsp.status_code != 200:
+            raise KeyWriteError(self._bucket, key, rsp.text)
+        session = rsp.headers["Location"]
+        buf = bytearray()
+        offset = 0
+        async for data in _aiter(generator):
+            buf += data
+            while len(buf) >= self.chunk_size:
+                sent, _ = await self._upload_chunk(
+                    session, bytes(buf[: self.chunk_size]), offset, None
+                )
+                del buf[:sent]
+                offset += sent
+        total = offset + len(buf)
+        done = False
+        while not done:
+            sent, done = await self._upload_chunk(session, bytes(buf), offset, total)
+            if not done and not sent:
+                raise KeyWriteError(self._bucket, key, "upload without progress")
+            del buf[:sent]
+            offset += sent
+        return True
 
     async def put_stream(
         self, key: str, generator: Generator[bytes, None, None]
     ) -> bool:
-        rsp = await run_async(self.client.put_stream, key, generator)
-        return rsp
+        try:
+            return await self._resumable(key, generator)
+        except (KeyWriteError, httpx.HTTPError) as e:
+            logger.error(f"Upload of {key} to {self._bucket} failed: {e}")
+            return False
 
     async def get(self, key: str) -> Union[bytes, str, None]:
-        rsp = await run_async(self.client.get, key)
+        rsp = await self._request("GET", self._object_url(key), params={"alt": "media"})
+        if rsp.status_code != 200:
+            raise KeyReadError(self._bucket, key, f"status {rsp.status_code}")
+        return rsp.content
+
+    async def _range(
+        self, key: str, start: int, end: int, generation: Optional[str] = None
+    ) -> httpx.Response:
+        params = {"alt": "media"}
+        if generation:
+            # the same version of the object for every range
+            params["generation"] = generation
+        rsp = await self._request(
+            "GET",
+            self._object_url(key),
+            params=params,
+            headers={"Range": f"bytes={start}-{end}"},
+        )
+        # 416: an empty object
+        if rsp.status_code not in (200, 206, 416):
+            raise KeyReadError(self._bucket, key, f"status {rsp.status_code}")
         return rsp
 
     async def get_stream(self, key: str) -> AsyncGenerator[bytes, None]:
-        yield await run_async(self.client.get_stream, key)
+        first = await self._range(key, 0, self.chunk_size - 1)
+        if first.status_code == 416:
+            return
+        yield first.content
+        if first.status_code == 200:
+            # smaller than a chunk or the server doesn't support ranges
+            return
+        total = int(first.headers["Content-Range"].rsplit("/", maxsplit=1)[1])
+        generation = first.headers.get("x-goog-generation")
+        pending: Deque[asyncio.Future] = deque()
+        try:
+            for start in range(self.chunk_size, total, self.chunk_size):
+                end = min(start + self.chunk_size, total) - 1
+                pending.append(
+                    asyncio.ensure_future(self._range(key, start, end, generation))
+                )
+                if len(pending) >= self.parallel:
+                    yield (await pending.popleft()).content
+            while pending:
+                yield (await pending.popleft()).content
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _fetch(
+        self, key: str, generation: Optional[str], part: transfer.Part
+    ) -> bytes:
+        rsp = await self._range(key, part[0], part[1], generation)
+        return rsp.content
+
+    async def get_file(
+        self,
+        key: str,
+        fpath: str,
+        parallel: int = defaults.KV_PARALLEL_PARTS,
+        part_size: int = defaults.KV_PART_SIZE,
+    ):
+        """Downloads `parallel` ranges at the same time, the file is
+        checked with the md5 of the object when it has one
+        (composed objects only have crc32c)"""
+        first = await self._range(key, 0, part_size - 1)
+        if first.status_code == 416:
+            transfer.stream_to_file([], fpath)
+            return
+        md5 = _md5_hash(first)
+        check = transfer.md5_check(md5) if md5 else None
+        size = len(first.content)
+        if first.status_code == 206:
+            size = transfer.range_total(first.headers["Content-Range"])
+        try:
+            await transfer.adownload_parts(
+                partial(self._fetch, key, first.headers.get("x-goog-generation")),
+                size,
+                fpath,
+                parallel,
+                part_size,
+                first.content,
+                check=check,
+            )
+        except ValueError as e:
+            raise KeyReadError(self._bucket, key, str(e))
+
+    async def _put_part(self, name: str, data: bytes):
+        rsp = await self._request(
+            "POST",
+            self._upload_url,
+            params={"uploadType": "media", "name": name},
+            content=data,
+            headers={"Content-Type": "application/octet-stream"},
+        )
+        if rsp.status_code != 200:
+            raise KeyWriteError(self._bucket, name, rsp.text)
+        md5 = base64.b64encode(hashlib.md5(data).digest()).decode()
+        if rsp.json().get("md5Hash", md5) != md5:
+            raise KeyWriteError(self._bucket, name, "md5 doesn't match")
+
+    async def _compose(self, key: str, names: List[str], size: int):
+        rsp = await self._request(
+            "POST",
+            f"{self._object_url(key)}/compose",
+            json={
+                "sourceObjects": [{"name": n} for n in names],
+                "destination": {"contentType": "application/octet-stream"},
+            },
+        )
+        if rsp.status_code != 200:
+            raise KeyWriteError(self._bucket, key, rsp.text)
+        if int(rsp.json().get("size", size)) != size:
+            raise KeyWriteError(self._bucket, key, "size doesn't match")
+
+    async def _delete(self, name: str):
+        await self._request("DELETE", self._object_url(name))
+
+    async def put_file(
+        self,
+        key: str,
+        fpath: str,
+        parallel: int = defaults.KV_PARALLEL_PARTS,
+        part_size: int = defaults.KV_PART_SIZE,
+    ) -> bool:
+        """
+        A parallel composite upload: the parts are uploaded as temporary
+        objects, `parallel` at the same time, and composed in `key`.
+        Each part is checked with its md5. Files smaller than
+        `part_size` are streamed.
+        """
+        size = os.path.getsize(fpath)
+        if size <= part_size:
+            return await self.put_stream(key, transfer.afile_chunks(fpath))
+        # the parts are composed by only one request
+        part_size = max(part_size, -(-size // defaults.GCS_COMPOSE_MAX))
+        parts = transfer.split_parts(size, part_size)
+        names = [f"{key}.parts/{i}" for i in range(len(parts))]
+        sem = asyncio.Semaphore(parallel)
+
+        async def upload(name: str, part: transfer.Part):
+            async with sem:
+                data = await run_async(transfer.read_part, fpath, part)
+                await self._put_part(name, data)
+
+        tasks = [asyncio.ensure_future(upload(n, p)) for n, p in zip(names, parts)]
+        try:
+            await asyncio.gather(*tasks)
+            await self._compose(key, names, size)
+            return True
+        except (KeyWriteError, httpx.HTTPError) as e:
+            logger.error(f"Upload of {key} to {self._bucket} failed: {e}")
+            return False
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await asyncio.gather(
+                *[self._delete(n) for n in names], return_exceptions=True
+            )
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -1,5 +1,6 @@
 import asyncio
 import os
+import shutil
 import tempfile
 from pathlib import Path
 from typing import Any, AsyncGenerator, Dict, Generator, Union
@@ -7,11 +8,25 @@ from typing import Any, AsyncGenerator, Dict, Generator, Union
 import aiofiles
 from smart_open import open as sopen
 
-from labfunctions.utils import mkdir_p
+from labfunctions import defaults
+from labfunctions.utils import mkdir_p, run_async
 
 from .kvspec import AsyncKVSpec, GenericKVSpec, KeyReadError, KeyWriteError
 
 
+def copy_file(src: str, dst: str):
+    """The destination is replaced only if the copy is complete"""
+    tmp = f"{dst}.{os.getpid()}.part"
+    try:
+        shutil.copyfile(src, tmp)
+        if os.path.getsize(tmp) != os.path.getsize(src):
+            raise IOError(f"{src} changed while it was copied")
+        os.replace(tmp, dst)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
 class KVLocal(GenericKVSpec):
     """https://googleapis.dev/python/storage/latest/client.html"""
 
@@ -67,6 +82,34 @@ class KVLocal(GenericKVSpec):
         except Exception as e:
             raise KeyReadError(self._bucket, key, str(e))
 
+    def put_file(
+        self,
+        key: str,
+        fpath: str,
+        parallel: int = defaults.KV_PARALLEL_PARTS,
+        part_size: int = defaults.KV_PART_SIZE,
+    ) -> bool:
+        """A copy in the kernel (sendfile) is faster than parts"""
+        uri = self.uri(key)
+        mkdir_p(Path(uri).parent)
+        try:
+            copy_file(fpath, uri)
+        except Exception as e:
+            raise KeyWriteError(self._bucket, key, str(e))
+        return True
+
+    def get_file(
+        self,
+        key: str,
+        fpath: str,
+        parallel: int = defaults.KV_PARALLEL_PARTS,
+        part_size: int = defaults.KV_PART_SIZE,
+    ):
+        try:
+            copy_file(self.uri(key), fpath)
+        except Exception as e:
+            raise KeyReadError(self._bucket, key, str(e))
+
 
 class AsyncKVLocal(AsyncKVSpec):
     """For local usage and testing"""
@@ -118,10 +161,37 @@ class AsyncKVLocal(AsyncKVSpec):
         try:
             async with aiofiles.open(uri, mode="rb") as f:
                 while True:
-                    data = await f.read(1024)
+                    data = await f.read(defaults.UPLOAD_CHUNK_SIZE)
                     if not data:
                         break
                     yield data
 
         except Exception as e:
             raise KeyReadError(self._bucket, key, str(e))
+
+    async def put_file(
+        self,
+        key: str,
+        fpath: str,
+        parallel: int = defaults.KV_PARALLEL_PARTS,
+        part_size: int = defaults.KV_PART_SIZE,
+    ) -> bool:
+        uri = self.uri(key)
+        mkdir_p(Path(uri).parent)
+        try:
+            await run_async(copy_file, fpath, uri)
+        except Exception as e:
+            raise KeyWriteError(self._bucket, key, str(e))
+        return True
+
+    async def get_file(
+        self,
+        key: str,
+        fpath: str,
+        parallel: int = defaults.KV_PARALLEL_PARTS,
+        part_size: int = defaults.KV_PART_SIZE,
+    ):
+        try:
+            await run_async(copy_file, self.uri(key), fpath)
+        except Exception as e:
+            raise KeyReadError(self._bucket, key, str(e))
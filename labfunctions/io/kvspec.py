@@ -1,8 +1,11 @@
 from abc import ABC, abstractmethod
 from typing import Any, AsyncGenerator, Dict, Generator, Union
 
+from labfunctions import defaults
 from labfunctions.utils import get_class
 
+from . import transfer
+
 
 class KeyReadError(Exception):
     def __init__(self, bucket, key, error_msg):
@@ -47,6 +50,44 @@ class GenericKVSpec(ABC):
     def get_stream(self, key: str) -> Generator[bytes, None, None]:
         pass
 
+    def put_file(
+        self,
+        key: str,
+        fpath: str,
+        parallel: int = defaults.KV_PARALLEL_PARTS,
+        part_size: int = defaults.KV_PART_SIZE,
+    ) -> bool:
+        """
+        Stores the file in `fpath`. Stores with multipart or ranged
+        transfers move `parallel` parts of `part_size` at the same time,
+        by default the file is streamed.
+        """
+        return self.put_stream(key, transfer.file_chunks(fpath))
+
+    def get_file(
+        self,
+        key: str,
+        fpath: str,
+        parallel: int = defaults.KV_PARALLEL_PARTS,
+        part_size: int = defaults.KV_PART_SIZE,
+    ):
+        """
+        Writes the value of `key` in `fpath`, which is only replaced
+        when the download finished, see :meth:`put_file`.
+
+        :raises KeyReadError: if the download fails or is incomplete
+        """
+        try:
+            transfer.stream_to_file(self.get_stream(key), fpath)
+        except KeyReadError:
+            raise
+        except Exception as e:
+            raise KeyReadError(self._bucket, key, str(e))
+
+    def close(self):
+        """Releases the connections of the store, if any"""
+        pass
+
     @staticmethod
     def create(store_class, bucket, opts: Dict[str, Any] = {}) -> "GenericKVSpec":
         Class = get_class(store_class)
@@ -87,6 +128,44 @@ class AsyncKVSpec(ABC):
     async def get_stream(self, key: str) -> AsyncGenerator[bytes, None]:
         pass
 
+    async def put_file(
+        self,
+        key: str,
+        fpath: str,
+        parallel: int = defaults.KV_PARALLEL_PARTS,
+        part_size: int = defaults.KV_PART_SIZE,
+    ) -> bool:
+        """
+        Stores the file in `fpath`. Stores with multipart or ranged
+        transfers move `parallel` parts of `part_size` at the same time,
+        by default the file is streamed.
+        """
+        return await self.put_stream(key, transfer.afile_chunks(fpath))
+
+    async def get_file(
+        self,
+        key: str,
+        fpath: str,
+        parallel: int = defaults.KV_PARALLEL_PARTS,
+        part_size: int = defaults.KV_PART_SIZE,
+    ):
+        """
+        Writes the value of `key` in `fpath`, which is only replaced
+        when the download finished, see :meth:`put_file`.
+
+        :raises KeyReadError: if the download fails or is incomplete
+        """
+        try:
+            await transfer.astream_to_file(self.get_stream(key), fpath)
+        except KeyReadError:
+            raise
+        except Exception as e:
+            raise KeyReadError(self._bucket, key, str(e))
+
+    async def close(self):
+        """Releases the connections of the store, if any"""
+        pass
+
     @staticmethod
     def create(store_class, bucket, opts: Dict[str, Any] = {}) -> "GenericKVSpec":
         Class = get_class(store_class)
@@ -1,3 +1,8 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
 from labfunctions.utils import Singleton
 
 
@@ -7,3 +12,86 @@ class MemoryStore(dict, metaclass=Singleton):
     """
 
     pass
+
+
+class TTLCache:
+    def __init__(self, maxsize: int = 128, ttl: Optional[float] = None):
+        """
+        A bounded in-process LRU cache where each entry could expire
+        after `ttl` seconds. It keeps hits and misses counters
+        to follow how much work the cache saves.
+
+        :param maxsize: max number of entries, the least recently used
+        entry is evicted first.
+        :param ttl: time to live in seconds of each entry, None never expires.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default=None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                expire, value = item
+                if expire is None or expire > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+        return default
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        ttl = ttl or self.ttl
+        expire = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (expire, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+            self._purge_expired()
+
+    def _purge_expired(self):
+        """The oldest entries are at the beginning"""
+        now = time.monotonic()
+        while self._data:
+            expire, _ = next(iter(self._data.values()))
+            if expire is None or expire > now:
+                break
+            self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> bool:
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def delete_where(self, func: Callable[[Hashable], bool]) -> int:
+        """Deletes every key for which `func(key)` is True"""
+        with self._lock:
+            keys = [k for k in self._data.keys() if func(k)]
+            for k in keys:
+                del self._data[k]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def keys(self) -> List[Hashable]:
+        with self._lock:
+            return list(self._data.keys())
+
+    def stats(self) -> Dict[str, int]:
+        return dict(
+            hits=self.hits, misses=self.misses, size=len(self), maxsize=self.maxsize
+        )
+
+    def __contains__(self, key: Hashable) -> bool:
+        item = self._data.get(key)
+        return item is not None and (item[0] is None or item[0] > time.monotonic())
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -0,0 +1,212 @@
+"""
+Transfers of files split in parts, used by the `put_file` and `get_file`
+methods of the kv stores. A download writes each part at its offset
+of a temporary file, which is moved to its destination only when
+every part arrived with its expected size.
+"""
+import asyncio
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    AsyncGenerator,
+    Awaitable,
+    Callable,
+    Generator,
+    List,
+    Optional,
+    Tuple,
+)
+
+from labfunctions import defaults
+from labfunctions.utils import run_async
+
+# first and last byte, as in http ranges
+Part = Tuple[int, int]
+
+
+def split_parts(size: int, part_size: int) -> List[Part]:
+    return [
+        (start, min(start + part_size, size) - 1) for start in range(0, size, part_size)
+    ]
+
+
+def range_total(content_range: str) -> int:
+    """Size of the object from a header as `bytes 0-99/1000`"""
+    return int(content_range.rsplit("/", maxsplit=1)[1])
+
+
+def file_md5(fpath, chunk_size: int = defaults.UPLOAD_CHUNK_SIZE) -> bytes:
+    h = hashlib.md5()
+    with open(fpath, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.digest()
+
+
+def md5_check(expected: bytes) -> Callable[[str], None]:
+    def check(fpath: str):
+        if file_md5(fpath) != expected:
+            raise ValueError("md5 of the file doesn't match")
+
+    return check
+
+
+def read_part(fpath, part: Part) -> bytes:
+    start, end = part
+    with open(fpath, "rb") as f:
+        return os.pread(f.fileno(), end - start + 1, start)
+
+
+def file_chunks(
+    fpath, chunk_size: int = defaults.UPLOAD_CHUNK_SIZE
+) -> Generator[bytes, None, None]:
+    with open(fpath, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            yield chunk
+
+
+async def afile_chunks(
+    fpath, chunk_size: int = defaults.UPLOAD_CHUNK_SIZE
+) -> AsyncGenerator[bytes, None]:
+    with open(fpath, "rb") as f:
+        while True:
+            chunk = await run_async(f.read, chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def _tmp_path(fpath) -> str:
+    return f"{fpath}.{os.getpid()}.part"
+
+
+def _check(part: Part, data: bytes):
+    expected = part[1] - part[0] + 1
+    if len(data) != expected:
+        raise ValueError(f"part {part} has {len(data)} bytes instead of {expected}")
+
+
+def stream_to_file(chunks, fpath):
+    tmp = _tmp_path(fpath)
+    try:
+        with open(tmp, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(tmp, fpath)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+async def astream_to_file(chunks: AsyncGenerator[bytes, None], fpath):
+    tmp = _tmp_path(fpath)
+    try:
+        with open(tmp, "wb") as f:
+            async for chunk in chunks:
+                await run_async(f.write, chunk)
+        os.replace(tmp, fpath)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def download_parts(
+    fetch: Callable[[Part], bytes],
+    size: int,
+    fpath,
+    parallel: int = defaults.KV_PARALLEL_PARTS,
+    part_size: int = defaults.KV_PART_SIZE,
+    first: bytes = b"",
+    check: Optional[Callable[[str], None]] = None,
+):
+    """
+    Downloads `parallel` parts of `part_size` at the same time with
+    `fetch(part)`, which should return the bytes of the part.
+
+    :param first: the first bytes of the object, already downloaded
+    :param check: called with the path of the file downloaded before
+    it is moved to `fpath`, it should raise ValueError if the file
+    is not valid, for instance when its checksum doesn't match.
+    :raises ValueError: if a part doesn't have its expected size
+    """
+    tmp = _tmp_path(fpath)
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.ftruncate(fd, size)
+        os.pwrite(fd, first, 0)
+
+        def one(part: Part):
+            data = fetch(part)
+            _check(part, data)
+            os.pwrite(fd, data, part[0])
+
+        parts = split_parts(size - len(first), part_size)
+        with ThreadPoolExecutor(max_workers=parallel) as pool:
+            futures = [
+                pool.submit(one, (s + len(first), e + len(first))) for s, e in parts
+            ]
+            try:
+                for fut in futures:
+                    fut.result()
+            except BaseException:
+                for fut in futures:
+                    fut.cancel()
+                raise
+        os.close(fd)
+        fd = None
+        if check:
+            check(tmp)
+        os.replace(tmp, fpath)
+    finally:
+        if fd is not None:
+            os.close(fd)
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+async def adownload_parts(
+    fetch: Callable[[Part], Awaitable[bytes]],
+    size: int,
+    fpath,
+    parallel: int = defaults.KV_PARALLEL_PARTS,
+    part_size: int = defaults.KV_PART_SIZE,
+    first: bytes = b"",
+    check: Optional[Callable[[str], None]] = None,
+):
+    """Async version of :func:`download_parts`. The parts are written
+    from the loop, they go to the page cache of the os"""
+    sem = asyncio.Semaphore(parallel)
+    tmp = _tmp_path(fpath)
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+
+    async def one(part: Part):
+        async with sem:
+            data = await fetch(part)
+            _check(part, data)
+            os.pwrite(fd, data, part[0])
+
+    tasks: List[asyncio.Future] = []
+    try:
+        os.ftruncate(fd, size)
+        os.pwrite(fd, first, 0)
+        parts = split_parts(size - len(first), part_size)
+        tasks = [
+            asyncio.ensure_future(one((s + len(first), e + len(first))))
+            for s, e in parts
+        ]
+        await asyncio.gather(*tasks)
+        os.close(fd)
+        fd = None
+        if check:
+            await run_async(check, tmp)
+        os.replace(tmp, fpath)
+    finally:
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        if fd is not None:
+            os.close(fd)
+        if os.path.exists(tmp):
+            os.remove(tmp)
@@ -90,3 +90,20 @@ async def create(session, execution_result: ExecutionResult) -> HistoryModel:
     )
     session.add(row)
     return row
+
+
+async def set_logs_path(session, projectid: str, execid: str, logs_path: str) -> int:
+    """The logs are uploaded when the execution ends, after its
+    result was registered.
+    :return: the number of rows updated
+    """
+    stmt = (
+        select(HistoryModel)
+        .where(HistoryModel.project_id == projectid)
+        .where(HistoryModel.execid == execid)
+    )
+    r = await session.execute(stmt)
+    rows = r.scalars().all()
+    for model in rows:
+        model.result = {**model.result, "logs_path": logs_path}
+    return len(rows)
@@ -1,16 +1,71 @@
-from typing import List, Optional, Union
+from typing import Dict, List, Optional, Union
 
+from redis.asyncio import Redis
 from sqlalchemy import delete as sqldelete
 from sqlalchemy import insert as sqlinsert
 from sqlalchemy import select
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import selectinload
 
+from labfunctions import defaults, log
 from labfunctions.errors.runtimes import RuntimeNotFound
+from labfunctions.io.memory_store import TTLCache
 from labfunctions.models import RuntimeModel
-from labfunctions.types.runtimes import RuntimeData, RuntimeReq, RuntimeSpec
+from labfunctions.types.runtimes import (
+    RuntimeData,
+    RuntimeEvent,
+    RuntimeReq,
+    RuntimeSpec,
+)
 from labfunctions.utils import get_version
 
+runtimes_cache = TTLCache(maxsize=1024, ttl=60 * 5)
+
+
+def init_cache(maxsize: int, ttl: int):
+    global runtimes_cache
+    runtimes_cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+
+def cache_stats() -> Dict[str, int]:
+    return runtimes_cache.stats()
+
+
+def invalidate_cache(projectid: str) -> int:
+    """
+    Removes every cached runtime of a project. A new version changes
+    which runtime is the latest, so the whole project is dropped.
+    """
+    return runtimes_cache.delete_where(lambda k: k[1] == projectid)
+
+
+async def publish_event(
+    redis: Redis, action: str, runtimeid: str, image: Optional[str] = None
+):
+    """Let the other server workers and the agents know about a runtime
+    change. `redis` should be the queue redis, the agents only
+    connect to it (see :meth:`ImageCache.listen`)"""
+    evt = RuntimeEvent(
+        action=action,
+        projectid=runtimeid.split("/", maxsplit=1)[0],
+        runtimeid=runtimeid,
+        image=image,
+    )
+    await redis.publish(defaults.RUNTIMES_CHANNEL, evt.json())
+
+
+async def listen_invalidations(redis: Redis):
+    """It runs forever, invalidating the cache when a runtime changes.
+    `redis` should be the same used by :func:`publish_event`"""
+    pubsub = redis.pubsub(ignore_subscribe_messages=True)
+    await pubsub.subscribe(defaults.RUNTIMES_CHANNEL)
+    async for msg in pubsub.listen():
+        try:
+            evt = RuntimeEvent.parse_raw(msg["data"])
+            invalidate_cache(evt.projectid)
+        except Exception as e:
+            log.server_logger.warning(f"Invalid runtime event {msg}: {e}")
+
 
 def select_runtime():
     stmt = select(RuntimeModel).options(selectinload(RuntimeModel.project))
@@ -50,26 +105,35 @@ async def get_list(session, projectid, limit=10) -> List[RuntimeData]:
     return [model2runtime(r[0]) for r in rows]
 
 
+def build_runtimeid(rq: RuntimeReq) -> str:
+    return f"{rq.project_id}/{rq.runtime_name}/{rq.version}"
+
+
 async def create(session, rq: RuntimeReq) -> bool:
-    rd = RuntimeData(
-        runtimeid=f"{rq.project_id}/{rq.runtime_name}/{rq.version}", **rq.dict()
-    )
+    rd = RuntimeData(runtimeid=build_runtimeid(rq), **rq.dict())
     stmt = _insert(rd)
     inserted = True
     try:
         await session.execute(stmt)
     except IntegrityError as e:
         inserted = False
+    invalidate_cache(rq.project_id)
     return inserted
 
 
 async def get_by_rid(session, runtimeid: str) -> Union[RuntimeData, None]:
+    key = ("rid", runtimeid.split("/", maxsplit=1)[0], runtimeid)
+    cached = runtimes_cache.get(key)
+    if cached:
+        return cached
+
     stmt = select_runtime().where(RuntimeModel.runtimeid == runtimeid).limit(1)
 
     rsp = await session.execute(stmt)
     model = rsp.scalar_one_or_none()
     if model:
         rd = model2runtime(model)
+        runtimes_cache.set(key, rd)
         return rd
     return None
 
@@ -77,6 +141,11 @@ async def get_by_rid(session, runtimeid: str) -> Union[RuntimeData, None]:
 async def get_runtime(
     session, projectid: str, runtime_name: str, version=None
 ) -> Union[RuntimeData, None]:
+    key = ("rt", projectid, runtime_name, version)
+    cached = runtimes_cache.get(key)
+    if cached:
+        return cached
+
     stmt = select_runtime().where(RuntimeModel.project_id == projectid)
     if version:
         stmt = (
@@ -95,6 +164,7 @@ async def get_runtime(
     model = rsp.scalar_one_or_none()
     if model:
         rd = model2runtime(model)
+        runtimes_cache.set(key, rd)
         return rd
     return None
 
@@ -113,6 +183,7 @@ def get_by_rid_sync(session, runtimeid: str) -> Union[RuntimeData, None]:
 async def delete_by_rid(session, runtimeid: int):
     stmt = sqldelete(RuntimeModel).where(RuntimeModel.runtimeid == runtimeid)
     await session.execute(stmt)
+    invalidate_cache(runtimeid.split("/", maxsplit=1)[0])
 
 
 # def docker_name_from_runtime(session, runtimeid: Optional[str] = None) -> RuntimeData:
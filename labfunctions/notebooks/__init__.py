@@ -1 +1,8 @@
-from .context import create_notebook_ctx
+from .context import (
+    create_notebook_ctx,
+    ctx2wire,
+    job_timeout,
+    sweep_ctxs,
+    wire2ctx,
+    workflow_run_ctx,
+)
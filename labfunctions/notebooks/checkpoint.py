@@ -0,0 +1,160 @@
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+import nbformat
+
+from labfunctions import defaults
+
+logger = logging.getLogger("nbworkf.server")
+
+# cells which always run when a notebook is resumed
+_ALWAYS_RUN = {"parameters", "injected-parameters", defaults.CHECKPOINT_SETUP_TAG}
+# nbclient doesn't execute the cells with this tag
+_SKIP_TAG = "skip-execution"
+
+
+def _tags(cell):
+    return cell.get("metadata", {}).get("tags", [])
+
+
+def _status(cell) -> Optional[str]:
+    return cell.get("metadata", {}).get("papermill", {}).get("status")
+
+
+def resume_point(nb, checkpoint) -> int:
+    """
+    Index of the last cell tagged `defaults.CHECKPOINT_TAG` completed in
+    `checkpoint`, when every cell up to it completed too. The cells of
+    `nb` up to it must be the same as in the checkpoint, otherwise the
+    notebook or its params changed and it starts from the beginning.
+
+    :return: -1 if the notebook can't be resumed
+    """
+    point = -1
+    if len(nb.cells) != len(checkpoint.cells):
+        return point
+    for i, (cell, done) in enumerate(zip(nb.cells, checkpoint.cells)):
+        if cell.source != done.source or cell.cell_type != done.cell_type:
+            break
+        if cell.cell_type == "code" and _status(done) != "completed":
+            break
+        if defaults.CHECKPOINT_TAG in _tags(cell):
+            point = i
+    return point
+
+
+def skip_completed(nb, checkpoint) -> Dict[int, nbformat.NotebookNode]:
+    """
+    Tags the code cells of `nb` completed before the resume point
+    (see :func:`resume_point`) to be skipped by the kernel. The cells
+    tagged `parameters`, `injected-parameters` or
+    `defaults.CHECKPOINT_SETUP_TAG` still run, the kernel is new
+    and they should rebuild what the next cells need.
+
+    :return: the executed cells from the checkpoint by index,
+    see :func:`restore_skipped`
+    """
+    skipped = {}
+    point = resume_point(nb, checkpoint)
+    for i in range(point + 1):
+        cell = nb.cells[i]
+        if cell.cell_type != "code" or _ALWAYS_RUN & set(_tags(cell)):
+            continue
+        cell.metadata["tags"] = [*_tags(cell), _SKIP_TAG]
+        skipped[i] = checkpoint.cells[i]
+    return skipped
+
+
+def restore_skipped(nb, skipped: Dict[int, nbformat.NotebookNode]):
+    """Puts back the outputs of the cells skipped, papermill
+    cleans them when the execution starts"""
+    for i, done in skipped.items():
+        cell = nb.cells[i]
+        cell.outputs = done.get("outputs", [])
+        cell.execution_count = done.get("execution_count")
+        cell.metadata["tags"] = [t for t in _tags(cell) if t != _SKIP_TAG]
+        cell.metadata["papermill"] = done.metadata.get("papermill", {})
+    if skipped:
+        nb.metadata.setdefault("labfunctions", {})["resumed_at"] = max(skipped)
+
+
+class Checkpointer:
+    def __init__(
+        self,
+        path: str,
+        upload: Callable[[str], None],
+        resume: Optional[nbformat.NotebookNode] = None,
+        every: float = defaults.CHECKPOINT_SECS,
+        deadline: Optional[float] = None,
+    ):
+        """
+        Uploads the notebook which papermill writes in `path` after each
+        cell, when it changed and no more often than `every` secs.
+        It also uploads it `defaults.CHECKPOINT_GRACE_SECS` before
+        `deadline`, when the agent would kill the container.
+        With the checkpoint of a previous try in `resume`, the cells
+        already completed are skipped (see :func:`skip_completed`).
+
+        :param upload: called with the notebook as json
+        :param deadline: timestamp of the timeout of the task
+        """
+        self.path = path
+        self.upload = upload
+        self.resume = resume
+        self.every = every
+        self.deadline = deadline
+        self.skipped: Dict[int, nbformat.NotebookNode] = {}
+        self._last_mtime = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+
+    def prepare(self, nb):
+        """Called with the notebook parameterized, before its execution"""
+        from papermill.execute import remove_error_markers
+
+        if self.resume is not None:
+            self.skipped = skip_completed(nb, remove_error_markers(self.resume))
+            if self.skipped:
+                logger.info(f"Resuming {self.path} after cell {max(self.skipped)}")
+
+    def restore(self, nb):
+        restore_skipped(nb, self.skipped)
+
+    def checkpoint(self) -> bool:
+        """Uploads the notebook if it changed since the last upload"""
+        try:
+            mtime = os.path.getmtime(self.path)
+            if mtime <= self._last_mtime:
+                return False
+            nb = nbformat.read(self.path, as_version=4)
+            restore_skipped(nb, self.skipped)
+            self.upload(nbformat.writes(nb))
+            self._last_mtime = mtime
+            return True
+        except Exception as e:
+            # papermill could be writing the notebook, or the server is down
+            logger.warning(f"Checkpoint of {self.path} failed: {e}")
+            return False
+
+    def _wait_secs(self) -> float:
+        if not self.deadline:
+            return self.every
+        before_kill = self.deadline - defaults.CHECKPOINT_GRACE_SECS - time.time()
+        if before_kill > 0:
+            return min(self.every, before_kill)
+        return self.every
+
+    def _loop(self):
+        while not self._stop.wait(self._wait_secs()):
+            self.checkpoint()
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
@@ -1,17 +1,53 @@
 from copy import deepcopy
 from datetime import datetime
 from pathlib import Path
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel
 
 from labfunctions import defaults, errors
 from labfunctions.executors.execid import ExecID
 from labfunctions.hashes import generate_random
-from labfunctions.types import ExecutionNBTask, ExecutionResult, NBTask, ServerSettings
+from labfunctions.types import (
+    ExecutionNBTask,
+    ExecutionResult,
+    NBTask,
+    ServerSettings,
+    SlimOptions,
+)
 from labfunctions.types.runtimes import RuntimeData
 from labfunctions.utils import get_version, today_string
 
 WFID_PREFIX = "tmp"
 
+CTX_WIRE_VERSION = 1
+# ExecutionNBTask field -> short key used over the queue
+_WIRE_KEYS = {
+    "projectid": "p",
+    "wfid": "w",
+    "execid": "e",
+    "nb_name": "n",
+    "params": "a",
+    "runtime": "r",
+    "today": "d",
+    "timeout": "t",
+    "created_at": "c",
+    "gpu_support": "g",
+    "cluster": "cl",
+    "machine": "m",
+    "remote_input": "ri",
+    "remote_output": "ro",
+    "notifications_ok": "no",
+    "notifications_fail": "nf",
+    "priority": "pr",
+    "kernel_reuse": "kr",
+    "slim": "sl",
+    "sweep": "sw",
+    "cpus": "cpu",
+    "mem_mb": "mem",
+    "checkpoint": "ck",
+}
+
 
 def execid_for_build(size=defaults.EXECID_LEN) -> str:
     return ExecID().firm_with(ExecID.types.build)
@@ -39,10 +75,25 @@ def prepare_runtime(runtime: Optional[RuntimeData] = None, gpu_support=False) ->
     else:
         _runtime = f"{runtime.docker_name}:{runtime.version}"
         if runtime.registry:
-            _runtime = f"{runtime.registry}/{runtime}"
+            _runtime = f"{runtime.registry}/{_runtime}"
     return _runtime
 
 
+def notebook_paths(nb_name: str, wfid: str, execid: str, today: str) -> Dict[str, str]:
+    """Papermill paths of an execution, all of them derived from its ids"""
+    root = Path(defaults.NOTEBOOKS_DIR)
+    output_dir = f"{defaults.NB_OUTPUTS}/ok/{today}"
+    error_dir = f"{defaults.NB_OUTPUTS}/errors/{today}"
+    output_name = f"{wfid}.{nb_name}.{execid}.ipynb"
+    return dict(
+        pm_input=str(root / f"{nb_name}.ipynb"),
+        pm_output=f"{output_dir}/{output_name}",
+        output_name=output_name,
+        output_dir=output_dir,
+        error_dir=error_dir,
+    )
+
+
 def create_notebook_ctx(
     projectid: str,
     task: NBTask,
@@ -52,7 +103,6 @@ def create_notebook_ctx(
 ) -> ExecutionNBTask:
     """It creates the execution context of a notebook based on project and workflow data"""
     # root = Path.cwd()
-    root = Path(defaults.NOTEBOOKS_DIR)
     today = today_string(format_="day")
     _now = datetime.utcnow().isoformat()
 
@@ -64,14 +114,7 @@ def create_notebook_ctx(
     _params["EXECID"] = execid
     _params["NOW"] = _now
 
-    nb_filename = f"{task.nb_name}.ipynb"
-
-    papermill_input = str(root / nb_filename)
-
-    output_dir = f"{defaults.NB_OUTPUTS}/ok/{today}"
-    error_dir = f"{defaults.NB_OUTPUTS}/errors/{today}"
-
-    output_name = f"{wfid}.{task.nb_name}.{execid}.ipynb"
+    paths = notebook_paths(task.nb_name, wfid, execid, today)
     _runtime = prepare_runtime(runtime, task.gpu_support)
     machine = task.machine or defaults.MACHINE_TYPE
     cluster = task.cluster or defaults.CLUSTER_NAME
@@ -85,20 +128,124 @@ def create_notebook_ctx(
         machine=task.machine,
         cluster=cluster,
         params=_params,
-        pm_input=str(papermill_input),
-        pm_output=f"{output_dir}/{output_name}",
-        output_name=output_name,
-        output_dir=output_dir,
-        error_dir=error_dir,
+        **paths,
         today=today,
         timeout=task.timeout,
         gpu_support=task.gpu_support,
         created_at=_now,
         notifications_ok=task.notifications_ok,
         notifications_fail=task.notifications_fail,
+        priority=task.priority,
+        kernel_reuse=task.kernel_reuse,
+        slim=task.slim,
+        sweep=task.sweep,
+        cpus=task.cpus,
+        mem_mb=task.mem_mb,
+        checkpoint=task.checkpoint,
     )
 
 
+def _injected_params(wfid: str, execid: str, now: str) -> Dict[str, Any]:
+    return {"WFID": wfid, "EXECID": execid, "NOW": now}
+
+
+def ctx2wire(ctx: ExecutionNBTask) -> Dict[str, Any]:
+    """
+    Compact form of a ExecutionNBTask to be sent over the queue.
+    Paths and params injected by :func:`create_notebook_ctx` are removed
+    when they can be derived again from the ids of the execution;
+    fields with default values are omitted.
+    """
+    data: Dict[str, Any] = {"v": CTX_WIRE_VERSION}
+    fields = ExecutionNBTask.__fields__
+    for name, key in _WIRE_KEYS.items():
+        value = getattr(ctx, name)
+        if value != fields[name].default:
+            data[key] = value.dict() if isinstance(value, BaseModel) else value
+
+    injected = _injected_params(ctx.wfid, ctx.execid, ctx.created_at)
+    data["a"] = {
+        k: v for k, v in ctx.params.items() if k not in injected or injected[k] != v
+    }
+    derived = notebook_paths(ctx.nb_name, ctx.wfid, ctx.execid, ctx.today)
+    for name, value in derived.items():
+        if getattr(ctx, name) != value:
+            data[name] = getattr(ctx, name)
+    return data
+
+
+def wire2ctx(data: Dict[str, Any]) -> ExecutionNBTask:
+    """
+    Inverse of :func:`ctx2wire`. The full dict form of ExecutionNBTask
+    is still accepted for jobs enqueued by older versions.
+    """
+    version = data.get("v")
+    if version is None:
+        return ExecutionNBTask(**data)
+    if version != CTX_WIRE_VERSION:
+        raise ValueError(f"Unknown ExecutionNBTask wire version {version}")
+
+    fields = {name: data[key] for name, key in _WIRE_KEYS.items() if key in data}
+    derived = notebook_paths(
+        fields["nb_name"], fields["wfid"], fields["execid"], fields["today"]
+    )
+    for name, value in derived.items():
+        fields[name] = data.get(name, value)
+    injected = _injected_params(fields["wfid"], fields["execid"], fields["created_at"])
+    fields["params"] = {**injected, **fields.get("params", {})}
+    if fields.get("slim"):
+        fields["slim"] = SlimOptions(**fields["slim"])
+    # it was validated before being enqueued
+    return ExecutionNBTask.construct(**fields)
+
+
+def workflow_run_ctx(
+    template: ExecutionNBTask, execid: str, now: str, today: str
+) -> ExecutionNBTask:
+    """
+    Execution context of a run of a scheduled workflow. Only the fields
+    that change between runs are replaced, so the template registered
+    with the workflow is not validated again.
+    """
+    params = {**template.params, "EXECID": execid, "NOW": now}
+    paths = notebook_paths(template.nb_name, template.wfid, execid, today)
+    return template.copy(
+        update=dict(execid=execid, params=params, created_at=now, today=today, **paths)
+    )
+
+
+def sweep_ctxs(ctx: ExecutionNBTask) -> List[ExecutionNBTask]:
+    """One execution context by item of `ctx.sweep`"""
+    items = []
+    for ix, sweep_params in enumerate(ctx.sweep or []):
+        execid = f"{ctx.execid}-{ix}"
+        params = {**ctx.params, **sweep_params, "EXECID": execid}
+        output_name = notebook_paths(ctx.nb_name, ctx.wfid, execid, ctx.today)[
+            "output_name"
+        ]
+        items.append(
+            ctx.copy(
+                update=dict(
+                    execid=execid,
+                    params=params,
+                    sweep=None,
+                    output_name=output_name,
+                    pm_output=f"{ctx.output_dir}/{output_name}",
+                )
+            )
+        )
+    return items
+
+
+def job_timeout(ctx: ExecutionNBTask) -> int:
+    """
+    Timeout of the libq job that runs a task. The container is killed
+    at the timeout of the task, the job lives a margin longer so the
+    dispatcher sees that kill instead of being cancelled by libq first.
+    """
+    return ctx.timeout + defaults.EXEC_JOB_MARGIN_SECS
+
+
 def make_error_result(ctx: ExecutionNBTask, elapsed) -> ExecutionResult:
     result = ExecutionResult(
         wfid=ctx.wfid,
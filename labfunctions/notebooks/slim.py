@@ -0,0 +1,164 @@
+import base64
+import hashlib
+import json
+import re
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import nbformat
+from nbconvert import NotebookExporter
+from nbconvert.preprocessors import Preprocessor
+from traitlets import Int, Unicode
+
+from labfunctions import defaults
+from labfunctions.types import SlimOptions
+
+_IMAGES_EXT = {"image/png": "png", "image/jpeg": "jpg", "image/gif": "gif"}
+# a line rewritten with carriage returns, like progress bars do
+_OVERWRITTEN = re.compile(r"[^\n]*\r(?!\n)")
+
+
+def _stream_text(output) -> str:
+    text = output.get("text", "")
+    if isinstance(text, list):
+        text = "".join(text)
+    return text
+
+
+class DedupOutputsPreprocessor(Preprocessor):
+    """Removes the outputs of a cell identical to a previous one"""
+
+    def preprocess_cell(self, cell, resources, index):
+        if cell.cell_type != "code":
+            return cell, resources
+        seen = set()
+        outputs = []
+        for output in cell.get("outputs", []):
+            key = json.dumps(output, sort_keys=True)
+            if key not in seen:
+                seen.add(key)
+                outputs.append(output)
+        cell.outputs = outputs
+        return cell, resources
+
+
+class StreamTailPreprocessor(Preprocessor):
+    """
+    Merges consecutive stream outputs, drops the lines rewritten
+    with carriage returns (progress bars) and keeps the last
+    `max_chars` of each stream.
+    """
+
+    max_chars = Int(defaults.SLIM_STREAM_TAIL).tag(config=True)
+
+    def _tail(self, text: str) -> str:
+        text = _OVERWRITTEN.sub("", text)
+        if len(text) <= self.max_chars:
+            return text
+        cut = len(text) - self.max_chars
+        return f"[... {cut} chars truncated ...]\n{text[cut:]}"
+
+    def preprocess_cell(self, cell, resources, index):
+        if cell.cell_type != "code":
+            return cell, resources
+        outputs = []
+        for output in cell.get("outputs", []):
+            last = outputs[-1] if outputs else None
+            if (
+                output.output_type == "stream"
+                and last is not None
+                and last.output_type == "stream"
+                and last.name == output.name
+            ):
+                last.text = _stream_text(last) + _stream_text(output)
+            else:
+                outputs.append(output)
+        for output in outputs:
+            if output.output_type == "stream":
+                output.text = self._tail(_stream_text(output))
+        cell.outputs = outputs
+        return cell, resources
+
+
+class ExternalizeImagesPreprocessor(Preprocessor):
+    """
+    Images bigger than `min_bytes` are moved to `resources["blobs"]`,
+    named by the sha256 of their content. The output keeps the path
+    of the blob in its metadata and a text placeholder.
+    """
+
+    min_bytes = Int(defaults.SLIM_IMAGE_MIN_BYTES).tag(config=True)
+    blobs_dir = Unicode(defaults.SLIM_BLOBS_DIR).tag(config=True)
+
+    def _externalize(self, output, resources):
+        data = output.get("data", {})
+        for mime, ext in _IMAGES_EXT.items():
+            encoded = data.get(mime)
+            if isinstance(encoded, list):
+                encoded = "".join(encoded)
+            if not encoded or len(encoded) < self.min_bytes:
+                continue
+            content = base64.b64decode(encoded)
+            digest = hashlib.sha256(content).hexdigest()
+            path = f"{self.blobs_dir}/{digest}.{ext}"
+            resources["blobs"][path] = content
+            del data[mime]
+            data.setdefault("text/plain", f"<{mime} {path}>")
+            output.setdefault("metadata", {})
+            output.metadata.setdefault("labfunctions", {})[mime] = path
+
+    def preprocess_cell(self, cell, resources, index):
+        if cell.cell_type != "code":
+            return cell, resources
+        resources.setdefault("blobs", {})
+        for output in cell.get("outputs", []):
+            if output.output_type in ("display_data", "execute_result"):
+                self._externalize(output, resources)
+        return cell, resources
+
+
+def slim_exporter(opts: SlimOptions) -> NotebookExporter:
+    exporter = NotebookExporter()
+    if opts.dedup:
+        exporter.register_preprocessor(DedupOutputsPreprocessor(), enabled=True)
+    if opts.stream_tail:
+        exporter.register_preprocessor(
+            StreamTailPreprocessor(max_chars=opts.stream_tail), enabled=True
+        )
+    if opts.externalize_images:
+        exporter.register_preprocessor(
+            ExternalizeImagesPreprocessor(min_bytes=opts.image_min_bytes),
+            enabled=True,
+        )
+    return exporter
+
+
+def slim_notebook(nb, opts: SlimOptions) -> Tuple[str, Dict[str, bytes]]:
+    """
+    Removes the weight of the outputs of an executed notebook,
+    see :class:`labfunctions.types.SlimOptions`.
+
+    :return: the notebook as json and the images externalized by path
+    """
+    exported, resources = slim_exporter(opts).from_notebook_node(
+        nb, resources={"blobs": {}}
+    )
+    return exported, resources["blobs"]
+
+
+def slim_output(path: str, opts: SlimOptions) -> List[str]:
+    """
+    Slims the notebook in `path` in place, the images externalized
+    are written to :data:`defaults.SLIM_BLOBS_DIR`.
+
+    :return: the paths of the blobs written
+    """
+    nb = nbformat.read(path, as_version=4)
+    exported, blobs = slim_notebook(nb, opts)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(exported)
+    for blob, content in blobs.items():
+        Path(blob).parent.mkdir(parents=True, exist_ok=True)
+        if not Path(blob).exists():
+            Path(blob).write_bytes(content)
+    return sorted(blobs)
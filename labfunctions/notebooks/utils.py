@@ -1,15 +1,40 @@
+import os
+from typing import Any, Dict, Optional
+
 import nbformat
 from nbconvert import NotebookExporter
 from traitlets.config import Config
 
+from labfunctions import defaults
+from labfunctions.io.memory_store import TTLCache
+
+# parsed notebooks by path, mtime and size of the file
+_notebooks = TTLCache(maxsize=defaults.NB_CACHE_SIZE)
+
+PAPERMILL_ENGINE = "labfunctions"
+_engine_registered = False
 
-def read_notebook(path, version=4):
-    with open(path, "r", encoding="utf-8") as f:
-        data = f.read()
-        note = nbformat.reads(data, as_version=version)
+
+def _cached_notebook(path, version=4) -> nbformat.NotebookNode:
+    """The parsed notebook is shared between calls, it must not be changed.
+    The file is read again when its mtime or its size change."""
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_mtime_ns, st.st_size, version)
+    note = _notebooks.get(key)
+    if note is None:
+        note = nbformat.read(path, as_version=version)
+        _notebooks.set(key, note)
     return note
 
 
+def read_notebook(path, version=4) -> nbformat.NotebookNode:
+    """
+    A notebook is parsed once while its file doesn't change,
+    each call gets a copy of it, which is cheaper than parsing the json.
+    """
+    return nbformat.from_dict(_cached_notebook(path, version=version))
+
+
 def clean_output(path, version=4):
     """
     Cleans notebooks outputs, for more info see:
@@ -23,7 +48,69 @@ def clean_output(path, version=4):
 
     exporter = NotebookExporter(config=c)
 
-    note = read_notebook(path, version=version)
+    # the exporter works on a copy of the notebook
+    note = _cached_notebook(path, version=version)
     exported, resources_dict = exporter.from_notebook_node(note)
 
     return exported, resources_dict
+
+
+def _register_engine():
+    """The engine used by :func:`execute_notebook`, registered once"""
+    global _engine_registered
+    if _engine_registered:
+        return
+    from papermill.engines import NBClientEngine, papermill_engines
+
+    class LocalEngine(NBClientEngine):
+        """The default engine of papermill. It records the path of a
+        notebook given as a node, and it skips the cells completed by
+        a previous try, see :class:`Checkpointer`"""
+
+        @classmethod
+        def execute_notebook(
+            cls, nb, kernel_name, source_path=None, checkpointer=None, **kwargs
+        ):
+            if source_path:
+                nb.metadata.papermill["input_path"] = source_path
+            if checkpointer:
+                checkpointer.prepare(nb)
+            try:
+                return super().execute_notebook(nb, kernel_name, **kwargs)
+            finally:
+                # the engine changes the same notebook
+                if checkpointer:
+                    checkpointer.restore(nb)
+
+    papermill_engines.register(PAPERMILL_ENGINE, LocalEngine)
+    _engine_registered = True
+
+
+def execute_notebook(
+    input_path: str,
+    output_path: str,
+    parameters: Optional[Dict[str, Any]] = None,
+    checkpointer=None,
+    **kwargs,
+) -> nbformat.NotebookNode:
+    """
+    `papermill.execute_notebook`, it accepts all of its arguments.
+    Local notebooks are read once while they don't change (see
+    :func:`read_notebook`) and given to papermill as a node.
+
+    :param checkpointer: a :class:`labfunctions.notebooks.checkpoint.Checkpointer`
+    to skip the cells completed in a previous try.
+    """
+    import papermill as pm
+
+    _register_engine()
+    if "engine_name" not in kwargs:
+        kwargs["engine_name"] = PAPERMILL_ENGINE
+        if isinstance(input_path, str) and os.path.isfile(input_path):
+            # papermill works on a copy of it
+            kwargs["source_path"] = input_path
+            input_path = _cached_notebook(input_path)
+    if checkpointer:
+        kwargs["engine_name"] = PAPERMILL_ENGINE
+        kwargs["checkpointer"] = checkpointer
+    return pm.execute_notebook(input_path, output_path, parameters=parameters, **kwargs)
@@ -40,9 +40,7 @@ class BuildTask:
         return self.client.projectid
 
     def get_runtime_file(self, full_zip_file_path, download_key_zip):
-        with open(full_zip_file_path, "wb") as f:
-            for chunk in self.kv.get_stream(download_key_zip):
-                f.write(chunk)
+        self.kv.get_file(download_key_zip, full_zip_file_path)
 
     def run(self, ctx: BuildCtx) -> DockerBuildLog:
         with tempfile.TemporaryDirectory() as tmp_dir:
@@ -13,6 +13,7 @@ from labfunctions.control import JobManager, SchedulerExec
 from labfunctions.db.nosync import AsyncSQL
 from labfunctions.events import EventManager
 from labfunctions.io.kvspec import AsyncKVSpec
+from labfunctions.managers import runtimes_mg
 from labfunctions.redis_conn import create_pool
 from labfunctions.security import auth_from_settings, sanic_init_auth
 from labfunctions.security.redis_tokens import RedisTokenStore
@@ -47,10 +48,10 @@ def create_db_instance(url) -> AsyncSQL:
 
 
 def create_projects_store(
-    store_class, store_bucket, base_root="/tmp/labstore"
+    store_class, store_bucket, base_root="/tmp/labstore", opts=None
 ) -> AsyncKVSpec:
     Class = get_class(store_class)
-    return Class(store_bucket, {"root": base_root})
+    return Class(store_bucket, {"root": base_root, **(opts or {})})
 
 
 def create_app(
@@ -99,16 +100,35 @@ def create_app(
         _queue_pool = create_redis(settings.QUEUE_REDIS)
 
         current_app.ctx.kv_store = projects_store_func(
-            settings.PROJECTS_STORE_CLASS_ASYNC, settings.PROJECTS_STORE_BUCKET
+            settings.PROJECTS_STORE_CLASS_ASYNC,
+            settings.PROJECTS_STORE_BUCKET,
+            opts=settings.PROJECTS_STORE_OPTS,
         )
         current_app.ctx.web_redis = web_redis.client()
         current_app.ctx.queue_redis = _queue_pool
+        fairshare_opts = None
+        if settings.QUEUE_FAIRSHARE:
+            fairshare_opts = dict(
+                weights=settings.QUEUE_FAIRSHARE_WEIGHTS,
+                max_depth=settings.QUEUE_FAIRSHARE_DEPTH,
+                wait_ttl=settings.QUEUE_FAIRSHARE_WAIT_TTL,
+            )
         current_app.ctx.scheduler = SchedulerExec(
-            _queue_pool, control_queue=settings.CONTROL_QUEUE
+            _queue_pool,
+            control_queue=settings.CONTROL_QUEUE,
+            fairshare_opts=fairshare_opts,
         )
+        if current_app.ctx.scheduler.fairshare:
+            current_app.add_task(current_app.ctx.scheduler.fairshare.run())
         current_app.ctx.job_manager = JobManager(conn=_queue_pool)
         current_app.ctx.db = _db
 
+        runtimes_mg.init_cache(
+            settings.RUNTIMES_CACHE_SIZE, settings.RUNTIMES_CACHE_TTL
+        )
+        # runtime events go through the queue redis, shared with the agents
+        current_app.add_task(runtimes_mg.listen_invalidations(_queue_pool.client()))
+
         if settings.CLUSTER_FILEPATH:
             current_app.ctx.cluster = ClusterControl(
                 settings.CLUSTER_FILEPATH,
@@ -125,6 +145,7 @@ def create_app(
         request.ctx.session = current_app.ctx.db.sessionmaker()
         request.ctx.session_ctx_token = _base_model_session_ctx.set(request.ctx.session)
         request.ctx.web_redis = current_app.ctx.web_redis
+        request.ctx.queue_redis = current_app.ctx.queue_redis
         request.ctx.events = EventManager(current_app.ctx.web_redis)
 
         request.ctx.dbconn = current_app.ctx.db.engine
@@ -138,10 +159,17 @@ def create_app(
     @app.listener("after_server_stop")
     async def shutdown(current_app, loop):
         await current_app.ctx.db.engine.dispose()
+        await current_app.ctx.kv_store.close()
         # await current_app.ctx.redis.close()
 
     @app.get("/status")
     async def status_handler(request):
-        return json(dict(msg="We are ok", version=version))
+        return json(
+            dict(
+                msg="We are ok",
+                version=version,
+                runtimes_cache=runtimes_mg.cache_stats(),
+            )
+        )
 
     return app
@@ -4,13 +4,16 @@ from .config import ClientSettings, ServerSettings
 from .core import (
     ExecutionNBTask,
     ExecutionResult,
+    ExecutionResultBatch,
     HistoryLastResponse,
     HistoryRequest,
     HistoryResult,
     Labfile,
     NBTask,
+    NBTaskBatch,
     ScheduleData,
     SimpleExecCtx,
+    SlimOptions,
     TaskStatus,
     WorkflowData,
     WorkflowDataWeb,
@@ -18,6 +18,7 @@ class AgentNode(BaseModel):
     workers: List[str]
     birthday: int
     machine_id: Optional[str] = None
+    images: List[str] = []
 
 
 class AgentConfig(BaseModel):
@@ -31,6 +32,15 @@ class AgentConfig(BaseModel):
     agent_name: Optional[str] = None
     workers_n = 1
     max_jobs: int = 10
+    warm_pool: int = 0
+    warm_max_runs: int = defaults.WARM_MAX_RUNS
+    warm_max_mem_mb: Optional[int] = None
+    admission: bool = False
+    max_cpus: Optional[float] = None
+    max_mem_mb: Optional[int] = None
+    prepull: bool = False
+    max_images: int = defaults.AGENT_MAX_IMAGES
+    max_images_mb: Optional[int] = None
 
 
 class AgentRequest(BaseModel):
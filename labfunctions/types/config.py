@@ -59,9 +59,17 @@ class ServerSettings(BaseSettings):
     WEB_REDIS: Optional[RedisDsn] = None
     QUEUE_REDIS: Optional[RedisDsn] = None
     QUEUE_DEFAULT_TIMEOUT: str = "30m"
+    QUEUE_FAIRSHARE: bool = False
+    QUEUE_FAIRSHARE_WEIGHTS: Dict[str, int] = {}
+    QUEUE_FAIRSHARE_DEPTH: int = 10
+    QUEUE_FAIRSHARE_WAIT_TTL: int = 60 * 60 * 24
     CONTROL_QUEUE: str = "default.control"
     BUILD_QUEUE: str = "default.build"
 
+    # runtimes cache
+    RUNTIMES_CACHE_SIZE: int = 1024
+    RUNTIMES_CACHE_TTL: int = 60 * 5
+
     # ids generations
     EXECID_LEN: int = EXECID_LEN
     PROJECTID_LEN: int = PROJECTID_MIN_LEN
@@ -94,6 +102,8 @@ class ServerSettings(BaseSettings):
     PROJECTS_STORE_CLASS_ASYNC = "labfunctions.io.kv_local.AsyncKVLocal"
     PROJECTS_STORE_CLASS_SYNC = "labfunctions.io.kv_local.KVLocal"
     PROJECTS_STORE_BUCKET = "labfunctions"
+    # client_opts of the store, as url or max_connections for AsyncKVFiles
+    PROJECTS_STORE_OPTS: Dict[str, Any] = {}
     EXT_KV_LOCAL_ROOT: Optional[str] = None
     EXT_KV_FILE_URL: Optional[str] = None
 
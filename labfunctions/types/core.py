@@ -1,7 +1,7 @@
 from dataclasses import dataclass
 from typing import Any, Dict, List, Optional
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, conlist, validator
 
 from labfunctions import defaults
 
@@ -10,12 +10,45 @@ from .projects import ProjectData
 
 
 class ScheduleData(BaseModel):
-    """Used as generic structure when querying database"""
+    """Used as generic structure when querying database
+
+    :param concurrency: what to do if the workflow is triggered while
+    a previous run is still active: "allow" runs both, "skip" drops the
+    new run, "queue-one" keeps at most one run waiting and "replace"
+    stops the active run in favor of the new one.
+    """
 
     start_in_min: int = 0
     repeat: Optional[int] = None
     cron: Optional[str] = None
     interval: Optional[str] = None
+    concurrency: str = defaults.WF_CONCURRENCY_ALLOW
+
+    @validator("concurrency")
+    def valid_concurrency(cls, v):
+        if v not in defaults.WF_CONCURRENCY_POLICIES:
+            raise ValueError(
+                f"concurrency must be one of {defaults.WF_CONCURRENCY_POLICIES}"
+            )
+        return v
+
+
+class SlimOptions(BaseModel):
+    """
+    How the outputs of an executed notebook are reduced before storing it.
+
+    :param dedup: removes outputs of a cell identical to a previous one.
+    :param stream_tail: chars kept from the end of each stream output
+    (stdout, stderr), progress bars only keep their last state. None to keep
+    everything.
+    :param externalize_images: images bigger than `image_min_bytes` are
+    stored apart in the history, named by the hash of their content.
+    """
+
+    dedup: bool = True
+    stream_tail: Optional[int] = defaults.SLIM_STREAM_TAIL
+    externalize_images: bool = False
+    image_min_bytes: int = defaults.SLIM_IMAGE_MIN_BYTES
 
 
 class NBTask(BaseModel):
@@ -38,6 +71,21 @@ class NBTask(BaseModel):
     :param notifications_ok: If ok send a notification to discord or slack.
     :param notifications_fail: If not ok, send notification to discord or slack.
     but internally the task also send a notification if the user wants.
+    :param priority: from 0 (highest) to 2 (lowest), used when the server
+    dispatch tasks in fair share mode.
+    :param kernel_reuse: run it in a Jupyter kernel already started,
+    only when the agent has a warm pool. For frequent and light notebooks.
+    :param slim: reduces the outputs of the notebook before storing it.
+    :param cpus: cpus requested, the container is limited to them and
+    the agent doesn't start it until they are free (see `--admission`).
+    :param mem_mb: memory requested in MB, like `cpus`.
+    :param checkpoint: the notebook is uploaded while it runs, a retry
+    of the task skips the cells before the last one completed with the
+    `checkpoint` tag. The kernel is new, so the cells after it should
+    load what they need from disk, cells tagged `setup` run again.
+    :param sweep: a list of params, the notebook runs once by each item
+    (merged over `params`) in a pool of processes of the same container.
+    Each run has its own execid: `<execid>-<index of the item>`.
     """
 
     nb_name: str
@@ -53,8 +101,28 @@ class NBTask(BaseModel):
     timeout: int = 10800  # secs 3h default
     notifications_ok: Optional[List[str]] = None
     notifications_fail: Optional[List[str]] = None
+    priority: int = defaults.PRIORITY_NORMAL
+    kernel_reuse: bool = False
+    slim: Optional[SlimOptions] = None
+    sweep: Optional[List[Dict[str, Any]]] = None
+    cpus: Optional[float] = None
+    mem_mb: Optional[int] = None
+    checkpoint: bool = False
     # schedule: Optional[ScheduleData] = None
 
+    @validator("sweep")
+    def valid_sweep(cls, v):
+        if v is not None and not 0 < len(v) <= defaults.SWEEP_MAX_ITEMS:
+            raise ValueError(f"sweep must have 1 to {defaults.SWEEP_MAX_ITEMS} items")
+        return v
+
+
+class NBTaskBatch(BaseModel):
+    """A list of tasks to be enqueued in one request, at most
+    BATCH_MAX_TASKS"""
+
+    tasks: conlist(NBTask, max_items=defaults.BATCH_MAX_TASKS)
+
 
 class ExecutionNBTask(BaseModel):
     """It will be send to task_handler, and it has the
@@ -85,11 +153,28 @@ class ExecutionNBTask(BaseModel):
     remote_output: Optional[str]
     notifications_ok: Optional[List[str]] = None
     notifications_fail: Optional[List[str]] = None
+    priority: int = defaults.PRIORITY_NORMAL
+    kernel_reuse: bool = False
+    slim: Optional[SlimOptions] = None
+    sweep: Optional[List[Dict[str, Any]]] = None
+    cpus: Optional[float] = None
+    mem_mb: Optional[int] = None
+    checkpoint: bool = False
 
 
 class ExecutionResult(BaseModel):
     """
     Is the result of a ExecutionTask execution.
+
+    :param error_msg: the last lines of the logs of the execution
+    :param logs_path: where the full logs are stored, relative to the project.
+    :param startup_secs: secs from the dispatch of the task by the agent
+    to the start of the first cell of the notebook.
+    :param blobs: images taken out of the output notebook,
+    see :class:`SlimOptions`.
+    :param sweep: execids of each run of a sweep (see :class:`NBTask`),
+    each one has its own result.
+    :param timed_out: the container was killed at the timeout of the task.
     """
 
     projectid: str
@@ -110,6 +195,17 @@ class ExecutionResult(BaseModel):
     output_dir: Optional[str] = None
     error_dir: Optional[str] = None
     error_msg: Optional[str] = None
+    logs_path: Optional[str] = None
+    startup_secs: Optional[float] = None
+    blobs: Optional[List[str]] = None
+    sweep: Optional[List[str]] = None
+    timed_out: bool = False
+
+
+class ExecutionResultBatch(BaseModel):
+    """Results registered in one request"""
+
+    results: List[ExecutionResult]
 
 
 @dataclass
@@ -21,8 +21,12 @@ class DockerBuildLog(BaseModel):
 
 
 class DockerResources(BaseModel):
+    """Same names than the params of docker-py, memory in bytes
+    and cpus in units of 10^-9 cpus"""
+
     mem_limit: Optional[int] = None
     mem_reservation: Optional[int] = None
+    nano_cpus: Optional[int] = None
 
 
 class DockerVolume(BaseModel):
@@ -49,6 +49,16 @@ class RuntimeReq(BaseModel):
     registry: Optional[str]
 
 
+class RuntimeEvent(BaseModel):
+    """Published by the server when a runtime is created or deleted,
+    `image` is the docker image used by the tasks of the runtime"""
+
+    action: str
+    projectid: str
+    runtimeid: str
+    image: Optional[str] = None
+
+
 class RuntimeData(BaseModel):
     """
     docker_name should be nbworkflows/[projectid]-[runtime_name]:[version]
@@ -9,6 +9,7 @@ import socket
 import subprocess
 import sys
 import unicodedata
+import zlib
 from datetime import datetime
 from functools import wraps
 from importlib import import_module
@@ -399,6 +400,71 @@ def binary_file_reader(fp: str, chunk_size=1024):
             yield data
 
 
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError("zstd encoding needs the zstandard package")
+    return zstandard
+
+
+def compressor(encoding: str):
+    """An object with `compress(data)` and `flush()` for gzip or zstd"""
+    if encoding == "gzip":
+        return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if encoding == "zstd":
+        return _zstd().ZstdCompressor().compressobj()
+    raise ValueError(f"Encoding {encoding} not supported")
+
+
+def decompressor(encoding: str):
+    """Inverse of :func:`compressor`, `identity` doesn't change the data"""
+    if encoding == "gzip":
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if encoding == "zstd":
+        return _zstd().ZstdDecompressor().decompressobj()
+    if encoding == "identity":
+        return None
+    raise ValueError(f"Encoding {encoding} not supported")
+
+
+def decompress_blocks(decomp, data: bytes, max_length: int):
+    """
+    Decompress `data` with an object given by :func:`decompressor`
+    without giving blocks larger than `max_length` (gzip), or a few MB
+    (zstd, fed in slices of `defaults.UPLOAD_ZSTD_SLICE` bytes).
+    """
+    if not hasattr(decomp, "unconsumed_tail"):
+        for i in range(0, len(data), defaults.UPLOAD_ZSTD_SLICE):
+            block = decomp.decompress(data[i : i + defaults.UPLOAD_ZSTD_SLICE])
+            if block:
+                yield block
+        return
+    block = decomp.decompress(data, max_length)
+    while True:
+        if block:
+            yield block
+        # a full block could leave output pending without input left
+        if not decomp.unconsumed_tail and len(block) < max_length:
+            break
+        block = decomp.decompress(decomp.unconsumed_tail, max_length)
+
+
+def compressed_file_reader(
+    fp: str, encoding="gzip", chunk_size=defaults.UPLOAD_CHUNK_SIZE
+):
+    """
+    Like :func:`binary_file_reader` but the file is compressed
+    while it is read, so it isn't loaded in memory.
+    """
+    comp = compressor(encoding)
+    for data in binary_file_reader(fp, chunk_size=chunk_size):
+        out = comp.compress(data)
+        if out:
+            yield out
+    yield comp.flush()
+
+
 def open_publickey(fp) -> str:
     with open(Path(fp).resolve(), "r") as f:
         data = f.read()
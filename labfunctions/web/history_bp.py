@@ -5,18 +5,31 @@ from dataclasses import asdict
 
 import httpx
 from sanic import Blueprint
-from sanic.response import json
+from sanic.response import json, raw
 from sanic_ext import openapi
 
 from labfunctions import defaults
 from labfunctions.conf.server_settings import settings
 from labfunctions.defaults import API_VERSION
+from labfunctions.errors.generics import UploadTooLarge
+from labfunctions.io.kvspec import KeyReadError
 from labfunctions.managers import history_mg
 from labfunctions.managers.users_mg import inject_user
 from labfunctions.security.web import protected
-from labfunctions.types import ExecutionResult, HistoryRequest, NBTask
-from labfunctions.utils import today_string
-from labfunctions.web.utils import get_kvstore, get_query_param2, get_scheduler2
+from labfunctions.types import (
+    ExecutionResult,
+    ExecutionResultBatch,
+    HistoryRequest,
+    NBTask,
+)
+from labfunctions.utils import decompressor, secure_filename, today_string
+from labfunctions.web.utils import (
+    decompress_reader,
+    get_kvstore,
+    get_query_param2,
+    get_scheduler2,
+    stream_reader,
+)
 
 history_bp = Blueprint("history", url_prefix="history", version=API_VERSION)
 
@@ -41,6 +54,23 @@ async def history_create(request):
     return json(dict(msg="created"), 201)
 
 
+@history_bp.post("/_batch")
+@openapi.body({"application/json": ExecutionResultBatch})
+@openapi.response(201, "Created")
+@protected()
+async def history_create_batch(request):
+    """Register the results of many executions, like a sweep"""
+    # pylint: disable=unused-argument
+    batch = ExecutionResultBatch(**request.json)
+
+    session = request.ctx.session
+    async with session.begin():
+        for exec_result in batch.results:
+            await history_mg.create(session, exec_result)
+
+    return json(dict(msg="created"), 201)
+
+
 @history_bp.get("/<projectid>")
 @openapi.parameter("projectid", str, "path")
 @openapi.response(200, "Found")
@@ -146,6 +176,143 @@ async def history_output_fail(request, projectid):
     return json(dict(msg="OK"), 201)
 
 
+@history_bp.post("/<projectid>/_output", stream=True)
+@openapi.parameter("projectid", str, "path")
+@openapi.parameter("output_name", str, "query")
+@openapi.parameter("status", str, "query")
+@openapi.response(201, dict(msg=str), "Created")
+@openapi.response(413, dict(msg=str), "Too large once decompressed")
+@openapi.response(415, dict(msg=str), "Encoding not supported")
+@protected()
+async def history_output(request, projectid):
+    """
+    Upload the output notebook of an execution as a stream.
+    The body could be compressed with gzip or zstd (`Content-Encoding`),
+    it is stored decompressed.
+    `status` is `ok` or `errors`
+    """
+    # pylint: disable=unused-argument
+    kv_store = get_kvstore(request)
+
+    encoding = request.headers.get("content-encoding", "identity")
+    try:
+        decomp = decompressor(encoding)
+    except ValueError as e:
+        return json(dict(msg=str(e)), 415)
+    body = decompress_reader(stream_reader(request), decomp)
+
+    today = today_string(format_="day")
+    status = "errors" if get_query_param2(request, "status") == "errors" else "ok"
+    output_name = secure_filename(get_query_param2(request, "output_name"))
+
+    fp = f"{projectid}/{defaults.NB_OUTPUTS}/{status}/{today}/{output_name}"
+    try:
+        await kv_store.put_stream(fp, body)
+    except UploadTooLarge as e:
+        return json(dict(msg=str(e)), 413)
+
+    return json(dict(msg="OK"), 201)
+
+
+@history_bp.post("/<projectid>/_blobs/<name>", stream=True)
+@openapi.parameter("projectid", str, "path")
+@openapi.parameter("name", str, "path")
+@openapi.response(201, dict(msg=str), "Created")
+@protected()
+async def history_blob(request, projectid, name):
+    """
+    Upload an image taken out of an output notebook,
+    its name is the hash of its content.
+    """
+    # pylint: disable=unused-argument
+    kv_store = get_kvstore(request)
+
+    fp = f"{projectid}/{defaults.SLIM_BLOBS_DIR}/{secure_filename(name)}"
+    await kv_store.put_stream(fp, stream_reader(request))
+
+    return json(dict(msg="OK"), 201)
+
+
+@history_bp.post("/<projectid>/_checkpoints/<execid>", stream=True)
+@openapi.parameter("projectid", str, "path")
+@openapi.parameter("execid", str, "path")
+@openapi.response(201, dict(msg=str), "Created")
+@openapi.response(413, dict(msg=str), "Too large once decompressed")
+@openapi.response(415, dict(msg=str), "Encoding not supported")
+@protected()
+async def history_checkpoint(request, projectid, execid):
+    """
+    Upload the notebook of an execution while it runs, a retry of the
+    execution resumes from it. It could be compressed like `_output`.
+    """
+    # pylint: disable=unused-argument
+    kv_store = get_kvstore(request)
+
+    encoding = request.headers.get("content-encoding", "identity")
+    try:
+        decomp = decompressor(encoding)
+    except ValueError as e:
+        return json(dict(msg=str(e)), 415)
+    body = decompress_reader(stream_reader(request), decomp)
+
+    fp = f"{projectid}/{defaults.CHECKPOINTS_DIR}/{secure_filename(execid)}.ipynb"
+    try:
+        await kv_store.put_stream(fp, body)
+    except UploadTooLarge as e:
+        return json(dict(msg=str(e)), 413)
+
+    return json(dict(msg="OK"), 201)
+
+
+@history_bp.get("/<projectid>/_checkpoints/<execid>")
+@openapi.parameter("projectid", str, "path")
+@openapi.parameter("execid", str, "path")
+@openapi.response(200, "the notebook")
+@openapi.response(404, dict(msg=str), "Not found")
+@protected()
+async def history_get_checkpoint(request, projectid, execid):
+    """Get the last checkpoint of an execution"""
+    # pylint: disable=unused-argument
+    kv_store = get_kvstore(request)
+
+    fp = f"{projectid}/{defaults.CHECKPOINTS_DIR}/{secure_filename(execid)}.ipynb"
+    try:
+        data = await kv_store.get(fp)
+    except KeyReadError:
+        data = None
+    if not data:
+        return json(dict(msg="not found"), 404)
+    return raw(data, content_type="application/x-ipynb+json")
+
+
+@history_bp.post("/<projectid>/_logs", stream=True)
+@openapi.parameter("projectid", str, "path")
+@openapi.parameter("execid", str, "query")
+@openapi.response(201, dict(path=str), "Created")
+@openapi.response(404, "not found")
+@protected()
+async def history_logs(request, projectid):
+    """
+    Upload the gzipped logs of an execution as a stream, the
+    `logs_path` of its registered result is updated.
+    """
+    # pylint: disable=unused-argument
+    kv_store = get_kvstore(request)
+
+    today = today_string(format_="day")
+    execid = secure_filename(get_query_param2(request, "execid"))
+    path = f"{defaults.NB_OUTPUTS}/logs/{today}/{execid}.log.gz"
+
+    session = request.ctx.session
+    async with session.begin():
+        updated = await history_mg.set_logs_path(session, projectid, execid, path)
+        if not updated:
+            return json(dict(msg="not found"), 404)
+        await kv_store.put_stream(f"{projectid}/{path}", stream_reader(request))
+
+    return json(dict(path=path), 201)
+
+
 @history_bp.get("/<projectid>/_get_output")
 @openapi.parameter("projectid", str, "path")
 @openapi.parameter("file", str, "query")
@@ -6,6 +6,7 @@ from sanic_ext import openapi
 
 from labfunctions.defaults import API_VERSION
 from labfunctions.managers import runtimes_mg
+from labfunctions.notebooks.context import prepare_runtime
 from labfunctions.security.web import protected
 from labfunctions.types.runtimes import RuntimeData, RuntimeReq
 from labfunctions.web.utils import get_query_param2
@@ -39,6 +40,12 @@ async def runtimes_create(request: Request, projectid):
     rq = RuntimeReq(**request.json)
     async with session.begin():
         created = await runtimes_mg.create(session, rq)
+    if created:
+        rid = runtimes_mg.build_runtimeid(rq)
+        image = prepare_runtime(RuntimeData(runtimeid=rid, **rq.dict()))
+        await runtimes_mg.publish_event(
+            request.ctx.queue_redis, "created", rid, image=image
+        )
     code = 201
     if not created:
         code = 200
@@ -54,5 +61,6 @@ async def runtimes_delete(request: Request, projectid: str, rid: str):
     session = request.ctx.session
     async with session.begin():
         await runtimes_mg.delete_by_rid(session, rid)
+    await runtimes_mg.publish_event(request.ctx.queue_redis, "deleted", rid)
 
     return json({"msg": "ok"}, 200)
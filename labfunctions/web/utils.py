@@ -1,10 +1,14 @@
+from typing import AsyncGenerator
+
 from sanic import Blueprint, Request, Sanic
 
 from labfunctions import defaults
 from labfunctions.cluster2 import ClusterControl
 from labfunctions.conf.server_settings import settings
 from labfunctions.control import JobManager, SchedulerExec
+from labfunctions.errors.generics import UploadTooLarge
 from labfunctions.io.kvspec import AsyncKVSpec
+from labfunctions.utils import decompress_blocks
 
 
 def get_query_param2(request, key, default_val=None):
@@ -55,3 +59,34 @@ async def stream_reader(request: Request):
         if body is None:
             break
         yield body
+
+
+async def decompress_reader(
+    generator: AsyncGenerator[bytes, None],
+    decomp,
+    max_size: int = defaults.UPLOAD_MAX_DECOMPRESSED,
+):
+    """
+    Decompress the chunks of `generator` as they arrive, in blocks
+    of `defaults.UPLOAD_CHUNK_SIZE` at most.
+
+    :param decomp: given by :func:`labfunctions.utils.decompressor`
+    :raises UploadTooLarge: when the data decompressed is larger
+    than `max_size`, the caller should answer 413.
+    """
+    total = 0
+    async for chunk in generator:
+        if decomp is None:
+            yield chunk
+            continue
+        for data in decompress_blocks(decomp, chunk, defaults.UPLOAD_CHUNK_SIZE):
+            total += len(data)
+            if total > max_size:
+                raise UploadTooLarge(max_size)
+            yield data
+    if decomp is not None:
+        data = decomp.flush()
+        if len(data) + total > max_size:
+            raise UploadTooLarge(max_size)
+        if data:
+            yield data
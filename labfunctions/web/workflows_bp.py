@@ -10,7 +10,7 @@ from sanic_ext import openapi
 
 from labfunctions import types
 from labfunctions.conf.server_settings import settings
-from labfunctions.defaults import API_VERSION
+from labfunctions.defaults import API_VERSION, BATCH_MAX_TASKS
 from labfunctions.errors.generics import WorkflowRegisterError
 from labfunctions.managers import projects_mg, runtimes_mg, workflows_mg
 from labfunctions.security.web import protected
@@ -64,6 +64,49 @@ async def notebooks_run(request, projectid):
     return json(nb_ctx.dict(), 202)
 
 
+@workflows_bp.post("/<projectid>/notebooks/_run_batch")
+@openapi.parameter("projectid", str, "path")
+@openapi.body({"application/json": types.NBTaskBatch})
+@openapi.response(202, {"rows": list}, "Notebook execution tasks")
+@openapi.response(422, dict(msg=str), "Too many tasks")
+@protected()
+async def notebooks_run_batch(request, projectid):
+    """
+    Run a list of notebooks
+    """
+    # pylint: disable=unused-argument
+
+    session = request.ctx.session
+    try:
+        batch = types.NBTaskBatch(**request.json)
+    except ValidationError as e:
+        if any(err["type"] == "value_error.list.max_items" for err in e.errors()):
+            return json(dict(msg=f"at most {BATCH_MAX_TASKS} tasks by batch"), 422)
+        return json(dict(msg="wrong params"), 400)
+
+    scheduler = get_scheduler2(request)
+    async with session.begin():
+        ctxs = await scheduler.enqueue_notebooks(
+            session, projectid=projectid, tasks=batch.tasks
+        )
+    return json(dict(rows=[c.dict() for c in ctxs]), 202)
+
+
+@workflows_bp.get("/<projectid>/notebooks/_queue")
+@openapi.parameter("projectid", str, "path")
+@openapi.response(200, {"queues": dict}, "Pending notebooks by queue and priority")
+@protected()
+async def notebooks_queue_depth(request, projectid):
+    """
+    Notebooks of the project waiting to be dispatched when fair share is enabled
+    """
+    # pylint: disable=unused-argument
+
+    scheduler = get_scheduler2(request)
+    depth = await scheduler.queue_depth(projectid)
+    return json(dict(queues=depth), 200)
+
+
 @workflows_bp.get("/<projectid>")
 @openapi.parameter("projectid", str, "path")
 @openapi.response(200, types.WorkflowsList, "Notebook Workflow already exist")
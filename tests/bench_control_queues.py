@@ -0,0 +1,49 @@
+"""
+Micro-benchmark of the per-enqueue overhead of getting a queue object.
+
+    python -m tests.bench_control_queues
+
+A QueuePool with maxsize=0 keeps nothing, so it behaves like the
+previous implementation which built a new Queue for each request.
+"""
+import asyncio
+import time
+
+from labfunctions.control.queues import QueuePool
+
+from .test_control_scheduler import ConnMock
+
+N = 100_000
+QNAMES = [f"default.machine{i}" for i in range(8)]
+
+
+def bench_get(pool: QueuePool, n=N) -> float:
+    started = time.perf_counter()
+    for i in range(n):
+        pool.get(QNAMES[i % len(QNAMES)])
+    return (time.perf_counter() - started) / n
+
+
+async def bench_enqueue(pool: QueuePool, n=N // 10) -> float:
+    started = time.perf_counter()
+    for i in range(n):
+        Q = pool.get(QNAMES[i % len(QNAMES)])
+        await Q.enqueue("labfunctions.control.tasks.notebook_dispatcher")
+    return (time.perf_counter() - started) / n
+
+
+def main():
+    conn = ConnMock()
+    before = QueuePool(conn, maxsize=0)
+    after = QueuePool(conn)
+
+    print(f"get queue, no pool:    {bench_get(before) * 1e6:.2f} us")
+    print(f"get queue, pooled:     {bench_get(after) * 1e6:.2f} us")
+    enq_before = asyncio.run(bench_enqueue(before))
+    enq_after = asyncio.run(bench_enqueue(after))
+    print(f"enqueue, no pool:      {enq_before * 1e6:.2f} us")
+    print(f"enqueue, pooled:       {enq_after * 1e6:.2f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Micro-benchmark of the work done by the agent on each tick of a
+scheduled workflow, before running its container.
+
+    python -m tests.bench_control_workflows
+
+`tick_before` reproduces the previous dispatcher: parsing the registered
+data, patching it and parsing it again from its dict form.
+"""
+import time
+from datetime import datetime
+
+from labfunctions.control import tasks
+from labfunctions.executors import ExecID
+from labfunctions.notebooks import ctx2wire, wire2ctx, workflow_run_ctx
+from labfunctions.types import ExecutionNBTask
+from labfunctions.utils import today_string
+
+from .factories import ExecutionNBTaskFactory
+
+N = 10_000
+
+
+def tick_before(data) -> ExecutionNBTask:
+    ctx = wire2ctx(data)
+    ctx.execid = str(ExecID())
+    _now = datetime.utcnow().isoformat()
+    ctx.params["NOW"] = _now
+    ctx.created_at = _now
+    ctx.today = today_string(format_="day")
+    return wire2ctx(ctx.dict())
+
+
+def tick_after(data) -> ExecutionNBTask:
+    template = tasks.workflow_template(data["w"], data)
+    return workflow_run_ctx(
+        template,
+        execid=str(ExecID()),
+        now=datetime.utcnow().isoformat(),
+        today=today_string(format_="day"),
+    )
+
+
+def bench(func, data, n=N) -> float:
+    started = time.perf_counter()
+    for _ in range(n):
+        func(data)
+    return (time.perf_counter() - started) / n
+
+
+def main():
+    ctx = ExecutionNBTaskFactory(runtime="nuxion/labfunctions:0.8.0", wfid="wfbench")
+    data = ctx2wire(ctx)
+
+    print(f"workflow tick, before: {bench(tick_before, data) * 1e6:.2f} us")
+    print(f"workflow tick, after:  {bench(tick_after, data) * 1e6:.2f} us")
+
+
+if __name__ == "__main__":
+    main()
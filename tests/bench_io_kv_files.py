@@ -0,0 +1,93 @@
+"""
+Throughput of AsyncKVFiles against a local fileserver stand-in.
+
+    python -m tests.bench_io_kv_files
+
+"fresh client" opens a new client (and connection) for each request,
+like the previous implementation did. "pooled" reuses the connections
+of the client of the store.
+"""
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from labfunctions.io.kv_files import AsyncKVFiles
+
+N = 500
+CONCURRENCY = 16
+PAYLOAD = b"x" * 16 * 1024
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    data = {}
+
+    def do_PUT(self):
+        size = int(self.headers.get("Content-Length", 0))
+        self.data[self.path] = self.rfile.read(size)
+        self.send_response(201)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        body = self.data.get(self.path, b"")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_fileserver() -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class FreshClientKV(AsyncKVFiles):
+    async def put(self, key: str, bdata: bytes):
+        kv = AsyncKVFiles(self._bucket, self._opts)
+        try:
+            return await kv.put(key, bdata)
+        finally:
+            await kv.close()
+
+    async def get(self, key: str):
+        kv = AsyncKVFiles(self._bucket, self._opts)
+        try:
+            return await kv.get(key)
+        finally:
+            await kv.close()
+
+
+async def bench(kv: AsyncKVFiles, n=N) -> float:
+    sem = asyncio.Semaphore(CONCURRENCY)
+
+    async def one(i):
+        async with sem:
+            await kv.put(f"k{i % 100}", PAYLOAD)
+            await kv.get(f"k{i % 100}")
+
+    started = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(n)])
+    elapsed = time.perf_counter() - started
+    await kv.close()
+    return n * 2 / elapsed
+
+
+def main():
+    server = start_fileserver()
+    opts = {"url": f"http://127.0.0.1:{server.server_address[1]}"}
+    fresh = asyncio.run(bench(FreshClientKV("bench", opts)))
+    pooled = asyncio.run(bench(AsyncKVFiles("bench", opts)))
+    print(f"fresh client: {fresh:.0f} req/s")
+    print(f"pooled:       {pooled:.0f} req/s")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
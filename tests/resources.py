@@ -66,6 +66,8 @@ def create_app(bluprints, db, web_redis, rq_redis=None, app_name="test"):
     _app.ctx.db = db
     _app.ctx.rq_redis = rq_redis
     _app.ctx.web_redis = web_redis
+    # the same redis for the runtime events in tests
+    _app.ctx.queue_redis = web_redis
 
     _store = TestTokenStore()
     auth = auth_from_settings(settings.SECURITY, _store)
@@ -83,6 +85,7 @@ def create_app(bluprints, db, web_redis, rq_redis=None, app_name="test"):
         request.ctx.session = current_app.ctx.db.sessionmaker()
         request.ctx.session_ctx_token = _base_model_session_ctx.set(request.ctx.session)
         request.ctx.web_redis = current_app.ctx.web_redis
+        request.ctx.queue_redis = current_app.ctx.queue_redis
 
         request.ctx.events = EventManager(
             current_app.ctx.web_redis,
@@ -40,20 +40,13 @@ def test_builder_BuildTask_init(mocker: MockerFixture, kvstore):
 
 
 def test_builder_BuildTask_get_runtime(mocker: MockerFixture, kvstore, tempdir):
-    def stream_data(any_):
-        for x in range(5):
-            yield str(x).encode()
-
-    mock = mocker.MagicMock()
-    mock.get_stream.return_value = [str(x).encode() for x in range(6)]
-    # mock.get_stream = stream_data
+    kvstore.put("test/dowload_zip_url", b"012345")
     client = NBClient(url_service="http://localhost:8000")
     task = builder.BuildTask(client, kvstore=kvstore)
-    task.kv = mock
-    task.get_runtime_file(f"{tempdir}/test.zip", "dowload_zip_url")
+    task.get_runtime_file(f"{tempdir}/test.zip", "test/dowload_zip_url")
     is_file = Path(f"{tempdir}/test.zip").is_file()
     assert is_file
-    assert mock.get_stream.called
+    assert Path(f"{tempdir}/test.zip").read_bytes() == b"012345"
 
 
 def test_builder_BuildTask_run(mocker: MockerFixture, kvstore, tempdir):
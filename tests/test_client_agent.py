@@ -0,0 +1,62 @@
+import time
+
+import httpx
+import jwt
+
+from labfunctions import defaults
+from labfunctions.client.agent_client import AgentClient
+from labfunctions.types import TokenCreds
+
+from .factories import LabStateFactory
+
+url = "http://localhost:8000"
+
+
+def _agent_client(exp):
+    calls = []
+    token = jwt.encode({"usr": "agt", "exp": exp}, "secret")
+
+    def handler(request: httpx.Request):
+        calls.append(request.url.path)
+        if request.url.path.endswith("/_private_key"):
+            return httpx.Response(200, json={"private_key": "pkey"})
+        creds = {"access_token": token, "refresh_token": "refresh"}
+        return httpx.Response(200, json={"agent_name": "agt", "creds": creds})
+
+    def http_init(**kwargs):
+        return httpx.Client(transport=httpx.MockTransport(handler), **kwargs)
+
+    client = AgentClient(
+        url_service=url,
+        creds=TokenCreds(access_token="test", refresh_token="test"),
+        lab_state=LabStateFactory(),
+        http_init_func=http_init,
+    )
+    return client, calls
+
+
+def test_client_agent_creds_cached():
+    client, calls = _agent_client(exp=int(time.time()) + 60 * 60 * 12)
+
+    for _ in range(3):
+        assert client.projects_private_key("test") == "pkey"
+        token = client.projects_agent_token(projectid="test")
+
+    assert token.agent_name == "agt"
+    assert len(calls) == 2
+
+    client.invalidate_creds("test")
+    client.projects_private_key("test")
+    client.projects_agent_token(projectid="test")
+
+    assert len(calls) == 4
+
+
+def test_client_agent_token_refresh():
+    exp = int(time.time()) + defaults.AGENT_CREDS_REFRESH_SECS - 1
+    client, calls = _agent_client(exp=exp)
+
+    client.projects_agent_token(projectid="test")
+    client.projects_agent_token(projectid="test")
+
+    assert len(calls) == 2
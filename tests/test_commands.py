@@ -0,0 +1,119 @@
+import asyncio
+
+import httpx
+import pytest
+from pytest_mock import MockerFixture
+
+from labfunctions.commands import AsyncDockerCommand, DockerCommand, demux_docker_stream
+
+
+def _docker_frame(text: str, stream=1) -> bytes:
+    payload = text.encode()
+    return bytes([stream, 0, 0, 0]) + len(payload).to_bytes(4, "big") + payload
+
+
+def test_commands_demux_docker_stream():
+    raw = _docker_frame("hello ") + _docker_frame("world", stream=2)
+    frames, left = demux_docker_stream(bytearray(raw[:-2]))
+    assert frames == [b"hello "]
+    frames, left = demux_docker_stream(left + raw[-2:])
+    assert frames == [b"world"]
+    assert left == bytearray()
+
+
+@pytest.mark.asyncio
+async def test_commands_async_docker_run():
+    calls = []
+
+    def handler(request: httpx.Request):
+        calls.append((request.method, request.url.path))
+        path = request.url.path
+        if path == "/containers/create":
+            created = ("POST", "/images/create") in calls
+            return httpx.Response(201 if created else 404, json={"Id": "c1"})
+        if path == "/containers/c1/logs":
+            logs = _docker_frame("hello\n") + _docker_frame("world\n", stream=2)
+            return httpx.Response(200, content=logs)
+        if path == "/containers/c1/wait":
+            return httpx.Response(200, json={"StatusCode": 0})
+        return httpx.Response(204 if path.startswith("/containers") else 200)
+
+    client = httpx.AsyncClient(
+        base_url="http://docker", transport=httpx.MockTransport(handler)
+    )
+    chunks = []
+    cmd = AsyncDockerCommand(client, max_log_chars=8)
+    result = await cmd.run("lab exec local", "test:0.1", on_log=chunks.append)
+
+    assert result.status == 0
+    assert result.msg == "world\n"
+    assert chunks == ["hello\n", "world\n"]
+    assert ("DELETE", "/containers/c1") in calls
+
+
+@pytest.mark.asyncio
+async def test_commands_async_docker_logs_cancelled():
+    cancelled = []
+
+    async def follow_logs(cid, tail, on_log):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(cid)
+            raise
+
+    async def handler(request: httpx.Request):
+        if request.url.path == "/containers/create":
+            return httpx.Response(201, json={"Id": "c1"})
+        if request.url.path == "/containers/c1/wait":
+            await asyncio.sleep(5)
+        if request.url.path == "/containers/c1/kill":
+            return httpx.Response(500, json={"message": "kill failed"})
+        return httpx.Response(204)
+
+    client = httpx.AsyncClient(
+        base_url="http://docker", transport=httpx.MockTransport(handler)
+    )
+    cmd = AsyncDockerCommand(client, poll_secs=0.05)
+    cmd.follow_logs = follow_logs
+    result = await cmd.run("lab exec local", "test:0.1", should_stop=lambda: True)
+
+    assert result.status == -3
+    assert cancelled == ["c1"]
+
+
+@pytest.mark.asyncio
+async def test_commands_async_docker_should_stop():
+    calls = []
+
+    async def handler(request: httpx.Request):
+        calls.append((request.method, request.url.path))
+        if request.url.path == "/containers/create":
+            return httpx.Response(201, json={"Id": "c1"})
+        if request.url.path == "/containers/c1/wait":
+            await asyncio.sleep(5)
+        return httpx.Response(204)
+
+    async def should_stop():
+        return True
+
+    client = httpx.AsyncClient(
+        base_url="http://docker", transport=httpx.MockTransport(handler)
+    )
+    cmd = AsyncDockerCommand(client, poll_secs=0.01)
+    result = await cmd.run("lab exec local", "test:0.1", should_stop=should_stop)
+
+    assert result.status == -1
+    assert ("POST", "/containers/c1/kill") in calls
+
+
+def test_commands_docker_wait_should_stop(mocker: MockerFixture):
+    container = mocker.MagicMock()
+    container.wait.side_effect = Exception("read timeout")
+    cmd = DockerCommand(docker_client=mocker.MagicMock())
+    stop = mocker.MagicMock(side_effect=[False, True])
+
+    result = cmd._wait_result(container, 60, should_stop=stop, poll_secs=0.01)
+
+    assert result is None
+    assert container.wait.call_count == 2
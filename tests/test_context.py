@@ -1,8 +1,14 @@
+import json
+
+import pytest
+
 from labfunctions import context as ctx
 from labfunctions import defaults
 from labfunctions import defaults as df
 from labfunctions.executors.execid import ExecID
-from labfunctions.types import ProjectData, WorkflowDataWeb
+from labfunctions.notebooks import create_notebook_ctx, ctx2wire, sweep_ctxs, wire2ctx
+from labfunctions.notebooks.context import prepare_runtime
+from labfunctions.types import ProjectData, SlimOptions, WorkflowDataWeb
 from tests import factories
 
 from .factories import NBTaskFactory, ProjectDataFactory, RuntimeDataFactory
@@ -42,6 +48,13 @@ def test_context_prepare_runtime():
     assert run2.startswith("nuxion")
 
 
+def test_context_prepare_runtime_registry():
+    rd = RuntimeDataFactory(registry="registry.local:5000")
+    image = prepare_runtime(rd)
+
+    assert image == f"registry.local:5000/{rd.docker_name}:{rd.version}"
+
+
 def test_context_create_nb_ctx_dummy():
     pd = ProjectDataFactory()
     task = NBTaskFactory()
@@ -88,3 +101,70 @@ def test_context_create_nb_ctx_dummy():
 #     exec_task = ctx.create_notebook_ctx_ondemand(pd, task)
 #     res = ctx.make_error_result(exec_task, 10)
 #     assert res.error
+
+
+def test_context_wire_roundtrip():
+    task = NBTaskFactory(params={"A": 1, "NOW": "custom"})
+    nb_ctx = create_notebook_ctx("test", task, wfid="wfidtest")
+    wire = ctx2wire(nb_ctx)
+    restored = wire2ctx(wire)
+
+    assert "pm_output" not in wire
+    assert "WFID" not in wire["a"]
+    assert len(json.dumps(wire)) < len(json.dumps(nb_ctx.dict()))
+    assert restored == nb_ctx
+
+
+def test_context_wire_slim():
+    task = NBTaskFactory(slim=SlimOptions(externalize_images=True))
+    nb_ctx = create_notebook_ctx("test", task)
+    wire = ctx2wire(nb_ctx)
+    restored = wire2ctx(json.loads(json.dumps(wire)))
+
+    assert restored.slim.externalize_images
+    assert restored == nb_ctx
+
+
+def test_context_sweep_ctxs():
+    task = NBTaskFactory(params={"A": 1, "B": 1}, sweep=[{"A": 2}, {"A": 3}])
+    nb_ctx = create_notebook_ctx("test", task)
+    restored = wire2ctx(ctx2wire(nb_ctx))
+    items = sweep_ctxs(restored)
+
+    assert [i.execid for i in items] == [f"{nb_ctx.execid}-0", f"{nb_ctx.execid}-1"]
+    assert items[1].params["A"] == 3
+    assert items[1].params["B"] == 1
+    assert items[1].params["EXECID"] == items[1].execid
+    assert items[1].execid in items[1].pm_output
+    assert items[1].sweep is None
+
+
+def test_context_sweep_validation():
+    with pytest.raises(ValueError):
+        NBTaskFactory(sweep=[])
+
+
+def test_context_wire_not_derived():
+    task = NBTaskFactory()
+    nb_ctx = create_notebook_ctx("test", task)
+    nb_ctx.wfid = "changed"
+    restored = wire2ctx(ctx2wire(nb_ctx))
+
+    assert restored == nb_ctx
+
+
+def test_context_wire_dict_fallback():
+    task = NBTaskFactory()
+    nb_ctx = create_notebook_ctx("test", task)
+    restored = wire2ctx(nb_ctx.dict())
+
+    assert restored == nb_ctx
+
+
+def test_context_wire_resources():
+    task = NBTaskFactory(cpus=0.5, mem_mb=512)
+    nb_ctx = create_notebook_ctx("test", task)
+    restored = wire2ctx(json.loads(json.dumps(ctx2wire(nb_ctx))))
+
+    assert (restored.cpus, restored.mem_mb) == (0.5, 512)
+    assert restored == nb_ctx
@@ -0,0 +1,377 @@
+import asyncio
+
+import httpx
+import pytest
+from libq.types import JobPayload
+from libq.worker import AsyncWorker
+from pytest_mock import MockerFixture
+
+from labfunctions import defaults
+from labfunctions.commands import AsyncDockerCommand
+from labfunctions.control import scheduler, tasks
+from labfunctions.control.concurrency import WorkflowLock
+from labfunctions.control.fairshare import FairShareQueue
+from labfunctions.control.queues import QueuePool
+from labfunctions.errors.generics import CheckpointTimeout
+from labfunctions.notebooks import ctx2wire
+
+from .factories import ExecutionNBTaskFactory, NBTaskFactory, RuntimeDataFactory
+
+
+class PipelineMock:
+    def __init__(self):
+        self.calls = []
+        self.executed = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    def __getattr__(self, name):
+        def _call(*args, **kwargs):
+            self.calls.append((name, args))
+            return self
+
+        return _call
+
+    async def execute(self):
+        self.executed += 1
+
+
+class ConnMock:
+    def __init__(self):
+        self.pipe = PipelineMock()
+
+    def pipeline(self):
+        return self.pipe
+
+
+@pytest.mark.asyncio
+async def test_control_scheduler_resolve_runtimes(mocker: MockerFixture):
+    rd = RuntimeDataFactory()
+    get_runtime = mocker.patch(
+        "labfunctions.control.scheduler.runtimes_mg.get_runtime", return_value=rd
+    )
+    tasks = [
+        NBTaskFactory(runtime="default", version="a"),
+        NBTaskFactory(runtime="default", version="a"),
+        NBTaskFactory(runtime="default", version="b"),
+        NBTaskFactory(runtime=None),
+    ]
+    runtimes = await scheduler.resolve_runtimes(None, "test", tasks)
+
+    assert get_runtime.call_count == 2
+    assert runtimes[("default", "a")] == rd
+
+
+@pytest.mark.asyncio
+async def test_control_scheduler_enqueue_notebooks(mocker: MockerFixture):
+    mocker.patch(
+        "labfunctions.control.scheduler.runtimes_mg.get_runtime",
+        return_value=RuntimeDataFactory(),
+    )
+    conn = ConnMock()
+    se = scheduler.SchedulerExec(conn, settings=mocker.MagicMock())
+    tasks = [NBTaskFactory(machine="cpu") for _ in range(5)]
+    tasks.append(NBTaskFactory(machine="gpu"))
+
+    ctxs = await se.enqueue_notebooks(None, projectid="test", tasks=tasks)
+    pushed = [c for c in conn.pipe.calls if c[0] == "rpush"]
+
+    assert len(ctxs) == 6
+    assert len(pushed) == 6
+    assert conn.pipe.executed == 1
+    assert len({c.execid for c in ctxs}) == 6
+
+
+@pytest.mark.asyncio
+async def test_control_scheduler_notebook_job_in_worker(mocker: MockerFixture):
+    mocker.patch(
+        "labfunctions.control.scheduler.runtimes_mg.get_runtime",
+        return_value=RuntimeDataFactory(),
+    )
+    result = mocker.MagicMock()
+    result.timed_out = False
+    result.dict.return_value = {"ok": True}
+    docker_exec = mocker.patch(
+        "labfunctions.control.tasks.docker_exec_async", return_value=result
+    )
+    conn = ConnMock()
+    se = scheduler.SchedulerExec(conn, settings=mocker.MagicMock())
+    await se.enqueue_notebooks(None, projectid="test", tasks=[NBTaskFactory()])
+    stored = [c[1][2] for c in conn.pipe.calls if c[0] == "setex"][0]
+    payload = JobPayload.parse_raw(stored)
+
+    # the same choice than AsyncWorker.run_job
+    worker = AsyncWorker(conn=conn, handle_signals=False)
+    call = worker.call_func_bg if payload.background else worker.call_func
+    rsp = await call(payload)
+
+    assert not rsp.error
+    assert rsp.func_result == {"ok": True}
+    assert docker_exec.call_count == 1
+
+
+def test_control_queues_pool(mocker: MockerFixture):
+    pool = QueuePool(ConnMock(), maxsize=2, idle_secs=60)
+    q1 = pool.get("default.cpu")
+    q2 = pool.get("default.cpu")
+    pool.get("default.gpu")
+    pool.get("gpu.cpu")
+
+    assert q1 is q2
+    assert len(pool) == 2
+    assert pool.get("default.cpu") is not q1
+
+    mocker.patch("labfunctions.io.memory_store.time.monotonic", return_value=1e12)
+    assert pool.get("gpu.cpu") is not None
+    assert len(pool) == 1
+
+
+@pytest.mark.asyncio
+async def test_control_fairshare_dispatch(async_redis_web):
+    pool = QueuePool(async_redis_web)
+    fs = FairShareQueue(async_redis_web, pool, weights={"p2": 2}, max_depth=5)
+    async with async_redis_web.pipeline() as pipe:
+        for i in range(10):
+            fs.push(pipe, "default.cpu", "p1", f"p1-{i}", 1)
+        for i in range(10):
+            fs.push(pipe, "default.cpu", "p2", f"p2-{i}", 1)
+        fs.push(pipe, "default.cpu", "p3", "p3-high", 0)
+        await pipe.execute()
+
+    moved = await fs.dispatch("default.cpu")
+    queued = await async_redis_web.lrange(pool.get("default.cpu").name, 0, -1)
+    depth = await fs.depth()
+
+    assert moved == 5
+    assert queued[0] == "p3-high"
+    assert len([q for q in queued if q.startswith("p2")]) == 2
+    assert len([q for q in queued if q.startswith("p1")]) == 2
+    assert depth["default.cpu"][1] == {"p1": 8, "p2": 8}
+    assert depth["default.cpu"][0] == {}
+
+
+@pytest.mark.asyncio
+async def test_control_fairshare_shared_cursor(async_redis_web):
+    """Two servers dispatching the same queue share the round robin"""
+    pool = QueuePool(async_redis_web)
+    fs1 = FairShareQueue(async_redis_web, pool, max_depth=1)
+    fs2 = FairShareQueue(async_redis_web, pool, max_depth=1)
+    async with async_redis_web.pipeline() as pipe:
+        for p in ["p1", "p2"]:
+            for i in range(2):
+                fs1.push(pipe, "default.cpu", p, f"{p}-{i}", 1)
+        await pipe.execute()
+    qname = pool.get("default.cpu").name
+
+    assert await fs1.dispatch("default.cpu") == 1
+    first = await async_redis_web.lpop(qname)
+    assert await fs2.dispatch("default.cpu") == 1
+    second = await async_redis_web.lpop(qname)
+
+    assert {first[:2], second[:2]} == {"p1", "p2"}
+
+
+@pytest.mark.asyncio
+async def test_control_scheduler_enqueue_fairshare(async_redis_web, mocker):
+    se = scheduler.SchedulerExec(
+        async_redis_web, settings=mocker.MagicMock(), fairshare_opts={"max_depth": 1}
+    )
+    tasks = [NBTaskFactory(machine="cpu") for _ in range(3)]
+    await se.enqueue_notebooks(None, projectid="test", tasks=tasks)
+    depth = await se.queue_depth("test")
+
+    assert depth["default.cpu"][defaults.PRIORITY_NORMAL] == {"test": 2}
+
+
+@pytest.fixture
+async def wf_lock(async_redis_web):
+    lock = WorkflowLock(async_redis_web, "wftest", ttl=60)
+    yield lock
+
+
+@pytest.mark.asyncio
+async def test_control_concurrency_policies(wf_lock):
+    assert await wf_lock.acquire("e1", "skip") == ("run", "")
+    assert await wf_lock.acquire("e2", "skip") == ("skip", "e1")
+    assert await wf_lock.acquire("e3", "queue-one", "data3") == ("queued", "e1")
+    assert await wf_lock.acquire("e4", "queue-one", "data4") == ("skip", "e1")
+    assert await wf_lock.acquire("e5", "replace") == ("replace", "e1")
+    assert await wf_lock.lost("e1")
+    assert not await wf_lock.lost("e5")
+
+    assert await wf_lock.release("e1") is None
+    assert not await wf_lock.lost("e5")
+    # the parked run takes the lock
+    assert await wf_lock.release("e5") == "data3"
+    assert not await wf_lock.lost("e3")
+    assert await wf_lock.release("e3") is None
+    assert not await wf_lock.conn.exists(wf_lock.running_key)
+
+
+@pytest.mark.asyncio
+async def test_control_tasks_dispatch_with_policy(wf_lock, mocker: MockerFixture):
+    result = mocker.MagicMock()
+    result.dict.return_value = {"ok": True}
+    docker_exec = mocker.patch(
+        "labfunctions.control.tasks.docker_exec_async", return_value=result
+    )
+    ctx = ExecutionNBTaskFactory(wfid="wftest", execid="e1", runtime="test")
+    other = ExecutionNBTaskFactory(wfid="wftest", execid="e2", runtime="test")
+
+    await wf_lock.acquire("e0", "skip")
+    skipped = await tasks._dispatch_with_policy(ctx, "skip", wf_lock)
+    await wf_lock.release("e0")
+    rsp = await tasks._dispatch_with_policy(other, "skip", wf_lock)
+
+    assert skipped["skipped"]
+    assert skipped["running"] == "e0"
+    assert rsp == {"ok": True}
+    assert docker_exec.call_count == 1
+    assert not await wf_lock.conn.exists(wf_lock.running_key)
+
+
+@pytest.mark.asyncio
+async def test_control_tasks_queue_one(wf_lock, mocker: MockerFixture):
+    result = mocker.MagicMock()
+    result.dict.return_value = {"ok": True}
+    docker_exec = mocker.patch(
+        "labfunctions.control.tasks.docker_exec_async", return_value=result
+    )
+    Queue = mocker.patch("labfunctions.control.tasks.Queue")
+    Queue.return_value.enqueue = mocker.AsyncMock()
+    mocker.patch("labfunctions.control.tasks._workflow_lock", return_value=wf_lock)
+    first = ExecutionNBTaskFactory(wfid="wftest", execid="e0", runtime="test")
+    parked = ExecutionNBTaskFactory(wfid="wftest", execid="e1", runtime="test")
+
+    await wf_lock.acquire("e0", "queue-one")
+    queued = await tasks._dispatch_with_policy(parked, "queue-one", wf_lock)
+    # the worker is free while the parked run waits
+    assert queued["queued"]
+    assert not docker_exec.called
+
+    await tasks._run_locked(first, wf_lock)
+    enqueue = Queue.return_value.enqueue.call_args
+    assert Queue.call_args[0][0] == f"{parked.cluster}.{parked.machine}"
+    assert enqueue[0][0] == tasks.PARKED_TASK
+    assert enqueue[1]["execid"] == "e1"
+
+    rsp = await tasks.parked_dispatcher(**enqueue[1]["params"])
+    assert rsp == {"ok": True}
+    assert docker_exec.call_args_list[1][0][0].execid == "e1"
+    assert not await wf_lock.conn.exists(wf_lock.running_key)
+    assert Queue.return_value.enqueue.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_control_tasks_workflow_dispatcher(mocker: MockerFixture):
+    docker_exec = mocker.patch("labfunctions.control.tasks.docker_exec_async")
+    lock = mocker.patch("labfunctions.control.tasks._workflow_lock")
+    wire2ctx = mocker.spy(tasks, "wire2ctx")
+    ctx = ExecutionNBTaskFactory(runtime="test", wfid="wftpl")
+    data = ctx2wire(ctx)
+
+    await tasks.workflow_dispatcher(data)
+    await tasks.workflow_dispatcher(data)
+    first = docker_exec.call_args_list[0][0][0]
+    second = docker_exec.call_args_list[1][0][0]
+
+    assert wire2ctx.call_count == 1
+    assert not lock.called
+    assert first.execid != second.execid
+    assert second.params["EXECID"] == second.execid
+    assert second.execid in second.pm_output
+    assert ctx.execid not in second.output_name
+    assert tasks.workflow_template("wftpl", data).execid == ctx.execid
+
+
+@pytest.mark.asyncio
+async def test_control_tasks_notebook_dispatcher_timeout(mocker: MockerFixture):
+    async def handler(request: httpx.Request):
+        if request.url.path == "/containers/create":
+            return httpx.Response(201, json={"Id": "c1"})
+        if request.url.path == "/containers/c1/wait":
+            await asyncio.sleep(5)
+        return httpx.Response(204)
+
+    client = httpx.AsyncClient(
+        base_url="http://docker", transport=httpx.MockTransport(handler)
+    )
+    mocker.patch(
+        "labfunctions.executors.docker_exec.get_async_docker",
+        return_value=AsyncDockerCommand(client, poll_secs=0.05),
+    )
+    mocker.patch("labfunctions.executors.docker_exec.client.from_env")
+    mocker.patch(
+        "labfunctions.executors.docker_exec.NBTaskDocker.prepare_env", return_value={}
+    )
+    ctx = ExecutionNBTaskFactory(runtime="test", timeout=1)
+    checkpointed = ExecutionNBTaskFactory(runtime="test", timeout=1, checkpoint=True)
+
+    rsp = await tasks.notebook_dispatcher(ctx2wire(ctx))
+    # libq retries the job when it fails
+    with pytest.raises(CheckpointTimeout):
+        await tasks.notebook_dispatcher(ctx2wire(checkpointed))
+
+    assert rsp["error"]
+    assert rsp["timed_out"]
+
+
+@pytest.mark.asyncio
+async def test_control_tasks_container_timeout_first(mocker: MockerFixture):
+    async def handler(request: httpx.Request):
+        if request.url.path == "/containers/create":
+            # startup of the task, outside of its timeout
+            await asyncio.sleep(0.5)
+            return httpx.Response(201, json={"Id": "c1"})
+        if request.url.path == "/containers/c1/wait":
+            await asyncio.sleep(5)
+        return httpx.Response(204)
+
+    client = httpx.AsyncClient(
+        base_url="http://docker", transport=httpx.MockTransport(handler)
+    )
+    mocker.patch(
+        "labfunctions.executors.docker_exec.get_async_docker",
+        return_value=AsyncDockerCommand(client, poll_secs=0.05),
+    )
+    mocker.patch("labfunctions.executors.docker_exec.client.from_env")
+    mocker.patch(
+        "labfunctions.executors.docker_exec.NBTaskDocker.prepare_env", return_value={}
+    )
+    mocker.patch(
+        "labfunctions.control.scheduler.runtimes_mg.get_runtime",
+        return_value=RuntimeDataFactory(),
+    )
+    conn = ConnMock()
+    se = scheduler.SchedulerExec(conn, settings=mocker.MagicMock())
+    task = NBTaskFactory(timeout=1, checkpoint=True)
+    await se.enqueue_notebooks(None, projectid="test", tasks=[task])
+    stored = [c[1][2] for c in conn.pipe.calls if c[0] == "setex"][0]
+    payload = JobPayload.parse_raw(stored)
+
+    worker = AsyncWorker(conn=conn, handle_signals=False)
+    rsp = await worker.call_func(payload)
+
+    assert payload.timeout > task.timeout
+    # the dispatcher saw the kill and asks libq for a retry
+    assert rsp.error
+    assert "checkpoint" in rsp.error_msg
+
+
+def test_control_tasks_queue_conn(mocker: MockerFixture):
+    create_pool = mocker.patch("labfunctions.control.tasks.create_pool")
+    mocker.patch("labfunctions.control.tasks._queue_conn", None)
+
+    l1 = tasks._workflow_lock("wf1", 60)
+    l2 = tasks._workflow_lock("wf2", 60)
+    worker_conn = mocker.MagicMock()
+    tasks.init_queue_conn(worker_conn)
+    l3 = tasks._workflow_lock("wf3", 60)
+
+    assert create_pool.call_count == 1
+    assert l1.conn is l2.conn
+    assert l3.conn is worker_conn
@@ -0,0 +1,646 @@
+import asyncio
+import gzip
+import os
+import threading
+
+import httpx
+import nbformat
+import pytest
+from libq.types import JobPayload, JobStatus
+from libq.worker import AsyncWorker
+from pytest_mock import MockerFixture
+
+from labfunctions import defaults
+from labfunctions.commands import AsyncDockerCommand
+from labfunctions.control.scheduler import SchedulerExec
+from labfunctions.executors import docker_exec
+from labfunctions.executors.admission import ResourceGate
+from labfunctions.executors.image_cache import ImageCache
+from labfunctions.executors.kernel_pool import KernelPool, PooledKernel
+from labfunctions.executors.local_exec import load_task, local_exec_env
+from labfunctions.executors.log_stream import LogStreamer
+from labfunctions.executors.nbtask_base import (
+    NBTaskDocker,
+    NBTaskLocal,
+    startup_secs,
+    task_resources,
+)
+from labfunctions.executors.warm_exec import warm_exec_serve
+from labfunctions.executors.warm_pool import WarmPool
+from labfunctions.notebooks import ctx2wire, job_timeout
+from labfunctions.types import ExecutionResult, SlimOptions
+from labfunctions.types.docker import DockerRunResult
+from labfunctions.types.runtimes import RuntimeEvent
+
+from .factories import ExecutionNBTaskFactory
+
+
+@pytest.mark.asyncio
+async def test_executors_log_streamer():
+    published = []
+
+    async def publish(text):
+        published.append(text)
+
+    streamer = LogStreamer(publish, chunk_size=10)
+    await streamer.write("hello\n")
+    await streamer.write("world\n")
+    await streamer.write("bye\n")
+    logs = await streamer.close()
+
+    assert published == ["hello\nworld\n", "bye\n"]
+    assert gzip.decompress(logs.read()) == b"hello\nworld\nbye\n"
+
+
+@pytest.mark.asyncio
+async def test_executors_log_streamer_publish_fail():
+    async def publish(text):
+        raise ConnectionError("server down")
+
+    streamer = LogStreamer(publish, chunk_size=1)
+    await streamer.write("hello\n")
+    logs = await streamer.close()
+
+    assert gzip.decompress(logs.read()) == b"hello\n"
+
+
+@pytest.mark.asyncio
+async def test_executors_docker_exec_async(mocker: MockerFixture):
+    ctx = ExecutionNBTaskFactory(runtime="test")
+    nbclient = mocker.MagicMock()
+    nbclient.history_logs.return_value = "outputs/logs/today/x.log.gz"
+    mocker.patch(
+        "labfunctions.executors.docker_exec.client.from_env", return_value=nbclient
+    )
+
+    async def arun(self, ctx, cmd, should_stop=None, on_log=None):
+        await on_log("running\n")
+        return ExecutionResult(
+            projectid=ctx.projectid,
+            execid=ctx.execid,
+            wfid=ctx.wfid,
+            name=ctx.nb_name,
+            params=ctx.params,
+            input_=ctx.pm_input,
+            error=False,
+            elapsed_secs=1,
+            created_at=ctx.created_at,
+            error_msg="running\n",
+        )
+
+    mocker.patch("labfunctions.executors.docker_exec.NBTaskDocker.arun", arun)
+    mocker.patch("labfunctions.executors.docker_exec.get_async_docker")
+
+    result = await docker_exec.docker_exec_async(ctx)
+    events = [c.kwargs["event"] for c in nbclient.events_publish.call_args_list]
+
+    assert result.logs_path == "outputs/logs/today/x.log.gz"
+    assert events == ["log", "control"]
+    assert not nbclient.history_register.called
+
+
+@pytest.mark.asyncio
+async def test_executors_docker_exec_async_error(mocker: MockerFixture):
+    ctx = ExecutionNBTaskFactory(runtime="test")
+    nbclient = mocker.MagicMock()
+    nbclient.history_logs.return_value = "outputs/logs/today/x.log.gz"
+    mocker.patch(
+        "labfunctions.executors.docker_exec.client.from_env", return_value=nbclient
+    )
+
+    async def arun(self, ctx, cmd, should_stop=None, on_log=None):
+        await on_log("killed\n")
+        result = _result(ctx, error_msg="killed\n")
+        result.error = True
+        return result
+
+    mocker.patch("labfunctions.executors.docker_exec.NBTaskDocker.arun", arun)
+    mocker.patch("labfunctions.executors.docker_exec.get_async_docker")
+
+    result = await docker_exec.docker_exec_async(ctx)
+    registered = nbclient.history_register.call_args[0][0]
+
+    # the upload of the logs sets their path in the registered result
+    assert nbclient.method_calls.index(
+        mocker.call.history_register(registered)
+    ) < nbclient.method_calls.index(
+        mocker.call.history_logs(ctx.projectid, ctx.execid, mocker.ANY)
+    )
+    assert registered.execid == ctx.execid
+    assert result.logs_path == "outputs/logs/today/x.log.gz"
+
+
+def _result(ctx, **kwargs) -> ExecutionResult:
+    return ExecutionResult(
+        projectid=ctx.projectid,
+        execid=ctx.execid,
+        wfid=ctx.wfid,
+        name=ctx.nb_name,
+        params=ctx.params,
+        input_=ctx.pm_input,
+        error=False,
+        elapsed_secs=1,
+        created_at=ctx.created_at,
+        **kwargs,
+    )
+
+
+def _serve_in_thread(socket_path, max_runs=1):
+    thread = threading.Thread(
+        target=warm_exec_serve,
+        args=(socket_path,),
+        kwargs={"max_runs": max_runs, "idle_secs": 1},
+        daemon=True,
+    )
+    thread.start()
+    return thread
+
+
+@pytest.mark.asyncio
+async def test_executors_warm_pool(tempdir, mocker: MockerFixture):
+    ctx = ExecutionNBTaskFactory(runtime="test")
+    envs = []
+
+    def local_exec_env(kernels=None):
+        envs.append(os.environ["LF_TEST_WARM"])
+        return _result(ctx, startup_secs=0.1)
+
+    mocker.patch(
+        "labfunctions.executors.warm_exec.local_exec_env", side_effect=local_exec_env
+    )
+    threads = []
+
+    async def start(cmd, image, **kwargs):
+        name = os.path.basename(cmd.split("--socket ")[1].split()[0])
+        threads.append(_serve_in_thread(f"{tempdir}/{name}"))
+        return f"c{len(threads)}"
+
+    docker = mocker.MagicMock()
+    docker.start = start
+    docker.remove = mocker.AsyncMock()
+    pool = WarmPool(docker, size=1, max_runs=1, sockets_dir=tempdir)
+    key = (ctx.projectid, "test", False)
+
+    assert pool.acquire(key) is None
+    await asyncio.gather(*pool._background)
+    wc = pool.acquire(key)
+    result = await pool.run(wc, {"LF_TEST_WARM": "yes"}, timeout=10)
+    await asyncio.gather(*pool._background)
+
+    assert result.execid == ctx.execid
+    assert envs == ["yes"]
+    assert "LF_TEST_WARM" not in os.environ
+    docker.remove.assert_called_once_with("c1")
+    assert pool.acquire(key).cid == "c2"
+    # other projects don't get the containers of this one
+    assert pool.acquire(("other", "test", False)) is None
+
+    await pool.close()
+    for t in threads:
+        await asyncio.get_running_loop().run_in_executor(None, t.join, 1)
+
+
+def test_executors_startup_secs(mocker: MockerFixture):
+    nb = nbformat.v4.new_notebook()
+    nb.cells = [nbformat.v4.new_code_cell("1"), nbformat.v4.new_code_cell("2")]
+    nb.cells[0].metadata["papermill"] = {"start_time": "2022-01-01T00:00:02"}
+    mocker.patch.dict(os.environ, {defaults.DISPATCHED_AT_ENV: "1640995200"})
+
+    assert startup_secs(nb, 0) == 2.0
+
+
+def _kernel_nb(path, code):
+    nb = nbformat.v4.new_notebook()
+    params = nbformat.v4.new_code_cell("X = 0")
+    params.metadata["tags"] = ["parameters"]
+    nb.cells = [params, nbformat.v4.new_code_cell(code)]
+    nb.metadata["kernelspec"] = {
+        "name": "python3",
+        "display_name": "Python 3",
+        "language": "python",
+    }
+    nbformat.write(nb, path)
+
+
+def test_executors_kernel_reuse(tempdir, mocker: MockerFixture):
+    _kernel_nb(
+        f"{tempdir}/in.ipynb",
+        "import os\n"
+        "print(X, globals().get('Y'), os.environ.get('LF_TEST_KR'), os.getpid())\n"
+        "Y = 1",
+    )
+    kernels = KernelPool(size=1, max_runs=2)
+    runner = NBTaskLocal(mocker.MagicMock(), kernels=kernels)
+    key = ("prj", "wf1", "python3")
+
+    def run(x, wfid="wf1"):
+        ctx = ExecutionNBTaskFactory(
+            runtime="test",
+            projectid="prj",
+            wfid=wfid,
+            kernel_reuse=True,
+            params={"X": x},
+            pm_input=f"{tempdir}/in.ipynb",
+            pm_output=f"{tempdir}/out.ipynb",
+            output_dir=tempdir,
+        )
+        mocker.patch.dict(os.environ, {"LF_TEST_KR": str(x)})
+        result = runner.run(ctx)
+        out = nbformat.read(ctx.pm_output, as_version=4)
+        return result, out.cells[-1].outputs[0]["text"]
+
+    try:
+        _, first = run(1)
+        pid = kernels._idle[key][0].pid
+        _, other = run(3, wfid="wf2")
+        result, second = run(2)
+
+        assert first == f"1 None 1 {pid}\n"
+        assert second == f"2 None 2 {pid}\n"
+        # another workflow doesn't get the kernel of wf1
+        assert other != f"3 None 3 {pid}\n"
+        assert not result.error
+        # replaced after max_runs
+        assert pid is not None
+        assert kernels._idle[key] == []
+        kernels.fill()
+        assert kernels._idle[key][0].pid != pid
+    finally:
+        kernels.close()
+
+
+def test_executors_kernel_reuse_error(tempdir, mocker: MockerFixture):
+    _kernel_nb(f"{tempdir}/in.ipynb", "raise ValueError(X)")
+    kernels = KernelPool(size=1)
+    runner = NBTaskLocal(mocker.MagicMock(), kernels=kernels)
+    ctx = ExecutionNBTaskFactory(
+        runtime="test",
+        projectid="prj",
+        wfid="wf1",
+        kernel_reuse=True,
+        pm_input=f"{tempdir}/in.ipynb",
+        pm_output=f"{tempdir}/out.ipynb",
+        output_dir=tempdir,
+        output_name="out.ipynb",
+        error_dir=f"{tempdir}/errors",
+    )
+    try:
+        result = runner.run(ctx)
+
+        assert result.error
+        assert kernels._idle[("prj", "wf1", "python3")] == []
+    finally:
+        kernels.close()
+
+
+def test_executors_kernel_pool_max_keys(mocker: MockerFixture):
+    kernels = KernelPool(size=1, max_keys=2)
+    mocker.patch.object(
+        kernels, "_start", side_effect=lambda key: PooledKernel(mocker.MagicMock(), key)
+    )
+    mocker.patch.object(kernels, "_prepare")
+    shutdown = mocker.patch.object(kernels, "_shutdown")
+    k1 = kernels.acquire(("prj", "wf1", "python3"))
+    kernels.release(k1)
+    kernels.acquire(("prj", "wf2", "python3"))
+    kernels.acquire(("prj", "wf3", "python3"))
+
+    # the idle kernel of the least recently used workflow is shut down
+    assert list(kernels._idle) == [("prj", "wf2", "python3"), ("prj", "wf3", "python3")]
+    shutdown.assert_called_once_with(k1)
+
+
+def test_executors_local_run(tempdir, mocker: MockerFixture):
+    _kernel_nb(f"{tempdir}/in.ipynb", "print(X)")
+    runner = NBTaskLocal(mocker.MagicMock())
+    ctx = ExecutionNBTaskFactory(
+        runtime="test",
+        params={"X": 7},
+        pm_input=f"{tempdir}/in.ipynb",
+        pm_output=f"{tempdir}/out.ipynb",
+        output_dir=tempdir,
+    )
+
+    result = runner.run(ctx)
+    out = nbformat.read(ctx.pm_output, as_version=4)
+
+    assert not result.error
+    assert out.cells[1].metadata.tags == ["injected-parameters"]
+    assert out.cells[-1].outputs[0]["text"] == "7\n"
+    assert out.metadata.papermill.input_path == ctx.pm_input
+
+
+def test_executors_local_slim(tempdir, monkeypatch, mocker: MockerFixture):
+    _kernel_nb(
+        f"{tempdir}/in.ipynb",
+        "from IPython.display import Image, display\n"
+        "display(Image(data=b'0' * 20_000, format='png'))",
+    )
+    client = mocker.MagicMock()
+    runner = NBTaskLocal(client)
+    ctx = ExecutionNBTaskFactory(
+        runtime="test",
+        pm_input=f"{tempdir}/in.ipynb",
+        pm_output=f"{tempdir}/out.ipynb",
+        output_dir=tempdir,
+        slim=SlimOptions(externalize_images=True),
+    )
+    monkeypatch.chdir(tempdir)
+
+    result = runner.run(ctx)
+    runner.register(result)
+
+    assert len(result.blobs) == 1
+    assert os.path.getsize(result.blobs[0]) == 20_000
+    assert os.path.getsize(ctx.pm_output) < 5_000
+    client.history_blob.assert_called_once_with(ctx.projectid, result.blobs[0])
+
+
+def test_executors_sweep(tempdir, monkeypatch, mocker: MockerFixture):
+    _kernel_nb(f"{tempdir}/in.ipynb", "assert X != 2\nprint(X)")
+    monkeypatch.chdir(tempdir)
+    ctx = ExecutionNBTaskFactory(
+        runtime="test",
+        nb_name="in",
+        pm_input=f"{tempdir}/in.ipynb",
+        sweep=[{"X": 1}, {"X": 2}, {"X": 3}],
+    )
+    nbclient = mocker.MagicMock()
+    mocker.patch(
+        "labfunctions.executors.local_exec.client.from_env", return_value=nbclient
+    )
+    monkeypatch.setenv(defaults.EXECUTIONTASK_VAR, ctx.json())
+
+    result = local_exec_env()
+    (registered,) = nbclient.history_register_batch.call_args.args
+    items = {r.execid: r for r in registered[1:]}
+
+    assert result.error
+    assert result.sweep == [f"{ctx.execid}-{i}" for i in range(3)]
+    assert registered[0] == result
+    assert [items[e].error for e in result.sweep] == [False, True, False]
+    assert items[result.sweep[2]].params["X"] == 3
+    assert nbclient.history_nb_output.call_count == 3
+    assert not nbclient.history_register.called
+
+
+@pytest.mark.asyncio
+async def test_executors_admission():
+    gate = ResourceGate(cpus=4, mem_mb=4096, task_cpus=1, task_mem_mb=1024)
+    big = ExecutionNBTaskFactory(runtime="test", cpus=3, mem_mb=512)
+    small = ExecutionNBTaskFactory(runtime="test")
+    huge = ExecutionNBTaskFactory(runtime="test", cpus=16, mem_mb=100_000)
+    order = []
+
+    async def run(ctx, name, secs):
+        async with gate.reserve(ctx):
+            order.append(f"{name}+")
+            await asyncio.sleep(secs)
+            order.append(f"{name}-")
+
+    await asyncio.gather(
+        run(big, "big", 0.05),
+        run(small, "small", 0.01),
+        run(huge, "huge", 0.01),
+    )
+
+    assert gate.request(huge) == (4, 4096)
+    assert order.index("huge+") > order.index("big-")
+    assert order.index("huge+") > order.index("small-")
+    assert order.index("small+") < order.index("big-")
+    assert gate.used_cpus == 0 and gate.used_mem_mb == 0
+
+
+@pytest.mark.asyncio
+async def test_executors_admission_timeout(mocker: MockerFixture):
+    gate = ResourceGate(cpus=1, mem_mb=1024, task_cpus=1, task_mem_mb=1024)
+    mocker.patch("labfunctions.executors.docker_exec._admission", gate)
+    nbclient = mocker.MagicMock()
+    mocker.patch(
+        "labfunctions.executors.docker_exec.client.from_env", return_value=nbclient
+    )
+    timeouts = []
+
+    async def arun(self, ctx, cmd, should_stop=None, on_log=None):
+        timeouts.append(ctx.timeout)
+        return _result(ctx)
+
+    mocker.patch("labfunctions.executors.docker_exec.NBTaskDocker.arun", arun)
+    mocker.patch("labfunctions.executors.docker_exec.get_async_docker")
+
+    async def hold(secs):
+        async with gate.reserve(ExecutionNBTaskFactory(runtime="test")):
+            await asyncio.sleep(secs)
+
+    holder = asyncio.ensure_future(hold(1.2))
+    await asyncio.sleep(0)
+    late = ExecutionNBTaskFactory(runtime="test", timeout=1)
+    waiting = ExecutionNBTaskFactory(runtime="test", timeout=100)
+    not_admitted, _ = await asyncio.gather(
+        docker_exec.docker_exec_async(late), docker_exec.docker_exec_async(waiting)
+    )
+    await holder
+
+    assert not_admitted.error
+    assert "not admitted in 1 secs" in not_admitted.error_msg
+    assert nbclient.history_register.call_args[0][0].execid == late.execid
+    # the wait is deducted from the timeout of the task
+    assert timeouts == [98]
+    assert gate.used_cpus == 0
+
+
+@pytest.mark.asyncio
+async def test_executors_admission_in_job(mocker: MockerFixture):
+    gate = ResourceGate(cpus=1, mem_mb=1024, task_cpus=1, task_mem_mb=1024)
+    mocker.patch("labfunctions.executors.docker_exec._admission", gate)
+    mocker.patch("labfunctions.executors.docker_exec.client.from_env")
+    mocker.patch("labfunctions.executors.docker_exec.get_async_docker")
+
+    async def arun(self, ctx, cmd, should_stop=None, on_log=None):
+        # the container runs until its timeout
+        await asyncio.sleep(ctx.timeout)
+        result = _result(ctx)
+        result.error = True
+        result.timed_out = True
+        return result
+
+    mocker.patch("labfunctions.executors.docker_exec.NBTaskDocker.arun", arun)
+    ctx = ExecutionNBTaskFactory(runtime="test", timeout=2)
+    payload = JobPayload(
+        func_name=SchedulerExec.tasks["notebook"],
+        timeout=job_timeout(ctx),
+        params={"data": ctx2wire(ctx)},
+        status=JobStatus.queued.value,
+        queue="default.cpu",
+        created_ts=0,
+    )
+    worker = AsyncWorker(conn=mocker.MagicMock(), handle_signals=False)
+
+    async with gate.reserve(ExecutionNBTaskFactory(runtime="test")):
+        job = asyncio.ensure_future(worker.call_func(payload))
+        await asyncio.sleep(1.2)
+    rsp = await job
+
+    # the wait at the gate and the container fit in the job
+    assert not rsp.error
+    assert rsp.func_result["timed_out"]
+    assert gate.used_cpus == 0
+
+
+def test_executors_task_resources():
+    ctx = ExecutionNBTaskFactory(runtime="test", cpus=1.5, mem_mb=256)
+    resources = task_resources(ctx)
+    config = AsyncDockerCommand.container_config(
+        "lab exec local", "test:0.1", resources=resources
+    )
+
+    assert config["HostConfig"]["NanoCpus"] == 1_500_000_000
+    assert config["HostConfig"]["Memory"] == 256 * 1024 * 1024
+    assert task_resources(ExecutionNBTaskFactory(runtime="test")).dict() == {
+        "mem_limit": None,
+        "mem_reservation": None,
+        "nano_cpus": None,
+    }
+
+
+def _docker_images(local):
+    calls = []
+
+    def handler(request: httpx.Request):
+        path = request.url.path
+        calls.append((request.method, path))
+        if path == "/images/json":
+            return httpx.Response(200, json=local)
+        if path == "/images/create":
+            return httpx.Response(200, content=b'{"status": "done"}\n')
+        if path.endswith("/json"):
+            return httpx.Response(200, json={"Size": 10})
+        return httpx.Response(200, json=[])
+
+    client = httpx.AsyncClient(
+        base_url="http://docker", transport=httpx.MockTransport(handler)
+    )
+    return AsyncDockerCommand(client), calls
+
+
+@pytest.mark.asyncio
+async def test_executors_image_cache():
+    old, used = "labfunctions/p-old:1", "labfunctions/p-used:1"
+    local = [
+        {"RepoTags": [used], "Created": 2, "Size": 10},
+        {"RepoTags": [old], "Created": 1, "Size": 10},
+        {"RepoTags": ["redis:6"], "Created": 0, "Size": 10},
+    ]
+    docker, calls = _docker_images(local)
+    images = ImageCache(docker, max_images=2)
+    metadata = {}
+    images.advertise(metadata)
+    await images.load()
+
+    assert metadata["images"] == [old, used]
+
+    async with images.use(used):
+        images.on_event(
+            RuntimeEvent(
+                action="created",
+                projectid="p",
+                runtimeid="p/new/1",
+                image="labfunctions/p-new:1",
+            )
+        )
+        await asyncio.gather(*images._background)
+
+    assert metadata["images"] == ["labfunctions/p-new:1", used]
+    assert ("DELETE", f"/images/{old}") in calls
+    assert ("DELETE", "/images/redis:6") not in calls
+
+    images.on_event(RuntimeEvent(action="deleted", projectid="p", runtimeid="p/new/1"))
+    await asyncio.gather(*images._background)
+
+    assert images.images == [used]
+
+
+@pytest.mark.asyncio
+async def test_executors_task_file(tempdir, monkeypatch, mocker: MockerFixture):
+    ctx = ExecutionNBTaskFactory(runtime="test", params={"DATA": "x" * 20_000_000})
+    nbclient = mocker.MagicMock()
+    nbclient._addr = "http://localhost:8000"
+    runner = NBTaskDocker(nbclient, tasks_dir=tempdir)
+    loaded = []
+
+    async def run(cmd, image, env_data=None, volumes=None, **kwargs):
+        inner = env_data[defaults.EXECUTIONTASK_FILE_VAR]
+        host = inner.replace(defaults.TASKS_MOUNT, volumes[0].orig_mount)
+        monkeypatch.setenv(defaults.EXECUTIONTASK_FILE_VAR, host)
+        loaded.append(load_task())
+        assert defaults.EXECUTIONTASK_VAR not in env_data
+        return DockerRunResult(msg="", status=0)
+
+    docker = mocker.MagicMock()
+    docker.run = run
+    result = await runner.arun(ctx, docker)
+
+    assert not result.error
+    assert loaded[0] == ctx
+    assert os.listdir(tempdir) == []
+
+    small = ExecutionNBTaskFactory(runtime="test")
+    env = runner.build_env(small.dict())
+    monkeypatch.delenv(defaults.EXECUTIONTASK_FILE_VAR)
+    monkeypatch.setenv(defaults.EXECUTIONTASK_VAR, env[defaults.EXECUTIONTASK_VAR])
+
+    assert load_task() == small
+
+
+def test_executors_checkpoint_retry(tempdir, monkeypatch, mocker: MockerFixture):
+    monkeypatch.chdir(tempdir)
+    nb = nbformat.v4.new_notebook()
+    params = nbformat.v4.new_code_cell("X = 0")
+    params.metadata["tags"] = ["parameters"]
+    setup = nbformat.v4.new_code_cell("import os")
+    setup.metadata["tags"] = ["setup"]
+    step = nbformat.v4.new_code_cell(
+        "open('runs.txt', 'a').write('1')\nprint('step done')"
+    )
+    step.metadata["tags"] = ["checkpoint"]
+    last = nbformat.v4.new_code_cell("assert os.path.exists('ready')\nprint(X)")
+    nb.cells = [params, setup, step, last]
+    nb.metadata["kernelspec"] = {
+        "name": "python3",
+        "display_name": "Python 3",
+        "language": "python",
+    }
+    nbformat.write(nb, f"{tempdir}/in.ipynb")
+    uploads = []
+    client = mocker.MagicMock()
+    client.history_checkpoint.side_effect = lambda p, e, data: uploads.append(data)
+    client.history_get_checkpoint.side_effect = lambda p, e: (
+        uploads[-1] if uploads else None
+    )
+    runner = NBTaskLocal(client)
+
+    def run():
+        ctx = ExecutionNBTaskFactory(
+            runtime="test",
+            checkpoint=True,
+            execid="exec1",
+            params={"X": 7},
+            pm_input=f"{tempdir}/in.ipynb",
+            pm_output=f"{tempdir}/out.ipynb",
+            output_name="out.ipynb",
+            output_dir=tempdir,
+            error_dir=f"{tempdir}/errors",
+        )
+        return runner.run(ctx)
+
+    first = run()
+    open(f"{tempdir}/ready", "w").close()
+    second = run()
+    out = nbformat.read(f"{tempdir}/out.ipynb", as_version=4)
+
+    assert first.error
+    assert not second.error
+    assert open(f"{tempdir}/runs.txt").read() == "1"
+    assert out.cells[3].outputs[0].text == "step done\n"
+    assert out.cells[-1].outputs[0].text == "7\n"
+    assert out.metadata.labfunctions["resumed_at"] == 3
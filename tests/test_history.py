@@ -1,11 +1,20 @@
+import gzip
+import os
+
+import httpx
 import pytest
 from pytest_mock import MockerFixture
 
+from labfunctions import defaults
+from labfunctions.client.history_client import HistoryClient
 from labfunctions.defaults import API_VERSION
+from labfunctions.errors.generics import UploadTooLarge
 from labfunctions.managers import history_mg
 from labfunctions.managers.history_mg import HistoryLastResponse
 from labfunctions.models import HistoryModel
 from labfunctions.types import HistoryLastResponse
+from labfunctions.utils import decompress_blocks, decompressor
+from labfunctions.web.utils import decompress_reader
 
 from .factories import (
     ExecutionResultFactory,
@@ -85,6 +94,43 @@ async def test_history_bp_last_404(
     assert res.status_code == 404
 
 
+@pytest.mark.asyncio
+async def test_history_bp_logs(
+    async_session, sanic_app, async_redis_web, access_token, mocker: MockerFixture
+):
+    set_logs = mocker.patch(
+        "labfunctions.web.history_bp.history_mg.set_logs_path", return_value=1
+    )
+    put_stream = mocker.patch.object(sanic_app.ctx.kv_store, "put_stream")
+    req, res = await sanic_app.asgi_client.post(
+        f"{version}/history/test/_logs?execid=exec1",
+        content=gzip.compress(b"logs"),
+        headers={"Authorization": f"Bearer {access_token}"},
+    )
+    path = res.json["path"]
+
+    assert res.status_code == 201
+    assert path.endswith("/exec1.log.gz")
+    assert put_stream.call_args[0][0] == f"test/{path}"
+    assert set_logs.call_args[0][1:] == ("test", "exec1", path)
+
+
+@pytest.mark.asyncio
+async def test_history_bp_logs_404(
+    async_session, sanic_app, async_redis_web, access_token, mocker: MockerFixture
+):
+    mocker.patch("labfunctions.web.history_bp.history_mg.set_logs_path", return_value=0)
+    put_stream = mocker.patch.object(sanic_app.ctx.kv_store, "put_stream")
+    req, res = await sanic_app.asgi_client.post(
+        f"{version}/history/other/_logs?execid=exec1",
+        content=gzip.compress(b"logs"),
+        headers={"Authorization": f"Bearer {access_token}"},
+    )
+
+    assert res.status_code == 404
+    assert not put_stream.called
+
+
 def test_history_mg_select():
     stmt = history_mg.select_history()
     assert "nb_history" in str(stmt)
@@ -114,3 +160,112 @@ async def test_history_mg_create(async_session):
     assert isinstance(model_ok, HistoryModel)
     assert model_err.status == -1
     assert model_ok.status == 0
+
+
+@pytest.mark.asyncio
+async def test_history_mg_set_logs_path(async_session):
+    exec_ok = ExecutionResultFactory(error=False, logs_path=None)
+    await history_mg.create(async_session, exec_ok)
+
+    other = await history_mg.set_logs_path(
+        async_session, "other", exec_ok.execid, "outputs/logs/y.log.gz"
+    )
+    updated = await history_mg.set_logs_path(
+        async_session, exec_ok.projectid, exec_ok.execid, "outputs/logs/x.log.gz"
+    )
+    missing = await history_mg.set_logs_path(
+        async_session, exec_ok.projectid, "missing", "x"
+    )
+    row = await history_mg.get_one(async_session, exec_ok.execid)
+
+    assert other == 0
+    assert updated == 1
+    assert missing == 0
+    assert row.result.logs_path == "outputs/logs/x.log.gz"
+
+
+def test_history_client_nb_output(tempdir):
+    result = ExecutionResultFactory(output_dir=tempdir, output_name="nb.ipynb")
+    with open(f"{tempdir}/nb.ipynb", "wb") as f:
+        f.write(b"{}" * 1000)
+    requests = []
+
+    def handler(request: httpx.Request):
+        requests.append(request)
+        return httpx.Response(201, json={"msg": "OK"})
+
+    client = HistoryClient(url_service="http://localhost:8000")
+    client._http = httpx.Client(
+        base_url="http://localhost:8000", transport=httpx.MockTransport(handler)
+    )
+
+    assert client.history_nb_output(result)
+    req = requests[0]
+    assert req.url.path == f"/history/{result.projectid}/_output"
+    assert req.url.params["status"] == "ok"
+    assert req.headers["content-encoding"] == "gzip"
+    assert gzip.decompress(req.read()) == b"{}" * 1000
+
+
+def test_history_client_checkpoint():
+    requests = []
+
+    def handler(request: httpx.Request):
+        requests.append(request)
+        if request.method == "POST":
+            return httpx.Response(201, json={"msg": "OK"})
+        return httpx.Response(404, json={"msg": "not found"})
+
+    client = HistoryClient(url_service="http://localhost:8000")
+    client._http = httpx.Client(
+        base_url="http://localhost:8000", transport=httpx.MockTransport(handler)
+    )
+
+    assert client.history_checkpoint("prj", "exec1", '{"cells": []}')
+    assert client.history_get_checkpoint("prj", "exec1") is None
+    req = requests[0]
+    assert req.url.path == "/history/prj/_checkpoints/exec1"
+    assert gzip.decompress(req.read()) == b'{"cells": []}'
+
+
+@pytest.mark.asyncio
+async def test_history_decompress_reader():
+    data = b"output notebook" * 1000
+
+    async def body():
+        compressed = gzip.compress(data)
+        for i in range(0, len(compressed), 100):
+            yield compressed[i : i + 100]
+
+    chunks = [c async for c in decompress_reader(body(), decompressor("gzip"))]
+
+    assert b"".join(chunks) == data
+
+
+@pytest.mark.asyncio
+async def test_history_decompress_reader_bomb():
+    bomb = gzip.compress(b"\0" * 10 * defaults.UPLOAD_CHUNK_SIZE)
+
+    async def body():
+        yield bomb
+
+    max_size = 3 * defaults.UPLOAD_CHUNK_SIZE
+    reader = decompress_reader(body(), decompressor("gzip"), max_size=max_size)
+    sizes = []
+    with pytest.raises(UploadTooLarge):
+        async for chunk in reader:
+            sizes.append(len(chunk))
+
+    # a small body is decompressed in bounded blocks
+    assert len(bomb) < defaults.UPLOAD_CHUNK_SIZE
+    assert max(sizes) == defaults.UPLOAD_CHUNK_SIZE
+    assert sum(sizes) == max_size
+
+
+def test_history_decompress_blocks():
+    data = os.urandom(1000) * 300
+    decomp = decompressor("gzip")
+    blocks = list(decompress_blocks(decomp, gzip.compress(data), 4096))
+
+    assert all(len(b) <= 4096 for b in blocks)
+    assert b"".join(blocks) + decomp.flush() == data
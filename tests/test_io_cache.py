@@ -0,0 +1,194 @@
+import pickle
+
+from labfunctions.io import cache
+from labfunctions.io.kv_local import KVLocal
+
+
+class Blob:
+    """Like a numpy array, its data is pickled out of band"""
+
+    def __init__(self, data):
+        self.data = data
+
+    def __reduce_ex__(self, protocol):
+        return Blob, (pickle.PickleBuffer(self.data),)
+
+
+def _tiered(tmp_path, **kwargs):
+    disk = cache.DiskTier(root=str(tmp_path / "disk"), **kwargs)
+    kv = cache.KVTier(KVLocal("cache", {"root": str(tmp_path / "kv")}))
+    return cache.TieredCache(cache.MemoryTier(), disk, kv), disk, kv
+
+
+def test_io_cache_key():
+    def f(x):
+        return x
+
+    ident = cache.func_identity(f)
+    k1 = cache.cache_key(ident, (1,), {"a": 1}, namespace="wf")
+    k2 = cache.cache_key(ident, (1,), {"a": 1}, namespace="wf")
+    k3 = cache.cache_key(ident, (2,), {"a": 1}, namespace="wf")
+
+    assert k1 == k2
+    assert k1 != k3
+    assert k1.startswith("wf/")
+
+
+def test_io_cache_frozen_result_new_execution(tmp_path):
+    tiered, _, _ = _tiered(tmp_path)
+    calls = []
+
+    def my_func(msg):
+        calls.append(msg)
+        return msg * 2
+
+    f1 = cache.frozen_result(wfid="wf", execid="exec1", cache=tiered)(my_func)
+    f2 = cache.frozen_result(wfid="wf", execid="exec2", cache=tiered)(my_func)
+
+    assert f1("hi") == "hihi"
+    assert f2("hi") == "hihi"
+    assert f2("bye") == "byebye"
+    assert calls == ["hi", "bye"]
+
+
+def test_io_cache_frozen_result_falsy(tmp_path):
+    tiered, _, _ = _tiered(tmp_path)
+    calls = []
+
+    @cache.frozen_result(wfid="wf", cache=tiered)
+    def empty():
+        calls.append(1)
+        return []
+
+    assert empty() == []
+    assert empty() == []
+    assert len(calls) == 1
+
+
+def test_io_cache_memory_hit_same_instance(tmp_path):
+    tiered, _, _ = _tiered(tmp_path)
+
+    @cache.frozen_result(wfid="wf", cache=tiered)
+    def items():
+        return [1]
+
+    first = items()
+    first.append(2)
+    # documented: a hit in memory is not a copy
+    assert items() is first
+    tiered.memory.clear()
+    assert items() == [1]
+
+
+def test_io_cache_tiers(tmp_path, mocker):
+    tiered, disk, kv = _tiered(tmp_path)
+    tiered.put("wf/k", {"a": 1})
+    loads = mocker.spy(cache.pickle, "loads")
+
+    assert tiered.get("wf/k") == {"a": 1}
+    assert loads.call_count == 0
+
+    # another process: only the disk and the kv store
+    other = cache.TieredCache(cache.MemoryTier(), disk, kv)
+    assert other.get("wf/k") == {"a": 1}
+    assert loads.call_count == 1
+
+    # another machine: the kv hit is copied to its disk
+    disk2 = cache.DiskTier(root=str(tmp_path / "disk2"))
+    remote = cache.TieredCache(cache.MemoryTier(), disk2, kv)
+    assert remote.get("wf/k") == {"a": 1}
+    assert disk2.get("wf/k") is not None
+
+
+def test_io_cache_ttl(tmp_path, mocker):
+    tiered, _, _ = _tiered(tmp_path)
+    tiered.put("wf/k", 1)
+    now = cache.time.time()
+    mocker.patch("labfunctions.io.cache.time.time", return_value=now + 120)
+
+    assert tiered.get("wf/k", ttl=60) is cache._MISS
+    assert tiered.get("wf/k", ttl=None) == 1
+
+
+def test_io_cache_memory_eviction():
+    mem = cache.MemoryTier(max_bytes=100)
+    mem.put("a", 1, 40, 0)
+    mem.put("b", 2, 40, 0)
+    mem.get("a")
+    mem.put("c", 3, 40, 0)
+
+    assert mem.get("b") is cache._MISS
+    assert mem.get("a") == 1
+    assert mem.used == 80
+
+
+def test_io_cache_disk_eviction(tmp_path):
+    disk = cache.DiskTier(root=str(tmp_path), max_bytes=2500)
+    disk.put("wf/a", [b"0" * 1000])
+    disk.put("wf/b", [b"0" * 1000])
+    cache.os.utime(disk.path("wf/a"), (1, 1))
+    cache.os.utime(disk.path("wf/b"), (2, 2))
+    disk.get("wf/a")
+    disk.put("wf/c", [b"0" * 1000])
+
+    assert disk.get("wf/b") is None
+    assert disk.get("wf/a") is not None
+    assert disk.get("wf/c") is not None
+
+
+def test_io_cache_out_of_band(tmp_path):
+    tiered, disk, kv = _tiered(tmp_path)
+    tiered.put("wf/k", {"blob": Blob(bytearray(b"x" * 1000)), "n": 1})
+    raw = disk.get("wf/k")
+
+    assert raw.find(b"x" * 1000) % cache._ALIGN == 0
+
+    other = cache.TieredCache(cache.MemoryTier(), disk)
+    result = other.get("wf/k")
+    # a view of the mapped file, writable without changing it
+    view = result["blob"].data
+    assert isinstance(view.obj, cache.mmap.mmap)
+    assert view.tobytes() == b"x" * 1000
+    view[0] = ord("y")
+    assert other.tiers[0].get("wf/k").find(b"x" * 1000) > 0
+
+
+def test_io_cache_kv_streamed_to_disk(tmp_path):
+    _, _, kv = _tiered(tmp_path)
+    writer = cache.TieredCache(None, kv)
+    writer.put("wf/k", Blob(bytearray(b"x" * 1000)))
+
+    disk = cache.DiskTier(root=str(tmp_path / "disk2"))
+    reader = cache.TieredCache(cache.MemoryTier(), disk, kv)
+    result = reader.get("wf/k")
+
+    assert memoryview(result.data).tobytes() == b"x" * 1000
+    assert disk.get("wf/k") is not None
+    assert reader.get("wf/missing") is cache._MISS
+    assert not list((tmp_path / "disk2" / "wf").glob(".*"))
+
+
+def test_io_cache_invalid_entry(tmp_path):
+    tiered, disk, _ = _tiered(tmp_path)
+    disk.put("wf/k", [b"<html>not found</html>"])
+
+    assert tiered.get("wf/k") is cache._MISS
+    assert disk.get("wf/k") is None
+
+
+def test_io_cache_kv_larger_than_disk(tmp_path, mocker):
+    _, _, kv = _tiered(tmp_path)
+    writer = cache.TieredCache(None, kv)
+    writer.put("wf/k", Blob(bytearray(b"x" * 10_000)))
+    get_stream = mocker.spy(kv, "get_stream")
+
+    disk = cache.DiskTier(root=str(tmp_path / "small"), max_bytes=1000)
+    reader = cache.TieredCache(cache.MemoryTier(), disk, kv)
+    result = reader.get("wf/k")
+
+    assert memoryview(result.data).tobytes() == b"x" * 10_000
+    assert disk.get("wf/k") is None
+    assert get_stream.call_count == 1
+    # the memory tier keeps it for the next calls
+    assert reader.get("wf/k") is result
+    assert not list((tmp_path / "small" / "wf").iterdir())
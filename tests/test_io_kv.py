@@ -1,10 +1,19 @@
+import base64
+import hashlib
+import json
+import os
 import tempfile
 from io import BytesIO
+from urllib.parse import unquote
 
+import httpx
 import pytest
 
+from labfunctions.io import kv_files, transfer
+from labfunctions.io.kv_files import AsyncKVFiles, KVFiles
+from labfunctions.io.kv_gcs import AsyncKVGS
 from labfunctions.io.kv_local import AsyncKVLocal, KVLocal
-from labfunctions.io.kvspec import AsyncKVSpec, GenericKVSpec
+from labfunctions.io.kvspec import AsyncKVSpec, GenericKVSpec, KeyReadError
 
 
 def write_stream():
@@ -63,3 +72,261 @@ async def test_io_kv_local_async_stream_rw():
         value = obj.getvalue().decode()
 
     assert "0" in value
+
+
+@pytest.mark.asyncio
+async def test_io_kv_files_async_pooled(mocker):
+    data = {}
+
+    def handler(request: httpx.Request):
+        if request.method == "PUT":
+            data[request.url.path] = request.read()
+            return httpx.Response(201)
+        return httpx.Response(200, content=data[request.url.path])
+
+    clients = []
+    AsyncClient = httpx.AsyncClient
+
+    def create_client(**kwargs):
+        client = AsyncClient(transport=httpx.MockTransport(handler), **kwargs)
+        clients.append(kwargs)
+        return client
+
+    mocker.patch.object(kv_files.httpx, "AsyncClient", side_effect=create_client)
+    kv = AsyncKVFiles("test", {"url": "http://fileserver", "max_connections": 4})
+    for x in range(5):
+        await kv.put(f"k{x}", b"hello")
+
+    async def async_stream():
+        for chunk in write_stream():
+            yield chunk
+
+    await kv.put_stream("stream", async_stream())
+    res = await kv.get("k1")
+    chunks = [c async for c in kv.get_stream("stream")]
+    await kv.close()
+
+    assert res == b"hello"
+    assert b"".join(chunks) == b"0123456789"
+    assert len(clients) == 1
+    assert clients[0]["limits"].max_connections == 4
+    assert kv._client is None
+
+
+class FakeGCS:
+    """Stand-in of the JSON api of google storage"""
+
+    def __init__(self, fail_chunks=0):
+        self.objects = {}
+        self.sessions = {}
+        self.ranges = 0
+        self.fail_chunks = fail_chunks
+        self.composed = set()
+
+    def upload(self, request: httpx.Request):
+        params = request.url.params
+        if params["uploadType"] == "media":
+            data = request.read()
+            self.objects[params["name"]] = data
+            md5 = base64.b64encode(hashlib.md5(data).digest()).decode()
+            return httpx.Response(200, json={"md5Hash": md5, "size": str(len(data))})
+        sid = str(len(self.sessions))
+        self.sessions[sid] = (params["name"], bytearray())
+        return httpx.Response(200, headers={"Location": f"http://gcs/session/{sid}"})
+
+    def chunk(self, request: httpx.Request):
+        name, data = self.sessions[request.url.path.rsplit("/", 1)[1]]
+        spec, total = request.headers["Content-Range"][len("bytes ") :].split("/")
+        if spec != "*":
+            body = request.read()
+            assert int(spec.split("-")[0]) == len(data)
+            if self.fail_chunks:
+                # it stores a part of the chunk and fails
+                self.fail_chunks -= 1
+                data += body[: 256 * 1024]
+                return httpx.Response(503)
+            data += body
+        if total != "*" and len(data) == int(total):
+            self.objects[name] = bytes(data)
+            return httpx.Response(200, json={})
+        headers = {"Range": f"bytes=0-{len(data) - 1}"} if data else {}
+        return httpx.Response(308, headers=headers)
+
+    def _name(self, request: httpx.Request) -> str:
+        path = request.url.raw_path.decode().split("?")[0]
+        return unquote(path.split("/o/")[1].split("/")[0])
+
+    def compose(self, request: httpx.Request):
+        sources = json.loads(request.read())["sourceObjects"]
+        data = b"".join(self.objects[s["name"]] for s in sources)
+        name = self._name(request)
+        self.objects[name] = data
+        self.composed.add(name)
+        return httpx.Response(200, json={"size": str(len(data))})
+
+    def download(self, request: httpx.Request):
+        name = self._name(request)
+        obj = self.objects.get(name)
+        if obj is None:
+            return httpx.Response(404)
+        headers = {"x-goog-generation": "1"}
+        if name not in self.composed:
+            md5 = base64.b64encode(hashlib.md5(obj).digest()).decode()
+            headers["x-goog-hash"] = f"crc32c=AAAAAA==,md5={md5}"
+        _range = request.headers.get("Range")
+        if not _range:
+            return httpx.Response(200, content=obj, headers=headers)
+        if not obj:
+            return httpx.Response(416)
+        self.ranges += 1
+        start, end = map(int, _range[len("bytes=") :].split("-"))
+        end = min(end, len(obj) - 1)
+        headers["Content-Range"] = f"bytes {start}-{end}/{len(obj)}"
+        return httpx.Response(206, content=obj[start : end + 1], headers=headers)
+
+    def __call__(self, request: httpx.Request):
+        if request.method == "POST" and request.url.path.endswith("/compose"):
+            return self.compose(request)
+        if request.method == "POST":
+            return self.upload(request)
+        if request.method == "PUT":
+            return self.chunk(request)
+        if request.method == "DELETE":
+            self.objects.pop(self._name(request), None)
+            return httpx.Response(204)
+        return self.download(request)
+
+
+def _gcs(mocker, fake: FakeGCS) -> AsyncKVGS:
+    mocker.patch.object(AsyncKVGS, "_backoff")
+    kv = AsyncKVGS(
+        "test",
+        {"endpoint": "http://gcs", "anonymous": True, "chunk_size": 256 * 1024},
+    )
+    kv._client = httpx.AsyncClient(transport=httpx.MockTransport(fake))
+    return kv
+
+
+@pytest.mark.asyncio
+async def test_io_kv_gcs_async_rw(mocker):
+    fake = FakeGCS()
+    kv = _gcs(mocker, fake)
+    await kv.put("dir/test", b"hello world")
+    res = await kv.get("dir/test")
+
+    assert res == b"hello world"
+    assert fake.objects["dir/test"] == b"hello world"
+    with pytest.raises(KeyReadError):
+        await kv.get("missing")
+    await kv.close()
+
+
+@pytest.mark.asyncio
+async def test_io_kv_gcs_async_stream_rw(mocker):
+    fake = FakeGCS(fail_chunks=1)
+    kv = _gcs(mocker, fake)
+    kv.parallel = 2
+    data = bytes(range(256)) * 4 * 1024 + b"end"  # 4 chunks and a bit
+
+    async def stream():
+        for i in range(0, len(data), 100_000):
+            yield data[i : i + 100_000]
+
+    ok = await kv.put_stream("big", stream())
+    chunks = [c async for c in kv.get_stream("big")]
+
+    assert ok
+    assert fake.objects["big"] == data
+    assert b"".join(chunks) == data
+    assert fake.ranges == 5
+
+    await kv.put_stream("empty", stream_empty())
+    assert [c async for c in kv.get_stream("empty")] == []
+    with pytest.raises(KeyReadError):
+        [c async for c in kv.get_stream("missing")]
+
+
+async def stream_empty():
+    for _ in []:
+        yield b""
+
+
+def test_io_kv_local_file_rw(tmp_path):
+    src = tmp_path / "src.zip"
+    src.write_bytes(os.urandom(100_000))
+    kv = KVLocal("test", {"root": str(tmp_path / "store")})
+    kv.put_file("dir/test.zip", str(src))
+    kv.get_file("dir/test.zip", str(tmp_path / "dst.zip"))
+
+    assert (tmp_path / "dst.zip").read_bytes() == src.read_bytes()
+    with pytest.raises(KeyReadError):
+        kv.get_file("missing", str(tmp_path / "missing.zip"))
+    assert not list(tmp_path.glob("*.part"))
+
+
+@pytest.mark.asyncio
+async def test_io_kv_local_async_file_rw(tmp_path):
+    src = tmp_path / "src.zip"
+    src.write_bytes(os.urandom(100_000))
+    kv = AsyncKVLocal("test", {"root": str(tmp_path / "store")})
+    await kv.put_file("dir/test.zip", str(src))
+    await kv.get_file("dir/test.zip", str(tmp_path / "dst.zip"))
+
+    assert (tmp_path / "dst.zip").read_bytes() == src.read_bytes()
+
+
+def test_io_kv_transfer_incomplete_part(tmp_path):
+    dst = tmp_path / "dst"
+    dst.write_bytes(b"previous")
+
+    def fetch(part):
+        return b"x" * (part[1] - part[0])
+
+    with pytest.raises(ValueError):
+        transfer.download_parts(fetch, 100, str(dst), part_size=10)
+    assert dst.read_bytes() == b"previous"
+    assert not list(tmp_path.glob("*.part"))
+
+
+def test_io_kv_files_get_file_ranges(tmp_path):
+    data = os.urandom(100_000)
+    ranges = []
+
+    def handler(request: httpx.Request):
+        start, end = map(int, request.headers["Range"][len("bytes=") :].split("-"))
+        ranges.append(start)
+        end = min(end, len(data) - 1)
+        headers = {"Content-Range": f"bytes {start}-{end}/{len(data)}"}
+        return httpx.Response(206, content=data[start : end + 1], headers=headers)
+
+    kv = KVFiles("test", {"url": "http://fileserver"})
+    kv._client = httpx.Client(transport=httpx.MockTransport(handler))
+    kv.get_file("test.zip", str(tmp_path / "dst.zip"), parallel=3, part_size=16_384)
+
+    assert (tmp_path / "dst.zip").read_bytes() == data
+    assert sorted(ranges) == list(range(0, len(data), 16_384))
+
+
+@pytest.mark.asyncio
+async def test_io_kv_gcs_async_file_rw(mocker, tmp_path):
+    fake = FakeGCS()
+    kv = _gcs(mocker, fake)
+    src = tmp_path / "src.zip"
+    src.write_bytes(os.urandom(1_000_000))
+
+    ok = await kv.put_file("test.zip", str(src), parallel=2, part_size=256 * 1024)
+    await kv.get_file("test.zip", str(tmp_path / "dst.zip"), part_size=256 * 1024)
+
+    assert ok
+    assert "test.zip" in fake.composed
+    assert list(fake.objects) == ["test.zip"]
+    assert (tmp_path / "dst.zip").read_bytes() == src.read_bytes()
+
+    # checked with the md5 of the object
+    fake.objects["small"] = b"hello"
+    await kv.get_file("small", str(tmp_path / "small"))
+    mocker.patch.object(transfer, "file_md5", return_value=b"other")
+    with pytest.raises(KeyReadError):
+        await kv.get_file("small", str(tmp_path / "small3"))
+    assert (tmp_path / "small").read_bytes() == b"hello"
+    assert not (tmp_path / "small3").exists()
@@ -1,4 +1,4 @@
-from labfunctions.io import MemoryStore
+from labfunctions.io import MemoryStore, TTLCache
 
 
 def test_io_memory_store():
@@ -9,3 +9,30 @@ def test_io_memory_store():
 
     assert id(ms) == id(ms2)
     assert ms["test"] == ms2["test"]
+
+
+def test_io_memory_ttl_cache(mocker):
+    cache = TTLCache(maxsize=2, ttl=10)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 1
+
+    mocker.patch("labfunctions.io.memory_store.time.monotonic", return_value=1e12)
+    assert cache.get("a") is None
+    assert len(cache) == 1
+
+
+def test_io_memory_ttl_cache_delete_where():
+    cache = TTLCache(maxsize=10)
+    cache.set(("rt", "p1", "a"), 1)
+    cache.set(("rt", "p2", "a"), 2)
+    removed = cache.delete_where(lambda k: k[1] == "p1")
+
+    assert removed == 1
+    assert ("rt", "p2", "a") in cache
@@ -0,0 +1,177 @@
+import base64
+import shutil
+
+import nbformat
+
+from labfunctions import defaults
+from labfunctions.notebooks import utils
+from labfunctions.notebooks.checkpoint import (
+    restore_skipped,
+    resume_point,
+    skip_completed,
+)
+from labfunctions.notebooks.slim import slim_notebook
+from labfunctions.types import SlimOptions
+
+
+def test_notebooks_read_cached(tempdir):
+    path = f"{tempdir}/workflow.ipynb"
+    shutil.copy("tests/workflow.ipynb", path)
+    hits = utils._notebooks.hits
+
+    first = utils.read_notebook(path)
+    first.cells[0].metadata["tags"] = ["changed"]
+    second = utils.read_notebook(path)
+
+    assert utils._notebooks.hits == hits + 1
+    assert second.cells[0].metadata.get("tags") != ["changed"]
+
+    second.cells = second.cells[:1]
+    nbformat.write(second, path)
+    third = utils.read_notebook(path)
+
+    assert len(third.cells) == 1
+
+
+def test_notebooks_clean_output(tempdir):
+    path = f"{tempdir}/workflow.ipynb"
+    nb = nbformat.v4.new_notebook()
+    nb.cells = [
+        nbformat.v4.new_code_cell(
+            "print(1)", outputs=[nbformat.v4.new_output("stream", text="1\n")]
+        )
+    ]
+    nbformat.write(nb, path)
+
+    exported, _ = utils.clean_output(path)
+    cached = utils.read_notebook(path)
+
+    assert nbformat.reads(exported, as_version=4).cells[0].outputs == []
+    assert cached.cells[0].outputs[0].text == "1\n"
+
+
+def _output_nb():
+    image = base64.b64encode(b"\x89PNG" + b"0" * 20_000).decode()
+    nb = nbformat.v4.new_notebook()
+    nb.cells = [
+        nbformat.v4.new_code_cell(
+            "train()",
+            outputs=[
+                nbformat.v4.new_output("stream", text="epoch 1\r"),
+                nbformat.v4.new_output("stream", text="epoch 2\rdone\n"),
+                nbformat.v4.new_output("stream", text="x" * 100),
+            ],
+        ),
+        nbformat.v4.new_code_cell(
+            "plot()",
+            outputs=[
+                nbformat.v4.new_output("display_data", data={"image/png": image}),
+                nbformat.v4.new_output("display_data", data={"image/png": image}),
+            ],
+        ),
+    ]
+    return nb
+
+
+def test_notebooks_slim():
+    opts = SlimOptions(stream_tail=50, externalize_images=True)
+
+    exported, blobs = slim_notebook(_output_nb(), opts)
+    nb = nbformat.reads(exported, as_version=4)
+    stream, plot = nb.cells[0].outputs, nb.cells[1].outputs
+    blob = list(blobs)[0]
+
+    assert len(stream) == 1
+    assert stream[0].text.startswith("[... 55 chars truncated ...]\n")
+    assert stream[0].text.endswith("x" * 50)
+    assert "epoch" not in stream[0].text
+    assert len(plot) == 1
+    assert "image/png" not in plot[0].data
+    assert plot[0].metadata.labfunctions["image/png"] == blob
+    assert blob.startswith(f"{defaults.SLIM_BLOBS_DIR}/")
+    assert blobs[blob].startswith(b"\x89PNG")
+    assert len(exported) < 1000
+
+
+def test_notebooks_slim_defaults():
+    exported, blobs = slim_notebook(_output_nb(), SlimOptions())
+    nb = nbformat.reads(exported, as_version=4)
+
+    assert blobs == {}
+    assert "image/png" in nb.cells[1].outputs[0].data
+    assert nb.cells[0].outputs[0].text == "done\n" + "x" * 100
+
+
+def _checkpoint_nb(statuses):
+    nb = nbformat.v4.new_notebook()
+    sources = ["import os", "X = 1", "load()", "train()", "report()"]
+    nb.cells = [nbformat.v4.new_code_cell(s) for s in sources]
+    nb.cells[0].metadata["tags"] = ["setup"]
+    nb.cells[1].metadata["tags"] = ["injected-parameters"]
+    nb.cells[2].metadata["tags"] = ["checkpoint"]
+    nb.cells[3].metadata["tags"] = ["checkpoint"]
+    for cell, status in zip(nb.cells, statuses):
+        cell.metadata["papermill"] = {"status": status}
+        cell.outputs = [nbformat.v4.new_output("stream", text=cell.source)]
+    return nb
+
+
+def test_notebooks_checkpoint_resume():
+    done = "completed"
+    checkpoint = _checkpoint_nb([done, done, done, "failed", "pending"])
+    nb = _checkpoint_nb([None] * 5)
+    for cell in nb.cells:
+        cell.outputs = []
+
+    skipped = skip_completed(nb, checkpoint)
+
+    assert resume_point(nb, checkpoint) == 2
+    assert list(skipped) == [2]
+    assert "skip-execution" in nb.cells[2].metadata.tags
+    assert "skip-execution" not in nb.cells[0].metadata.tags
+
+    restore_skipped(nb, skipped)
+
+    assert nb.cells[2].metadata.tags == ["checkpoint"]
+    assert nb.cells[2].outputs[0].text == "load()"
+    assert nb.metadata.labfunctions["resumed_at"] == 2
+
+
+def test_notebooks_checkpoint_changed():
+    checkpoint = _checkpoint_nb(["completed"] * 5)
+    nb = _checkpoint_nb([None] * 5)
+    nb.cells[1].source = "X = 2"
+
+    assert resume_point(nb, checkpoint) == -1
+    assert skip_completed(nb, checkpoint) == {}
+
+
+def test_notebooks_execute_parsed_once(tempdir, mocker):
+    nb = nbformat.v4.new_notebook()
+    params = nbformat.v4.new_code_cell("X = 0")
+    params.metadata["tags"] = ["parameters"]
+    nb.cells = [params, nbformat.v4.new_code_cell("open('x.txt', 'w').write(str(X))")]
+    nb.metadata["kernelspec"] = {
+        "name": "python3",
+        "display_name": "Python 3",
+        "language": "python",
+    }
+    path = f"{tempdir}/in_once.ipynb"
+    nbformat.write(nb, path)
+    read = mocker.spy(nbformat, "read")
+
+    for x in (1, 2):
+        out = utils.execute_notebook(
+            path,
+            f"{tempdir}/out_{{X}}.ipynb",
+            parameters={"X": x},
+            cwd=tempdir,
+            progress_bar=False,
+        )
+
+    # papermill gets the notebook read once, not its path
+    assert read.call_count == 1
+    assert out.metadata["papermill"]["parameters"] == {"X": 2}
+    assert out.metadata["papermill"]["input_path"] == path
+    assert open(f"{tempdir}/x.txt").read() == "2"
+    assert nbformat.read(f"{tempdir}/out_1.ipynb", as_version=4)
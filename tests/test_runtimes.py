@@ -2,6 +2,7 @@ from pathlib import Path
 
 import pytest
 
+from labfunctions import defaults
 from labfunctions.defaults import API_VERSION
 from labfunctions.managers import runtimes_mg
 from labfunctions.runtimes import generate_dockerfile
@@ -74,6 +75,29 @@ async def test_runtimes_bp_create(async_session, sanic_app, access_token, mocker
     assert res2.status_code == 200
 
 
+@pytest.mark.asyncio
+async def test_runtimes_bp_events(async_session, sanic_app, access_token, mocker):
+    """The agents only listen for runtime events in the queue redis"""
+    rq = RuntimeReqFactory()
+    sanic_app.ctx.queue_redis = mocker.AsyncMock()
+    mocker.patch("labfunctions.web.runtimes_bp.runtimes_mg.create", return_value=True)
+    mocker.patch(
+        "labfunctions.web.runtimes_bp.runtimes_mg.delete_by_rid", return_value=None
+    )
+    await sanic_app.asgi_client.post(
+        f"{version}/runtimes/test",
+        headers={"Authorization": f"Bearer {access_token}"},
+        json=rq.dict(),
+    )
+    await sanic_app.asgi_client.delete(
+        f"{version}/runtimes/test/{rq.runtime_name}",
+        headers={"Authorization": f"Bearer {access_token}"},
+    )
+    published = sanic_app.ctx.queue_redis.publish.call_args_list
+
+    assert [c[0][0] for c in published] == [defaults.RUNTIMES_CHANNEL] * 2
+
+
 @pytest.mark.asyncio
 async def test_runtimes_bp_list(async_session, sanic_app, access_token, mocker):
     runtimes = RuntimeDataFactory.create_batch(size=5)
@@ -102,6 +126,20 @@ async def test_runtimes_bp_delete(async_session, sanic_app, access_token, mocker
     assert res.status_code == 200
 
 
+@pytest.mark.asyncio
+async def test_runtimes_mg_cache(async_session):
+    rows = await runtimes_mg.get_list(async_session, "test")
+    runtimes_mg.init_cache(10, 60)
+    rd = await runtimes_mg.get_by_rid(async_session, rows[0].runtimeid)
+    rd2 = await runtimes_mg.get_by_rid(async_session, rows[0].runtimeid)
+    stats = runtimes_mg.cache_stats()
+    runtimes_mg.invalidate_cache("test")
+
+    assert rd is rd2
+    assert stats["hits"] == 1
+    assert runtimes_mg.cache_stats()["size"] == 0
+
+
 def test_runtimes_dockerfile(tempdir):
     spec = RuntimeSpecFactory()
     generate_dockerfile(Path(tempdir), spec)
@@ -1,5 +1,8 @@
+import pytest
+
+from labfunctions import defaults
 from labfunctions.models import ProjectModel
-from labfunctions.types import NBTask, ProjectData, ScheduleData
+from labfunctions.types import NBTask, NBTaskBatch, ProjectData, ScheduleData
 from labfunctions.types.user import UserOrm
 
 from .factories import (
@@ -43,3 +46,16 @@ def test_types_user_serialization():
 #     dict_ = nb.dict()
 #     task = NBTask(**dict_)
 #     assert isinstance(task.schedule, ScheduleData)
+
+
+def test_types_schedule_concurrency():
+    with pytest.raises(ValueError):
+        ScheduleData(concurrency="never")
+    assert ScheduleData().concurrency == defaults.WF_CONCURRENCY_ALLOW
+
+
+def test_types_batch_max_tasks():
+    task = NBTaskFactory()
+    NBTaskBatch(tasks=[task] * defaults.BATCH_MAX_TASKS)
+    with pytest.raises(ValueError):
+        NBTaskBatch(tasks=[task] * (defaults.BATCH_MAX_TASKS + 1))
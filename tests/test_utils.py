@@ -1,3 +1,4 @@
+import gzip
 import logging
 from pathlib import Path
 from tempfile import TemporaryDirectory
@@ -113,3 +114,19 @@ def test_utils_get_version():
 def test_utils_pkg_route():
     here = utils.pkg_route()
     assert here.endswith("labfunctions")
+
+
+def test_utils_compressed_file_reader():
+    fp = f"{tmp_dir.name}/compress.txt"
+    data = b"hello world\n" * 10_000
+    with open(fp, "wb") as f:
+        f.write(data)
+
+    chunks = list(utils.compressed_file_reader(fp, chunk_size=4096))
+    decomp = utils.decompressor("gzip")
+
+    assert gzip.decompress(b"".join(chunks)) == data
+    assert b"".join(decomp.decompress(c) for c in chunks) == data
+    assert utils.decompressor("identity") is None
+    with pytest.raises(ValueError):
+        utils.decompressor("br")
@@ -0,0 +1,24 @@
+import pytest
+from pytest_mock import MockerFixture
+
+from labfunctions import defaults
+from labfunctions.defaults import API_VERSION
+
+from .factories import NBTaskFactory
+
+version = API_VERSION
+
+
+@pytest.mark.asyncio
+async def test_workflows_bp_run_batch_too_large(
+    async_session, sanic_app, async_redis_web, access_token, mocker: MockerFixture
+):
+    scheduler = mocker.patch("labfunctions.web.workflows_bp.get_scheduler2")
+    task = NBTaskFactory().dict()
+    req, res = await sanic_app.asgi_client.post(
+        f"{version}/workflows/test/notebooks/_run_batch",
+        json={"tasks": [task] * (defaults.BATCH_MAX_TASKS + 1)},
+        headers={"Authorization": f"Bearer {access_token}"},
+    )
+    assert res.status_code == 422
+    assert not scheduler.called